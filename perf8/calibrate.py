@@ -0,0 +1,193 @@
+#
+# Licensed to Elasticsearch B.V. under one or more contributor
+# license agreements. See the NOTICE file distributed with
+# this work for additional information regarding copyright
+# ownership. Elasticsearch B.V. licenses this file to you under
+# the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# 	http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+"""
+Calibrate -- measures what each plugin costs the command.
+
+With --calibrate the command is run with no plugin, the baseline, and
+with each enabled plugin or each --calibrate-set, --calibrate-runs
+times. The runs of the configurations are interleaved so a change of
+the load of the machine affects all of them. The runner measures the
+wall time, CPU time and peak RSS of the command itself, see
+perf8.runner, so perf8 startup and reports are left out.
+
+Results are in <target_dir>/calibration.json and calibration.html.
+"""
+
+import argparse
+import asyncio
+import datetime
+import json
+import os
+
+import humanize
+from jinja2 import Environment, FileSystemLoader
+
+from perf8 import __version__
+from perf8 import stats
+from perf8.logger import logger
+from perf8.plugins.base import get_registered_plugins
+from perf8.watcher import WatchedProcess
+
+HERE = os.path.dirname(__file__)
+BASELINE = "baseline"
+
+# (key in the runner measures, label, unit)
+METRICS = (
+    ("wall", "Wall time", "s"),
+    ("cpu", "CPU time", "s"),
+    ("peak_rss", "Peak RSS", "bytes"),
+)
+
+
+def _flag(name):
+    return name.replace("-", "_")
+
+
+def calibration_sets(args):
+    """Returns the sets of plugins to compare to the baseline."""
+    known = {plugin.name for plugin in get_registered_plugins()}
+    if args.calibrate_set:
+        sets = [
+            [name.strip() for name in value.split(",") if name.strip()]
+            for value in args.calibrate_set
+        ]
+    else:
+        sets = [
+            [plugin.name]
+            for plugin in get_registered_plugins()
+            if getattr(args, _flag(plugin.name), False)
+        ]
+    if not sets:
+        raise ValueError("Enable some plugins or use --calibrate-set")
+
+    for plugins in sets:
+        for name in plugins:
+            if name not in known:
+                raise ValueError(f"Unknown plugin {name}")
+        if "memray" in plugins and "cprofile" in plugins:
+            raise ValueError("You can't use --memray and --cprofile at the same time")
+    return sets
+
+
+def _run_args(args, plugins, target_dir):
+    run_args = argparse.Namespace(**vars(args))
+    for plugin in get_registered_plugins():
+        setattr(run_args, _flag(plugin.name), plugin.name in plugins)
+    run_args.target_dir = target_dir
+    run_args.calibrate = False
+    run_args.live_port = None
+    run_args.daemon = False
+    return run_args
+
+
+async def _run(run_args):
+    watcher = WatchedProcess(run_args)
+    await watcher.run()
+    return watcher.execution_info["command"]
+
+
+def summarize(samples, threshold):
+    """Summarizes the runs of each configuration against the baseline.
+
+    A set of plugins is safe when the upper bound of the confidence
+    interval of its wall time overhead is below `threshold` percent.
+    """
+    baseline = samples[BASELINE]
+    results = []
+    for name, runs in samples.items():
+        result = {"name": name, "runs": runs, "metrics": {}}
+        for metric, _, _ in METRICS:
+            values = [run[metric] for run in runs]
+            summary = stats.summarize(values)
+            if name != BASELINE:
+                summary["delta"] = stats.compare(
+                    [run[metric] for run in baseline], values
+                )
+            result["metrics"][metric] = summary
+        if name != BASELINE:
+            high = result["metrics"]["wall"]["delta"]["ci_high_pct"]
+            result["safe"] = high is not None and high < threshold
+        results.append(result)
+    return results
+
+
+def _format(value, unit):
+    if unit == "bytes":
+        return humanize.naturalsize(value, binary=True)
+    return f"{value:.3f}{unit}"
+
+
+def render(args, results):
+    environment = Environment(loader=FileSystemLoader(os.path.join(HERE, "templates")))
+    environment.filters["value"] = _format
+    template = environment.get_template("calibration.html")
+    content = template.render(
+        args=args,
+        version=__version__,
+        created_at=datetime.datetime.now().strftime("%d-%m-%y %H:%M:%S"),
+        metrics=METRICS,
+        results=results,
+    )
+    target = os.path.join(args.target_dir, "calibration.html")
+    with open(target, "w") as f:
+        f.write(content)
+    return target
+
+
+def calibrate(args):
+    """Runs the calibration, returns True if all the plugin sets are safe."""
+    configurations = [(BASELINE, [])] + [
+        ("+".join(plugins), plugins) for plugins in calibration_sets(args)
+    ]
+    samples = {name: [] for name, _ in configurations}
+    root = os.path.join(args.target_dir, "calibration")
+
+    for run in range(args.calibrate_runs):
+        for name, plugins in configurations:
+            run_dir = os.path.join(root, name, str(run))
+            logger.info(f"[calibrate] {name}, run {run + 1}/{args.calibrate_runs}")
+            command = asyncio.run(_run(_run_args(args, plugins, run_dir)))
+            if command is None:
+                raise RuntimeError(f"The {name} run did not measure the command")
+            command["report"] = os.path.relpath(
+                os.path.join(run_dir, "index.html"), args.target_dir
+            )
+            samples[name].append(command)
+
+    results = summarize(samples, args.calibrate_threshold)
+    os.makedirs(args.target_dir, exist_ok=True)
+    with open(os.path.join(args.target_dir, "calibration.json"), "w") as f:
+        json.dump(
+            stats.json_safe(
+                {"threshold": args.calibrate_threshold, "results": results}
+            ),
+            f,
+            indent=2,
+            allow_nan=False,
+        )
+
+    for result in results[1:]:
+        wall = result["metrics"]["wall"]["delta"]
+        logger.info(
+            f"[calibrate] {result['name']}: wall time {wall['delta_pct']:+.1f}% "
+            f"[{wall['ci_low_pct']:+.1f}%, {wall['ci_high_pct']:+.1f}%] "
+            f"{'safe' if result['safe'] else 'not safe'}"
+        )
+    logger.info(f"Find the calibration report at {render(args, results)}")
+    return all(result["safe"] for result in results[1:])
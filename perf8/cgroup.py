@@ -0,0 +1,228 @@
+#
+# Licensed to Elasticsearch B.V. under one or more contributor
+# license agreements. See the NOTICE file distributed with
+# this work for additional information regarding copyright
+# ownership. Elasticsearch B.V. licenses this file to you under
+# the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# 	http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+"""
+cgroup -- limits, usage and pressure of the cgroup of a process (Linux).
+
+Both cgroup v2 and v1 (or hybrid) hierarchies are supported. Files are
+opened once and re-read with pread(). Pressure stall information comes
+from the cgroup v2 directory, or from /proc/pressure when the cgroup
+doesn't have it.
+"""
+
+import os
+import re
+
+CGROUP_ROOT = "/sys/fs/cgroup"
+BUFFER_SIZE = 4096
+
+# v1 reports "no limit" as a huge page-aligned number
+UNLIMITED = 1 << 60
+
+PRESSURE_SOME = re.compile(rb"some .*total=(\d+)")
+PRESSURE_FULL = re.compile(rb"full .*total=(\d+)")
+PRESSURES = ("cpu", "memory", "io")
+
+
+def cgroup_dirs(pid="self", root=CGROUP_ROOT, proc="/proc"):
+    """Returns the cgroup directories of a process, per controller.
+
+    The cgroup v2 directory is under the "" key.
+    """
+    dirs = {}
+    try:
+        with open(os.path.join(proc, str(pid), "cgroup")) as f:
+            lines = f.read().splitlines()
+    except OSError:
+        return dirs
+
+    for line in lines:
+        _, controllers, path = line.split(":", 2)
+        path = path.lstrip("/")
+        if controllers == "":
+            # v2 is mounted at the root, or under unified/ in hybrid mode
+            mounts = (root, os.path.join(root, "unified"))
+            names = ("",)
+        else:
+            names = controllers.split(",")
+            mounts = [os.path.join(root, controllers)]
+            mounts += [os.path.join(root, name) for name in names]
+
+        for mount in mounts:
+            if not os.path.isdir(mount):
+                continue
+            if not controllers and not os.path.exists(
+                os.path.join(mount, "cgroup.procs")
+            ):
+                continue
+            # in a cgroup namespace the cgroup of the process is the root
+            directory = os.path.join(mount, path)
+            if not os.path.isdir(directory):
+                directory = mount
+            for name in names:
+                dirs[name] = directory
+            break
+    return dirs
+
+
+class Cgroup:
+    """Reads the metrics of the cgroup of a process.
+
+    `read()` returns a tuple of integers in the order of `FIELDS`. Memory
+    and CPU limits are 0 when there are none. Throttling and pressure are
+    cumulative, in microseconds.
+    """
+
+    FIELDS = (
+        "memory_current",
+        "memory_max",
+        "cpu_quota",
+        "cpu_period",
+        "nr_periods",
+        "nr_throttled",
+        "throttled_usec",
+        "cpu_pressure_some",
+        "memory_pressure_some",
+        "memory_pressure_full",
+        "io_pressure_some",
+        "io_pressure_full",
+    )
+
+    def __init__(self, pid="self", root=CGROUP_ROOT, proc="/proc"):
+        self.dirs = cgroup_dirs(pid, root, proc)
+        self.version = 1 if "memory" in self.dirs or "cpu" in self.dirs else 2
+        self._fds = {}
+
+        if self.version == 2:
+            files = {
+                "memory_current": ("", "memory.current"),
+                "memory_max": ("", "memory.max"),
+                "cpu_max": ("", "cpu.max"),
+                "cpu_stat": ("", "cpu.stat"),
+            }
+        else:
+            files = {
+                "memory_current": ("memory", "memory.usage_in_bytes"),
+                "memory_max": ("memory", "memory.limit_in_bytes"),
+                "cpu_quota": ("cpu", "cpu.cfs_quota_us"),
+                "cpu_period": ("cpu", "cpu.cfs_period_us"),
+                "cpu_stat": ("cpu", "cpu.stat"),
+            }
+        for resource in PRESSURES:
+            files[f"{resource}_pressure"] = ("", f"{resource}.pressure")
+
+        for key, (controller, name) in files.items():
+            directory = self.dirs.get(controller)
+            path = None if directory is None else os.path.join(directory, name)
+            if key.endswith("_pressure") and (path is None or not os.path.exists(path)):
+                path = os.path.join(proc, "pressure", key[: -len("_pressure")])
+            if path is None:
+                continue
+            try:
+                self._fds[key] = os.open(path, os.O_RDONLY)
+            except OSError:
+                continue
+
+    @property
+    def available(self):
+        return "memory_current" in self._fds or "cpu_stat" in self._fds
+
+    def _read(self, key):
+        fd = self._fds.get(key)
+        if fd is None:
+            return None
+        try:
+            return os.pread(fd, BUFFER_SIZE, 0)
+        except OSError:
+            # e.g. reading PSI files when pressure accounting is disabled
+            return None
+
+    def _int(self, key):
+        content = self._read(key)
+        if content is None:
+            return 0
+        content = content.strip()
+        if content == b"max":
+            return 0
+        value = int(content)
+        return 0 if value < 0 or value >= UNLIMITED else value
+
+    def _cpu_stat(self):
+        content = self._read("cpu_stat")
+        stat = {}
+        if content is not None:
+            for line in content.splitlines():
+                key, _, value = line.partition(b" ")
+                stat[key] = int(value)
+        if b"throttled_usec" in stat:
+            throttled = stat[b"throttled_usec"]
+        else:
+            # cgroup v1 reports nanoseconds
+            throttled = stat.get(b"throttled_time", 0) // 1000
+        return stat.get(b"nr_periods", 0), stat.get(b"nr_throttled", 0), throttled
+
+    def _pressure(self, resource):
+        content = self._read(f"{resource}_pressure")
+        if content is None:
+            return 0, 0
+        some = PRESSURE_SOME.search(content)
+        full = PRESSURE_FULL.search(content)
+        return (
+            int(some.group(1)) if some else 0,
+            int(full.group(1)) if full else 0,
+        )
+
+    def cpu_limit(self):
+        """Returns the (quota, period) CPU limit, with a 0 quota if none."""
+        if self.version == 2:
+            content = self._read("cpu_max")
+            if content is None:
+                return 0, 0
+            quota, _, period = content.strip().partition(b" ")
+            return (0 if quota == b"max" else int(quota)), int(period or 0)
+        return self._int("cpu_quota"), self._int("cpu_period")
+
+    def memory_limit(self):
+        """Returns the memory limit in bytes, 0 if none."""
+        return self._int("memory_max")
+
+    def read(self):
+        cpu_some, _ = self._pressure("cpu")
+        return (
+            self._int("memory_current"),
+            self.memory_limit(),
+            *self.cpu_limit(),
+            *self._cpu_stat(),
+            cpu_some,
+            *self._pressure("memory"),
+            *self._pressure("io"),
+        )
+
+    def close(self):
+        for fd in self._fds.values():
+            os.close(fd)
+        self._fds.clear()
+
+
+def memory_limit(pid="self"):
+    """Returns the memory limit of the cgroup of a process, 0 if none."""
+    cgroup = Cgroup(pid)
+    try:
+        return cgroup.memory_limit()
+    finally:
+        cgroup.close()
@@ -25,12 +25,34 @@ import logging
 from perf8 import __version__
 from perf8.plugins.base import get_registered_plugins
 from perf8.watcher import WatchedProcess
+from perf8 import daemon
+from perf8.calibrate import calibrate
+from perf8.compare import compare
+from perf8.repeat import repeat
+from perf8.segments import parse_size
+from perf8.trends import ingest, trends
 from perf8.logger import set_logger, logger
 
 
 HERE = os.path.dirname(__file__)
 
 
+def positive_float(value):
+    """argparse type of the rates, in seconds: they must be > 0."""
+    number = float(value)
+    if not number > 0:
+        raise argparse.ArgumentTypeError(f"{value} is not a positive number")
+    return number
+
+
+def positive_int(value):
+    """argparse type of the run counts: they must be > 0."""
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"{value} is not a positive integer")
+    return number
+
+
 def parser():
     aparser = argparse.ArgumentParser(
         description="Python Performance Tracking.",
@@ -48,6 +70,14 @@ def parser():
         for name, options in plugin.arguments:
             aparser.add_argument(f"--{plugin.name}-{name}", **options)
 
+        if not plugin.in_process:
+            aparser.add_argument(
+                f"--{plugin.name}-rate",
+                type=positive_float,
+                default=None,
+                help="Probing rate in seconds (defaults to --refresh-rate)",
+            )
+
     aparser.add_argument(
         "-t",
         "--target-dir",
@@ -92,9 +122,24 @@ def parser():
     )
     aparser.add_argument(
         "--refresh-rate",
-        type=float,
+        type=positive_float,
         default=5.0,
-        help="Refresh rate",
+        help="Default probing rate in seconds",
+    )
+    aparser.add_argument(
+        "--report-mode",
+        default="embedded",
+        choices=["embedded", "interactive"],
+        help=(
+            "embedded: a self-contained page with base64 images. "
+            "interactive: client-side charts, sections are loaded when opened"
+        ),
+    )
+    aparser.add_argument(
+        "--plot-points",
+        type=int,
+        default=2000,
+        help="Longer series are downsampled to that many points in graphs",
     )
     aparser.add_argument(
         "-c",
@@ -119,6 +164,121 @@ def parser():
         help="Statsd port",
     )
 
+    aparser.add_argument(
+        "--statsd-rate",
+        type=positive_float,
+        default=None,
+        help="Statsd flush rate in seconds (defaults to --refresh-rate)",
+    )
+
+    aparser.add_argument(
+        "--live-port",
+        type=int,
+        default=None,
+        help="Serves the series live on http://127.0.0.1:<port>/ during the run",
+    )
+
+    aparser.add_argument(
+        "--trends-db",
+        type=str,
+        default=None,
+        help="Ingests the report in that SQLite database, see perf8 trends",
+    )
+
+    aparser.add_argument(
+        "--repeat",
+        type=positive_int,
+        default=1,
+        help=(
+            "Runs the command that many times and aggregates the runs, "
+            "--max-duration is checked against the median duration"
+        ),
+    )
+    aparser.add_argument(
+        "--warmup",
+        type=int,
+        default=0,
+        help="With --repeat: number of runs before the measured ones",
+    )
+    aparser.add_argument(
+        "--parallel",
+        type=positive_int,
+        default=1,
+        help="With --repeat: runs that many runs at a time, each on its own CPUs",
+    )
+
+    aparser.add_argument(
+        "--calibrate",
+        action="store_true",
+        default=False,
+        help=(
+            "Measures what the plugins cost: runs the command with no plugin, "
+            "then with each enabled plugin, and compares them"
+        ),
+    )
+    aparser.add_argument(
+        "--calibrate-runs",
+        type=positive_int,
+        default=3,
+        help="Calibration: number of runs of each configuration",
+    )
+    aparser.add_argument(
+        "--calibrate-set",
+        type=str,
+        action="append",
+        default=None,
+        help=(
+            "Calibration: comma-separated plugins measured together, can be "
+            "repeated (defaults to each enabled plugin on its own)"
+        ),
+    )
+    aparser.add_argument(
+        "--calibrate-threshold",
+        type=float,
+        default=5.0,
+        help="Calibration: max wall time overhead of a safe plugin set, in percent",
+    )
+
+    aparser.add_argument(
+        "--daemon",
+        action="store_true",
+        default=False,
+        help=(
+            "Long-running mode: data is split in segments that are compacted "
+            "and pruned, see `perf8 report` to build a report for a time window"
+        ),
+    )
+    aparser.add_argument(
+        "--segment-duration",
+        type=float,
+        default=3600.0,
+        help="Daemon mode: duration of a data segment in seconds",
+    )
+    aparser.add_argument(
+        "--rollup-after",
+        type=float,
+        default=6 * 3600.0,
+        help="Daemon mode: compacts segments older than that, in seconds (0 to disable)",
+    )
+    aparser.add_argument(
+        "--rollup-interval",
+        type=float,
+        default=60.0,
+        help="Daemon mode: compacted segments keep one record per interval, in seconds",
+    )
+    aparser.add_argument(
+        "--retention",
+        type=float,
+        default=7 * 24 * 3600.0,
+        help="Daemon mode: data older than that many seconds is removed (0 to disable)",
+    )
+    aparser.add_argument(
+        "--retention-size",
+        type=parse_size,
+        default="5G",
+        help="Daemon mode: the oldest data is removed above that size (0 to disable)",
+    )
+
     aparser.add_argument(
         "--all",
         action="store_true",
@@ -147,9 +307,173 @@ def parser():
     return aparser
 
 
+def report_parser():
+    aparser = argparse.ArgumentParser(
+        prog="perf8 report",
+        description="Builds the report of a time window of a --daemon session.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    aparser.add_argument(
+        "-t",
+        "--target-dir",
+        default=os.path.join(os.getcwd(), "perf8-report"),
+        type=str,
+        help="target dir of the session",
+    )
+    aparser.add_argument(
+        "--since",
+        default=None,
+        type=str,
+        help="Start of the window: a timestamp, an ISO date or a duration ago (2h)",
+    )
+    aparser.add_argument(
+        "--until",
+        default=None,
+        type=str,
+        help="End of the window: a timestamp, an ISO date or a duration ago (2h)",
+    )
+    aparser.add_argument(
+        "--report-mode",
+        default="embedded",
+        choices=["embedded", "interactive"],
+        help="See perf8 --help",
+    )
+    aparser.add_argument(
+        "--plot-points",
+        type=int,
+        default=2000,
+        help="Longer series are downsampled to that many points in graphs",
+    )
+    aparser.add_argument(
+        "-v",
+        "--verbose",
+        action="count",
+        default=0,
+        help="Verbosity level",
+    )
+    return aparser
+
+
+def compare_parser():
+    aparser = argparse.ArgumentParser(
+        prog="perf8 compare",
+        description="Compares a report to a baseline report and detects regressions.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    aparser.add_argument("baseline", type=str, help="target dir of the baseline")
+    aparser.add_argument("candidate", type=str, help="target dir of the candidate")
+    aparser.add_argument(
+        "-t",
+        "--target-dir",
+        default=os.path.join(os.getcwd(), "perf8-compare"),
+        type=str,
+        help="target dir for the comparison",
+    )
+    aparser.add_argument(
+        "--tolerance",
+        type=float,
+        default=5.0,
+        help="A metric regresses when it grows by more than that percentage",
+    )
+    aparser.add_argument(
+        "--tolerance-for",
+        action="append",
+        default=None,
+        metavar="PATTERN=PERCENT",
+        help="Tolerance of the metrics matching a pattern, e.g. 'statsd.*=10'",
+    )
+    aparser.add_argument(
+        "--profile-top",
+        type=int,
+        default=20,
+        help="Number of cProfile functions listed, the ones that changed the most",
+    )
+    aparser.add_argument(
+        "-v",
+        "--verbose",
+        action="count",
+        default=0,
+        help="Verbosity level",
+    )
+    return aparser
+
+
+def trends_parser():
+    aparser = argparse.ArgumentParser(
+        prog="perf8 trends",
+        description="Ingests reports in a SQLite database and draws their trends.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    aparser.add_argument(
+        "reports", nargs="*", help="target dirs of the reports to ingest"
+    )
+    aparser.add_argument(
+        "--db",
+        default=os.path.join(os.getcwd(), "perf8-trends.db"),
+        type=str,
+        help="SQLite database of the runs",
+    )
+    aparser.add_argument(
+        "-t",
+        "--target-dir",
+        default=os.path.join(os.getcwd(), "perf8-trends"),
+        type=str,
+        help="target dir for the trends",
+    )
+    aparser.add_argument(
+        "--last",
+        type=int,
+        default=100,
+        help="Number of runs drawn, the most recent ones (0 for all)",
+    )
+    aparser.add_argument(
+        "--metric",
+        action="append",
+        default=None,
+        metavar="PATTERN",
+        help="Only draws the metrics matching a pattern, e.g. 'rss.*'",
+    )
+    aparser.add_argument(
+        "--profile-top",
+        type=int,
+        default=20,
+        help="Number of cProfile functions stored per run, the ones with the most own time",
+    )
+    aparser.add_argument(
+        "-v",
+        "--verbose",
+        action="count",
+        default=0,
+        help="Verbosity level",
+    )
+    return aparser
+
+
+# perf8 <command> [options], perf8 [options] runs a command
+COMMANDS = {
+    "report": (report_parser, daemon.report),
+    "compare": (compare_parser, compare),
+    "trends": (trends_parser, trends),
+}
+
+
+def run_command(name, argv):
+    command_parser, func = COMMANDS[name]
+    args = command_parser().parse_args(argv)
+    set_logger(logging.DEBUG if args.verbose > 0 else logging.INFO)
+    return func(args)
+
+
 def main(args=None):
     os.environ["PERF8_ARGS"] = "::".join(sys.argv[1:])
 
+    if args is None and len(sys.argv) > 1 and sys.argv[1] in COMMANDS:
+        result = run_command(sys.argv[1], sys.argv[2:])
+        # a command returning False failed, e.g. a comparison with regressions
+        if result is False:
+            sys.exit(1)
+        return result
+
     if args is None:
         aparser = parser()
         args = aparser.parse_args()
@@ -165,7 +489,8 @@ def main(args=None):
             else:
                 setattr(args, plugin.name.replace("-", "_"), True)
 
-    if args.memray and args.cprofile:
+    # calibration runs the plugins one at a time
+    if args.memray and args.cprofile and not args.calibrate:
         raise Exception("You can't use --memray and --cprofile at the same time")
 
     if args.verbose > 0:
@@ -173,7 +498,16 @@ def main(args=None):
     else:
         set_logger(logging.INFO)
 
-    result = asyncio.run(WatchedProcess(args).run())
+    if args.calibrate:
+        result = calibrate(args)
+    elif args.repeat > 1 or args.warmup > 0:
+        result = repeat(args)
+    else:
+        result = asyncio.run(WatchedProcess(args).run())
+
+    # a calibration has no report of its own
+    if args.trends_db and not args.calibrate:
+        ingest(args.trends_db, [args.target_dir])
 
     status_file = os.path.join(args.target_dir, args.status_filename)
     logger.info(f"Writing status in {status_file}")
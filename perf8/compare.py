@@ -0,0 +1,352 @@
+#
+# Licensed to Elasticsearch B.V. under one or more contributor
+# license agreements. See the NOTICE file distributed with
+# this work for additional information regarding copyright
+# ownership. Elasticsearch B.V. licenses this file to you under
+# the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# 	http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+"""
+Compare -- tells whether a report regressed against a baseline report.
+
+`perf8 compare <baseline> <candidate>` reads the numbers of both
+reports: summary.json, the psutil and asyncstats series and the
+cProfile data. When a report was made with --repeat, each of its runs
+is a sample, otherwise the points of a series are.
+
+A metric regressed when it grew by more than its tolerance and the
+difference is significant. Without samples to test, e.g. the duration
+of a single run on each side, the tolerance alone decides.
+
+Results are in <target_dir>/compare.html and verdict.json.
+"""
+
+import datetime
+import json
+import os
+import pstats
+from collections import defaultdict
+from fnmatch import fnmatch
+
+import humanize
+import matplotlib.ticker as tkr
+import numpy as np
+from jinja2 import Environment, FileSystemLoader
+
+from perf8 import __version__
+from perf8 import stats
+from perf8.datafile import load_datafile
+from perf8.logger import logger
+from perf8.plot import Graph, Line, get_x
+from perf8.repeat import SUMMARY_FILE, format_value, run_metrics
+from perf8.repeat import unit as run_unit
+
+HERE = os.path.dirname(__file__)
+
+# (name, data file, column, label, unit), lower is better
+SERIES = (
+    ("rss", "report.npy", "rss", "RSS", "bytes"),
+    ("cpu_usage", "report.npy", "cpu_percent", "CPU usage", "%"),
+    ("loop_lag", "loop.npy", "lag", "Event loop lag", "s"),
+)
+PROFILE_FILE = "profile.data"
+
+# the number of blocks a series is cut into when its points are the samples
+BLOCKS = 10
+
+REGRESSION = "regression"
+IMPROVEMENT = "improvement"
+UNCHANGED = "unchanged"
+
+
+def run_dirs(report_dir):
+    """Returns the measured runs of a --repeat report, or the report itself."""
+    repeat_json = os.path.join(report_dir, "repeat.json")
+    if os.path.exists(repeat_json):
+        with open(repeat_json) as f:
+            runs = json.load(f)["runs"]
+        return [os.path.join(report_dir, run) for run in runs]
+    if not os.path.exists(os.path.join(report_dir, SUMMARY_FILE)):
+        raise ValueError(f"{report_dir} is not a perf8 report")
+    return [report_dir]
+
+
+def load_profile(path):
+    """Returns the calls, own and cumulative time of each profiled function."""
+    if not os.path.exists(path):
+        return {}
+    return {
+        pstats.func_std_string(func): {"calls": nc, "tottime": tt, "cumtime": ct}
+        for func, (_, nc, tt, ct, _) in pstats.Stats(path).stats.items()
+    }
+
+
+def load_run(run_dir):
+    """Returns the metrics, series and profile of a run."""
+    metrics = {}
+    summary_file = os.path.join(run_dir, SUMMARY_FILE)
+    if os.path.exists(summary_file):
+        with open(summary_file) as f:
+            metrics.update(run_metrics(json.load(f)))
+
+    series = {}
+    for name, filename, column, _, _ in SERIES:
+        path = os.path.join(run_dir, filename)
+        if not os.path.exists(path):
+            continue
+        data = load_datafile(path)
+        if len(data) == 0 or column not in data.dtype.names:
+            continue
+        x = np.asarray(get_x(data), dtype=float)
+        y = np.asarray(data[column], dtype=float)
+        series[name] = x, y
+        metrics[f"{name}.mean"] = float(np.nanmean(y))
+        metrics[f"{name}.peak"] = float(np.nanmax(y))
+
+    profile = load_profile(os.path.join(run_dir, PROFILE_FILE))
+    if profile:
+        metrics["profile_time"] = sum(entry["tottime"] for entry in profile.values())
+    return {"metrics": metrics, "series": series, "profile": profile}
+
+
+def unit(metric):
+    for name, _, _, _, series_unit in SERIES:
+        if metric.startswith(f"{name}."):
+            return series_unit
+    if metric == "profile_time":
+        return "s"
+    return run_unit(metric)
+
+
+def unit_formatter(unit):
+    """Returns the matplotlib formatter of the values of a unit."""
+    if unit == "bytes":
+        return tkr.FuncFormatter(humanize.naturalsize)
+    if unit == "%":
+        return tkr.PercentFormatter()
+    return None
+
+
+def parse_tolerances(values):
+    """Parses the PATTERN=PERCENT values of --tolerance-for."""
+    tolerances = []
+    for value in values or ():
+        pattern, _, percent = value.partition("=")
+        try:
+            tolerances.append((pattern.strip(), float(percent)))
+        except ValueError:
+            raise ValueError(f"Invalid tolerance {value!r}, use PATTERN=PERCENT")
+    return tolerances
+
+
+def get_tolerance(metric, default, tolerances):
+    # the last matching pattern wins
+    for pattern, percent in reversed(tolerances):
+        if fnmatch(metric, pattern):
+            return percent
+    return default
+
+
+def block_means(values, blocks=BLOCKS):
+    """Returns the means of `blocks` contiguous parts of a series."""
+    values = np.asarray(values, dtype=float)
+    if len(values) == 0:
+        return []
+    return [
+        float(part.mean()) for part in np.array_split(values, min(blocks, len(values)))
+    ]
+
+
+def judge(base, candidate, tolerance, base_points=None, candidate_points=None):
+    """Compares the samples of a metric, returns the delta and the status.
+
+    A single run per side has no spread. For the mean of a series, the
+    samples are then the means of contiguous blocks of its points: the
+    points follow each other in time and are not independent, testing
+    them as they are would find almost any difference significant.
+    """
+    if len(base) < 2 or len(candidate) < 2:
+        if base_points is not None and candidate_points is not None:
+            base, candidate = block_means(base_points), block_means(candidate_points)
+    tested = len(base) > 1 and len(candidate) > 1
+    delta = stats.compare(base, candidate)
+    delta["tested"] = tested
+
+    status = UNCHANGED
+    percent = delta["delta_pct"]
+    if percent is not None and abs(percent) > tolerance:
+        if delta["significant"] or not tested:
+            status = REGRESSION if percent > 0 else IMPROVEMENT
+    return delta, status
+
+
+def compare_metrics(base_runs, candidate_runs, args):
+    """Compares the metrics found in all the runs of both reports."""
+    runs = base_runs + candidate_runs
+    names = [
+        name
+        for name in base_runs[0]["metrics"]
+        if all(name in run["metrics"] for run in runs)
+    ]
+    tolerances = parse_tolerances(args.tolerance_for)
+
+    def points(side, name):
+        # the points of the series of a single run, for its mean
+        series, _, stat = name.rpartition(".")
+        if len(side) != 1 or stat != "mean" or series not in side[0]["series"]:
+            return None
+        values = side[0]["series"][series][1]
+        return values[~np.isnan(values)]
+
+    results = []
+    for name in names:
+        base = [run["metrics"][name] for run in base_runs]
+        candidate = [run["metrics"][name] for run in candidate_runs]
+        tolerance = get_tolerance(name, args.tolerance, tolerances)
+        delta, status = judge(
+            base,
+            candidate,
+            tolerance,
+            points(base_runs, name),
+            points(candidate_runs, name),
+        )
+        results.append(
+            {
+                "name": name,
+                "unit": unit(name),
+                "baseline": stats.summarize(base),
+                "candidate": stats.summarize(candidate),
+                "delta": delta,
+                "tolerance": tolerance,
+                "status": status,
+            }
+        )
+    return results
+
+
+def mean_profile(profiles):
+    totals = defaultdict(lambda: {"calls": 0.0, "tottime": 0.0, "cumtime": 0.0})
+    for profile in profiles:
+        for func, entry in profile.items():
+            for key, value in entry.items():
+                totals[func][key] += value / len(profiles)
+    return totals
+
+
+def compare_profiles(base_runs, candidate_runs, top=20):
+    """Returns the functions whose own time changed the most, per run."""
+    base = mean_profile([run["profile"] for run in base_runs])
+    candidate = mean_profile([run["profile"] for run in candidate_runs])
+    rows = []
+    for func in set(base) | set(candidate):
+        before, after = base[func], candidate[func]
+        rows.append(
+            {
+                "function": func,
+                "baseline": before,
+                "candidate": after,
+                "delta_calls": after["calls"] - before["calls"],
+                "delta_tottime": after["tottime"] - before["tottime"],
+                "delta_cumtime": after["cumtime"] - before["cumtime"],
+            }
+        )
+    rows.sort(key=lambda row: abs(row["delta_tottime"]), reverse=True)
+    return rows[:top]
+
+
+def align(series, grid):
+    """Returns the median of series resampled on the `grid` x axis."""
+    return np.median([np.interp(grid, x, y) for x, y in series], axis=0)
+
+
+def series_graphs(base_runs, candidate_runs, target_dir):
+    """Draws the baseline and candidate series on the same time axis.
+
+    The axis is the one of the first baseline run, over the span all the
+    runs share.
+    """
+    graphs = []
+    runs = base_runs + candidate_runs
+    for name, _, _, label, series_unit in SERIES:
+        if not all(name in run["series"] for run in runs):
+            continue
+        end = min(run["series"][name][0][-1] for run in runs)
+        grid = base_runs[0]["series"][name][0]
+        grid = grid[grid <= end]
+        base = align([run["series"][name] for run in base_runs], grid)
+        candidate = align([run["series"][name] for run in candidate_runs], grid)
+        graph = Graph(
+            label,
+            target_dir,
+            f"compare_{name}.png",
+            label,
+            unit_formatter(series_unit),
+            Line((grid, base), "Baseline", None, "b"),
+            Line((grid, candidate), "Candidate", None, "r"),
+        )
+        graph.render()
+        graphs.append(graph)
+    return graphs
+
+
+def render(args, verdict, graphs):
+    environment = Environment(loader=FileSystemLoader(os.path.join(HERE, "templates")))
+    environment.filters["value"] = format_value
+    template = environment.get_template("compare.html")
+    content = template.render(
+        args=args,
+        version=__version__,
+        created_at=datetime.datetime.now().strftime("%d-%m-%y %H:%M:%S"),
+        verdict=verdict,
+        graphs=[{"title": graph.title, "file": graph.target_file} for graph in graphs],
+    )
+    target = os.path.join(args.target_dir, "compare.html")
+    with open(target, "w") as f:
+        f.write(content)
+    return target
+
+
+def compare(args):
+    """Compares two reports, returns False if the candidate regressed."""
+    base_runs = [load_run(run) for run in run_dirs(args.baseline)]
+    candidate_runs = [load_run(run) for run in run_dirs(args.candidate)]
+    os.makedirs(args.target_dir, exist_ok=True)
+
+    metrics = compare_metrics(base_runs, candidate_runs, args)
+    verdict = {
+        "baseline": os.path.abspath(args.baseline),
+        "candidate": os.path.abspath(args.candidate),
+        "runs": {"baseline": len(base_runs), "candidate": len(candidate_runs)},
+        "metrics": metrics,
+        "regressions": [m["name"] for m in metrics if m["status"] == REGRESSION],
+        "improvements": [m["name"] for m in metrics if m["status"] == IMPROVEMENT],
+        "profile": compare_profiles(base_runs, candidate_runs, args.profile_top),
+    }
+    verdict["success"] = not verdict["regressions"]
+    with open(os.path.join(args.target_dir, "verdict.json"), "w") as f:
+        json.dump(stats.json_safe(verdict), f, indent=2, allow_nan=False)
+
+    for metric in metrics:
+        if metric["status"] == UNCHANGED:
+            continue
+        delta = metric["delta"]
+        logger.info(
+            f"[compare] {'❌' if metric['status'] == REGRESSION else '✅'} "
+            f"{metric['name']}: {delta['delta_pct']:+.1f}% "
+            f"(tolerance {metric['tolerance']:g}%)"
+        )
+    graphs = series_graphs(base_runs, candidate_runs, args.target_dir)
+    logger.info(f"Find the comparison at {render(args, verdict, graphs)}")
+    if not verdict["success"]:
+        logger.info(f"[compare] Regressions: {', '.join(verdict['regressions'])}")
+    return verdict["success"]
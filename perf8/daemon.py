@@ -0,0 +1,170 @@
+#
+# Licensed to Elasticsearch B.V. under one or more contributor
+# license agreements. See the NOTICE file distributed with
+# this work for additional information regarding copyright
+# ownership. Elasticsearch B.V. licenses this file to you under
+# the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# 	http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+"""
+Daemon -- reports on a time window of a long-running session.
+
+A session started with --daemon saves its arguments in session.json.
+`perf8 report` rebuilds the plugins from them, loads the records of the
+window from the segments and rollups, and renders a report in
+<target_dir>/reports/<window>/.
+"""
+
+import argparse
+import datetime
+import json
+import os
+import time
+from collections import defaultdict
+
+import humanize
+
+from perf8.logger import logger
+from perf8.plugins.base import get_registered_plugins
+from perf8.reporter import Reporter
+from perf8.segments import load_window, read_window, segments_dir
+
+SESSION_FILE = "session.json"
+DURATION_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+
+def save_session(args):
+    path = os.path.join(args.target_dir, SESSION_FILE)
+    with open(path, "w") as f:
+        json.dump(vars(args), f, indent=2, default=str)
+    return path
+
+
+def load_session(target_dir):
+    path = os.path.join(target_dir, SESSION_FILE)
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"{path} not found, was perf8 run with --daemon?")
+    with open(path) as f:
+        return argparse.Namespace(**json.load(f))
+
+
+def parse_time(value, now=None):
+    """Converts a window bound to a timestamp.
+
+    `value` is a timestamp, an ISO date, "now", or a duration ago such as
+    "90s", "30m", "2h" or "1d".
+    """
+    if value is None:
+        return None
+    if now is None:
+        now = time.time()
+    value = value.strip()
+    if value == "now":
+        return now
+    if value[-1:] in DURATION_UNITS:
+        try:
+            return now - float(value[:-1]) * DURATION_UNITS[value[-1]]
+        except ValueError:
+            pass
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.datetime.fromisoformat(value).timestamp()
+
+
+def _label(timestamp, default):
+    if timestamp is None:
+        return default
+    return time.strftime("%Y%m%d-%H%M%S", time.localtime(timestamp))
+
+
+class StatsdWindow:
+    """The statsd entries of a window, for the Reporter."""
+
+    def __init__(self, directory, since, until):
+        self.directory = directory
+        self.since = since
+        self.until = until
+
+    def get_series(self):
+        return read_window(self.directory, self.since, self.until)
+
+
+def report(args):
+    """Renders the report of a window of a daemon session."""
+    session = load_session(args.target_dir)
+    now = time.time()
+    since = parse_time(args.since, now)
+    until = parse_time(args.until, now)
+    window = f"{_label(since, 'start')}_{_label(until, 'end')}"
+    window_dir = os.path.join(args.target_dir, "reports", window)
+    os.makedirs(window_dir, exist_ok=True)
+
+    window_args = argparse.Namespace(**vars(session))
+    window_args.target_dir = window_dir
+    window_args.daemon = False
+    window_args.max_duration = 0
+    window_args.report_mode = args.report_mode
+    window_args.plot_points = args.plot_points
+
+    # in-process plugins don't write segments
+    plugins = [
+        klass
+        for klass in get_registered_plugins()
+        if not klass.in_process
+        if getattr(session, klass.name.replace("-", "_"), False)
+    ]
+    reports = defaultdict(list)
+    first = last = None
+    for klass in plugins:
+        plugin = klass(window_args)
+        data_path = getattr(plugin, "data_path", None)
+        if data_path is None:
+            continue
+        records = load_window(segments_dir(args.target_dir, data_path), since, until)
+        if records is None or len(records) == 0:
+            logger.warning(f"No {plugin.name} data in this window")
+            continue
+        start, end = float(records["when"].min()), float(records["when"].max())
+        first = start if first is None else min(first, start)
+        last = end if last is None else max(last, end)
+        graphs = plugin.get_graphs()
+        # the per-process series of --psutil-tree have their own segments
+        if getattr(plugin, "track_tree", False):
+            tree = load_window(
+                segments_dir(args.target_dir, plugin.tree_path), since, until
+            )
+            if tree is not None and len(tree) > 0:
+                graphs += plugin.get_tree_graphs(tree)
+        plugin.generate_plots(records, *graphs)
+        reports[plugin.name].extend(graph.as_report() for graph in graphs)
+
+    statsd_data = None
+    if getattr(session, "statsd", False):
+        statsd_data = StatsdWindow(
+            segments_dir(args.target_dir, "statsd.json"), since, until
+        )
+
+    duration = 0
+    if first is not None:
+        duration = (until or last) - (since or first)
+    execution_info = {
+        "duration": humanize.precisedelta(duration),
+        "duration_s": duration,
+        "window": [since or first, until or last],
+        "probes": [],
+    }
+    reporter = Reporter(window_args, execution_info, statsd_data)
+    html_report = reporter.generate(None, reports, plugins)
+    logger.info(f"Find the report at {html_report}")
+    return html_report
@@ -0,0 +1,165 @@
+#
+# Licensed to Elasticsearch B.V. under one or more contributor
+# license agreements. See the NOTICE file distributed with
+# this work for additional information regarding copyright
+# ownership. Elasticsearch B.V. licenses this file to you under
+# the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# 	http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+"""
+Datafile -- typed, append-only time series stored as NumPy .npy files.
+"""
+
+import os
+import csv
+import struct
+import time
+
+import numpy as np
+
+from perf8.logger import logger
+
+NPY_MAGIC = b"\x93NUMPY\x01\x00"
+
+
+class Datafile:
+    """Append-only time series stored in a NumPy .npy file.
+
+    Every sample is a fixed-width record of typed columns. `fields` is a
+    list of column names, or of (name, dtype) tuples -- columns are
+    float64 by default. Records are buffered and written in batches, and
+    the array length in the .npy header is updated on every flush so the
+    file can be memory-mapped with `np.load(path, mmap_mode="r")` at any
+    time, even while it's being written.
+    """
+
+    def __init__(self, report_file, fields, batch_size=64, flush_interval=1.0):
+        self.report_file = report_file
+        self.rows = tuple(
+            field if isinstance(field, str) else field[0] for field in fields
+        )
+        self.dtype = np.dtype(
+            [
+                (field, "<f8") if isinstance(field, str) else tuple(field)
+                for field in fields
+            ]
+        )
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.report_fd = None
+        self.count = 0
+        self._buffer = []
+        self._flushed = 0
+        self._last_flush = 0
+        self._header = None
+
+    def _write_header(self):
+        # the shape is written with a fixed width so the header size never
+        # changes when the file grows
+        header = "{'descr': %r, 'fortran_order': False, 'shape': (%20d,), }" % (
+            np.lib.format.dtype_to_descr(self.dtype),
+            self._flushed,
+        )
+        if self._header is None:
+            # magic string + version + header length, aligned on 64 bytes
+            total = len(NPY_MAGIC) + 2 + len(header) + 1
+            self._header = len(header) + 1 + (64 - total % 64) % 64
+        header = header.ljust(self._header - 1) + "\n"
+        self.report_fd.seek(0)
+        self.report_fd.write(NPY_MAGIC)
+        self.report_fd.write(struct.pack("<H", self._header))
+        self.report_fd.write(header.encode("latin1"))
+
+    def open(self):
+        self.report_fd = open(self.report_file, "wb")
+        self._write_header()
+        self.report_fd.flush()
+        self._last_flush = time.monotonic()
+
+    def add(self, values):
+        if self.report_fd is None:
+            logger.warning(f"Failed to write in {self.report_file}")
+            return
+        try:
+            self._buffer.append(tuple(values))
+        except TypeError:
+            logger.warning(f"Skipped an invalid record in {self.report_file}")
+            return
+        self.count += 1
+        if len(self._buffer) >= self.batch_size:
+            self.flush()
+        elif time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        if self.report_fd is None:
+            return
+        self._last_flush = time.monotonic()
+        if not self._buffer:
+            return
+        try:
+            records = np.array(self._buffer, dtype=self.dtype)
+        except (TypeError, ValueError):
+            records = self._valid_records()
+        finally:
+            self._buffer[:] = []
+        self.report_fd.seek(0, os.SEEK_END)
+        self.report_fd.write(records.tobytes())
+        self._flushed += len(records)
+        # the header is updated last so readers never see missing records
+        self._write_header()
+        self.report_fd.flush()
+
+    def _valid_records(self):
+        # a bad record only loses itself, not the whole batch
+        valid = []
+        for values in self._buffer:
+            try:
+                np.array([values], dtype=self.dtype)
+            except (TypeError, ValueError):
+                logger.warning(f"Skipped an invalid record in {self.report_file}")
+                self.count -= 1
+            else:
+                valid.append(values)
+        return np.array(valid, dtype=self.dtype)
+
+    def close(self):
+        if self.report_fd is None:
+            return
+        self.flush()
+        self.report_fd.close()
+        self.report_fd = None
+
+    @property
+    def location(self):
+        """Where the records are stored, for the report artifacts."""
+        return self.report_file
+
+    def load(self):
+        """Returns the records as a read-only structured array."""
+        self.flush()
+        return load_datafile(self.report_file)
+
+    def export_csv(self, csv_file, chunk_size=10000):
+        data = self.load()
+        with open(csv_file, "w") as f:
+            writer = csv.writer(f)
+            writer.writerow(self.rows)
+            for start in range(0, len(data), chunk_size):
+                writer.writerows(data[start : start + chunk_size].tolist())
+        return csv_file
+
+
+def load_datafile(path):
+    """Memory-maps a Datafile -- columns are read with no copy."""
+    return np.load(path, mmap_mode="r")
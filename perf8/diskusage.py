@@ -0,0 +1,274 @@
+#
+# Licensed to Elasticsearch B.V. under one or more contributor
+# license agreements. See the NOTICE file distributed with
+# this work for additional information regarding copyright
+# ownership. Elasticsearch B.V. licenses this file to you under
+# the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# 	http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+"""
+Incremental disk usage -- keeps a per-directory size index of a tree
+and only rescans the directories that changed since the last refresh.
+
+Changes are detected with inotify on Linux. When inotify is not
+available (other platforms, watch limit reached) we fall back to
+comparing directories mtimes, which catches created, deleted and renamed
+files but not files growing in place.
+"""
+
+import os
+import ctypes
+import ctypes.util
+import errno
+import struct
+import sys
+
+from perf8.logger import logger
+
+
+def scantree(path):
+    try:
+        for entry in os.scandir(path):
+            if entry.is_dir(follow_symlinks=False):
+                yield from scantree(entry.path)
+            else:
+                if not entry.name.startswith("."):
+                    yield entry
+    except (FileNotFoundError, PermissionError):
+        pass
+
+
+# XXX expensive, see DiskUsage
+def disk_usage(path):
+    size = 0
+    for entry in scantree(path):
+        try:
+            size += entry.stat().st_size
+        except (OSError, PermissionError, FileNotFoundError):
+            pass
+    return size
+
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO
+WATCH_MASK |= IN_CREATE | IN_DELETE | IN_ONLYDIR | IN_DONT_FOLLOW
+
+_EVENT = struct.Struct("iIII")
+
+
+class Inotify:
+    """Minimal ctypes binding, just enough to know which directories changed."""
+
+    def __init__(self):
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self._add_watch = libc.inotify_add_watch
+        self._add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self._rm_watch = libc.inotify_rm_watch
+        self._rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+
+    def add_watch(self, path):
+        wd = self._add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err), path)
+        return wd
+
+    def rm_watch(self, wd):
+        self._rm_watch(self.fd, wd)
+
+    def read_events(self):
+        """Returns the (wd, mask) of all pending events, without blocking."""
+        events = []
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                return events
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = _EVENT.unpack_from(data, offset)
+                offset += _EVENT.size + length
+                events.append((wd, mask))
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+class _Dir:
+    __slots__ = ("mtime", "size", "subdirs", "wd")
+
+    def __init__(self, mtime, size, subdirs, wd):
+        self.mtime = mtime
+        self.size = size
+        self.subdirs = subdirs
+        self.wd = wd
+
+
+class DiskUsage:
+    """Tracks the size of the files under `path`.
+
+    Gives the same result than `disk_usage(path)` but `refresh()` only
+    rescans directories that changed since the previous call.
+    """
+
+    def __init__(self, path, use_inotify=True):
+        self.path = path
+        self.total = 0
+        self._dirs = {}
+        self._wds = {}
+        self._inotify = None
+        if use_inotify and sys.platform.startswith("linux"):
+            try:
+                self._inotify = Inotify()
+            except (OSError, AttributeError) as e:
+                logger.debug(f"inotify is not available ({e}), using mtimes")
+        self._scan_tree(path)
+
+    @property
+    def mode(self):
+        return "inotify" if self._inotify is not None else "mtime"
+
+    def _watch(self, path):
+        if self._inotify is None:
+            return None
+        try:
+            wd = self._inotify.add_watch(path)
+        except OSError as e:
+            if e.errno == errno.ENOSPC:
+                logger.warning(
+                    "inotify watch limit reached, disk usage falls back to mtimes"
+                )
+                self._fallback()
+            return None
+        self._wds[wd] = path
+        return wd
+
+    def _fallback(self):
+        self._inotify.close()
+        self._inotify = None
+        self._wds.clear()
+        for info in self._dirs.values():
+            info.wd = None
+
+    def _scan_dir(self, path):
+        # the watch is set before scanning so we don't miss changes
+        # happening while we list the directory
+        wd = self._watch(path)
+        size = 0
+        subdirs = []
+        try:
+            mtime = os.stat(path).st_mtime_ns
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.append(entry.path)
+                    elif not entry.name.startswith("."):
+                        try:
+                            size += entry.stat().st_size
+                        except OSError:
+                            pass
+        except OSError:
+            mtime = None
+
+        old = self._dirs.get(path)
+        if old is not None:
+            self.total -= old.size
+            # the directory was replaced, the old watch follows the old inode
+            if old.wd is not None and old.wd != wd:
+                if self._wds.pop(old.wd, None) is not None:
+                    self._inotify.rm_watch(old.wd)
+        self._dirs[path] = _Dir(mtime, size, subdirs, wd)
+        self.total += size
+        return old, subdirs
+
+    def _scan_tree(self, path):
+        stack = [path]
+        while stack:
+            _, subdirs = self._scan_dir(stack.pop())
+            stack.extend(subdirs)
+
+    def _drop_tree(self, path):
+        stack = [path]
+        while stack:
+            info = self._dirs.pop(stack.pop(), None)
+            if info is None:
+                continue
+            self.total -= info.size
+            if info.wd is not None and self._wds.pop(info.wd, None) is not None:
+                self._inotify.rm_watch(info.wd)
+            stack.extend(info.subdirs)
+
+    def _rescan(self, path):
+        old, subdirs = self._scan_dir(path)
+        previous = set(old.subdirs) if old is not None else set()
+        current = set(subdirs)
+        for gone in previous - current:
+            self._drop_tree(gone)
+        for new in current - previous:
+            self._scan_tree(new)
+
+    def _changed_dirs(self):
+        if self._inotify is not None:
+            changed = set()
+            for wd, mask in self._inotify.read_events():
+                if mask & IN_Q_OVERFLOW:
+                    return list(self._dirs)
+                if mask & IN_IGNORED:
+                    continue
+                path = self._wds.get(wd)
+                if path is not None:
+                    changed.add(path)
+            return changed
+
+        changed = []
+        for path, info in self._dirs.items():
+            try:
+                mtime = os.stat(path).st_mtime_ns
+            except OSError:
+                mtime = None
+            if mtime != info.mtime:
+                changed.append(path)
+        return changed
+
+    def refresh(self):
+        # parents first, so a removed subtree is dropped before we try
+        # to rescan any of its directories
+        for path in sorted(self._changed_dirs(), key=len):
+            if path in self._dirs:
+                self._rescan(path)
+        if self.path not in self._dirs:
+            self._scan_tree(self.path)
+        return self.total
+
+    def close(self):
+        if self._inotify is not None:
+            self._inotify.close()
+            self._inotify = None
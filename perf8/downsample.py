@@ -0,0 +1,86 @@
+#
+# Licensed to Elasticsearch B.V. under one or more contributor
+# license agreements. See the NOTICE file distributed with
+# this work for additional information regarding copyright
+# ownership. Elasticsearch B.V. licenses this file to you under
+# the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# 	http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+"""
+Downsampling of long time series before they are plotted.
+
+- `lttb` picks the points that preserve the visual shape of the series,
+  using the Largest-Triangle-Three-Buckets algorithm (Sveinn Steinarsson,
+  "Downsampling Time Series for Visual Representation", 2013).
+- `minmax_envelope` gives the min and max of each bucket, so spikes that
+  LTTB could drop are still visible around the line.
+"""
+
+import numpy as np
+
+
+def lttb(x, y, n_out):
+    """Returns the indices of the `n_out` points to keep."""
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+
+    x = np.asarray(x, dtype=float)
+    y = np.nan_to_num(np.asarray(y, dtype=float))
+
+    # first and last points are always kept, the others are split in
+    # n_out - 2 buckets and we keep one point per bucket
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.intp)
+    indices = np.empty(n_out, dtype=np.intp)
+    indices[0] = 0
+    indices[-1] = n - 1
+
+    # the average point of each bucket, computed at once, bucket i + 1
+    # is the "next bucket" of bucket i
+    starts = edges[1:]
+    sizes = np.diff(np.append(starts, n))
+    avg_xs = (np.add.reduceat(x, starts) / sizes).tolist()
+    avg_ys = (np.add.reduceat(y, starts) / sizes).tolist()
+    bounds = edges.tolist()
+
+    selected = 0
+    for i in range(n_out - 2):
+        start, end = bounds[i], bounds[i + 1]
+        avg_x, avg_y = avg_xs[i], avg_ys[i]
+
+        # area of the triangles formed by the previously selected point,
+        # each point of the bucket and the average of the next bucket
+        ax, ay = x[selected], y[selected]
+        areas = np.abs(
+            (ax - avg_x) * (y[start:end] - ay) - (ax - x[start:end]) * (avg_y - ay)
+        )
+        selected = start + int(areas.argmax())
+        indices[i + 1] = selected
+
+    return indices
+
+
+def minmax_envelope(x, y, buckets):
+    """Returns (x, min, max) per bucket of consecutive points."""
+    n = len(x)
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    if buckets >= n:
+        return x, y, y
+
+    starts = np.linspace(0, n, buckets + 1).astype(np.intp)[:-1]
+    return (
+        x[starts],
+        np.fmin.reduceat(y, starts),
+        np.fmax.reduceat(y, starts),
+    )
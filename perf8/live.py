@@ -0,0 +1,391 @@
+#
+# Licensed to Elasticsearch B.V. under one or more contributor
+# license agreements. See the NOTICE file distributed with
+# this work for additional information regarding copyright
+# ownership. Elasticsearch B.V. licenses this file to you under
+# the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# 	http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+"""
+Live -- serves the series of a run while it's being recorded.
+
+A small HTTP server running in the event loop of the watcher, started
+with --live-port:
+
+- `/` is a page drawing the series as they grow
+- `/events` is a Server-Sent Events stream. The first event, "graphs",
+  describes the graphs of the plugins, then "records" events carry the
+  records appended to each series since the previous event, and "end"
+  is sent when the run is over. `/events?streams=report,loop` limits
+  the stream to some series.
+
+Series are the .npy Datafiles and statsd.json of the target directory,
+or their current segment in daemon mode. Each client keeps its offset
+in every file and only reads what was appended since.
+"""
+
+import ast
+import asyncio
+import json
+import os
+import re
+import struct
+import time
+import urllib.parse
+from contextlib import suppress
+
+import numpy as np
+from jinja2 import Environment, FileSystemLoader
+
+from perf8.logger import logger
+from perf8.segments import SEGMENTS_DIR, list_segments
+
+HERE = os.path.dirname(__file__)
+STATSD_FILE = "statsd.json"
+SHAPE = re.compile(rb"'shape': \(\s*(\d+),")
+CHUNK_SIZE = 1024 * 1024
+REQUEST_TIMEOUT = 10.0
+
+# files created by the run can have an mtime slightly older than its
+# start on filesystems with a coarse clock
+STALE_MARGIN = 1.0
+
+
+class NpyTail:
+    """Reads the records appended to a Datafile since the last read.
+
+    A Datafile rewrites its header with the number of records after each
+    batch, so a read only fetches the header and the new records.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.offset = 0
+        self.dtype = None
+        self._data_start = None
+        self._fd = os.open(path, os.O_RDONLY)
+
+    def _count(self):
+        prefix = os.pread(self._fd, 10, 0)
+        if len(prefix) < 10 or not prefix.startswith(b"\x93NUMPY"):
+            # the file was just created
+            return None
+        size = struct.unpack("<H", prefix[8:10])[0]
+        header = os.pread(self._fd, size, 10)
+        if len(header) < size:
+            return None
+        if self.dtype is None:
+            descr = ast.literal_eval(header.decode("latin1"))["descr"]
+            self.dtype = np.lib.format.descr_to_dtype(descr)
+            self._data_start = 10 + size
+        match = SHAPE.search(header)
+        return None if match is None else int(match.group(1))
+
+    def read(self):
+        count = self._count()
+        if count is not None and count < self.offset:
+            # the file was rewritten
+            self.offset = 0
+            self.dtype = None
+            count = self._count()
+        if count is None or count == self.offset:
+            return None
+
+        itemsize = self.dtype.itemsize
+        data = os.pread(
+            self._fd,
+            (count - self.offset) * itemsize,
+            self._data_start + self.offset * itemsize,
+        )
+        available = len(data) // itemsize
+        self.offset += available
+        return np.frombuffer(data[: available * itemsize], dtype=self.dtype)
+
+    def close(self):
+        os.close(self._fd)
+
+
+class LinesTail:
+    """Reads the JSON lines appended to a file since the last read."""
+
+    def __init__(self, path):
+        self.path = path
+        self.offset = 0
+        self._partial = b""
+        self._fd = os.open(path, os.O_RDONLY)
+
+    def read(self):
+        entries = []
+        while True:
+            chunk = os.pread(self._fd, CHUNK_SIZE, self.offset)
+            if not chunk:
+                break
+            self.offset += len(chunk)
+            lines = (self._partial + chunk).split(b"\n")
+            # the last line may not be complete yet
+            self._partial = lines.pop()
+            entries.extend(json.loads(line) for line in lines if line.strip())
+        return entries or None
+
+    def close(self):
+        os.close(self._fd)
+
+
+class Stream:
+    """A series of the run: a file, or a segments directory.
+
+    In a segments directory the most recent raw segment is followed.
+    When a new one starts, the end of the previous one is read first.
+    """
+
+    def __init__(self, name, location, started_at):
+        self.name = name
+        self.location = location
+        self.started_at = started_at
+        self.tail = None
+
+    def _current(self):
+        path = self.location
+        if os.path.isdir(path):
+            segments = [
+                segment
+                for _, is_rollup, segment in list_segments(path)
+                if not is_rollup
+            ]
+            if not segments:
+                return None
+            path = segments[-1]
+        try:
+            # leftovers of a previous run in the same directory
+            if os.stat(path).st_mtime < self.started_at - STALE_MARGIN:
+                return None
+        except FileNotFoundError:
+            return None
+        return path
+
+    def read(self):
+        """Returns what was appended since the last read: a list of chunks."""
+        path = self._current()
+        if path is None:
+            return []
+        chunks = []
+        if self.tail is not None and self.tail.path != path:
+            chunks.append(self.tail.read())
+            self.tail.close()
+            self.tail = None
+        if self.tail is None:
+            klass = NpyTail if path.endswith(".npy") else LinesTail
+            self.tail = klass(path)
+        chunks.append(self.tail.read())
+        return [chunk for chunk in chunks if chunk is not None]
+
+    def close(self):
+        if self.tail is not None:
+            self.tail.close()
+            self.tail = None
+
+
+def discover_streams(target_dir):
+    """Returns the {name: location} of the series of a target directory."""
+    found = {}
+    segments = os.path.join(target_dir, SEGMENTS_DIR)
+    if os.path.isdir(segments):
+        for name in os.listdir(segments):
+            found[name] = os.path.join(segments, name)
+    if os.path.isdir(target_dir):
+        for filename in os.listdir(target_dir):
+            name, ext = os.path.splitext(filename)
+            if ext == ".npy" or filename == STATSD_FILE:
+                found.setdefault(name, os.path.join(target_dir, filename))
+    return found
+
+
+def plugin_graphs(plugins):
+    """Returns the live specs of the graphs of started plugins, per series."""
+    graphs = {}
+    for plugin in plugins:
+        data_path = getattr(plugin, "data_path", None)
+        if data_path is None:
+            continue
+        name = os.path.splitext(os.path.basename(data_path))[0]
+        specs = [graph.live_spec() for graph in plugin.get_graphs()]
+        graphs[name] = [spec for spec in specs if spec is not None]
+    return graphs
+
+
+def _columns(records):
+    columns = {}
+    for name in records.dtype.names:
+        column = records[name]
+        if column.dtype.kind == "f":
+            # NaN is not valid JSON
+            column = np.where(np.isfinite(column), column, None)
+        columns[name] = column.tolist()
+    return columns
+
+
+def _event(kind, payload):
+    data = json.dumps(payload, separators=(",", ":"))
+    return f"event: {kind}\ndata: {data}\n\n".encode("utf8")
+
+
+class LiveServer:
+    """Serves the live page and the /events stream of a run.
+
+    `started_at` is the start of the run: older files in the target
+    directory are ignored. Clients are sent what's new every `interval`
+    seconds.
+    """
+
+    def __init__(
+        self,
+        target_dir,
+        port,
+        host="127.0.0.1",
+        interval=1.0,
+        graphs=None,
+        title="Performance Report",
+        started_at=None,
+    ):
+        self.target_dir = target_dir
+        self.port = port
+        self.host = host
+        self.interval = interval
+        self.graphs = graphs or {}
+        self.title = title
+        self.started_at = time.time() if started_at is None else started_at
+        self.server = None
+        self.clients = 0
+        self._closing = None
+        self.environment = Environment(
+            loader=FileSystemLoader(os.path.join(HERE, "templates"))
+        )
+
+    @property
+    def url(self):
+        return f"http://{self.host}:{self.port}/"
+
+    async def start(self):
+        self._closing = asyncio.Event()
+        self.server = await asyncio.start_server(self._handle, self.host, self.port)
+        # the port is picked by the system when 0
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self
+
+    async def close(self):
+        if self.server is None:
+            return
+        # clients get the last records and an "end" event
+        self._closing.set()
+        self.server.close()
+        await self.server.wait_closed()
+        self.server = None
+
+    def _poll(self, streams, names):
+        for name, location in discover_streams(self.target_dir).items():
+            if name in streams or (names is not None and name not in names):
+                continue
+            streams[name] = Stream(name, location, self.started_at)
+
+        payloads = []
+        for name, stream in streams.items():
+            for chunk in stream.read():
+                if isinstance(chunk, np.ndarray):
+                    payloads.append({"stream": name, "columns": _columns(chunk)})
+                else:
+                    payloads.append({"stream": name, "entries": chunk})
+        return payloads
+
+    async def _respond(self, writer, status, content_type, body):
+        headers = (
+            f"HTTP/1.1 {status}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            "Connection: close\r\n\r\n"
+        )
+        writer.write(headers.encode("latin1"))
+        writer.write(body)
+        await writer.drain()
+
+    async def _events(self, writer, query):
+        names = None
+        if "streams" in query:
+            names = set(",".join(query["streams"]).split(","))
+        writer.write(
+            b"HTTP/1.1 200 OK\r\n"
+            b"Content-Type: text/event-stream\r\n"
+            b"Cache-Control: no-cache\r\n"
+            b"Connection: close\r\n\r\n"
+        )
+        writer.write(_event("graphs", self.graphs))
+        await writer.drain()
+
+        loop = asyncio.get_running_loop()
+        streams = {}
+        self.clients += 1
+        try:
+            while True:
+                closing = self._closing.is_set()
+                # files are read in the thread pool, like blocking probes
+                payloads = await loop.run_in_executor(None, self._poll, streams, names)
+                for payload in payloads:
+                    writer.write(_event("records", payload))
+                if closing:
+                    writer.write(_event("end", {}))
+                    await writer.drain()
+                    return
+                if not payloads:
+                    # also detects clients that went away
+                    writer.write(b": ping\n\n")
+                await writer.drain()
+                with suppress(asyncio.TimeoutError):
+                    await asyncio.wait_for(self._closing.wait(), self.interval)
+        finally:
+            self.clients -= 1
+            for stream in streams.values():
+                stream.close()
+
+    async def _handle(self, reader, writer):
+        try:
+            request = await asyncio.wait_for(reader.readline(), REQUEST_TIMEOUT)
+            while True:
+                line = await asyncio.wait_for(reader.readline(), REQUEST_TIMEOUT)
+                if line in (b"\r\n", b"\n", b""):
+                    break
+
+            parts = request.decode("latin1").split()
+            if len(parts) < 2 or parts[0] != "GET":
+                await self._respond(writer, "405 Method Not Allowed", "text/plain", b"")
+                return
+
+            url = urllib.parse.urlsplit(parts[1])
+            if url.path == "/":
+                template = self.environment.get_template("live.html")
+                page = template.render(args={"title": self.title})
+                await self._respond(
+                    writer, "200 OK", "text/html; charset=utf-8", page.encode("utf8")
+                )
+            elif url.path == "/charts.js":
+                with open(os.path.join(HERE, "templates", "charts.js"), "rb") as f:
+                    script = f.read()
+                await self._respond(writer, "200 OK", "text/javascript", script)
+            elif url.path == "/events":
+                await self._events(writer, urllib.parse.parse_qs(url.query))
+            else:
+                await self._respond(writer, "404 Not Found", "text/plain", b"")
+        except (asyncio.TimeoutError, ConnectionError) as e:
+            logger.debug(f"[live] {e!r}")
+        finally:
+            writer.close()
+            with suppress(ConnectionError):
+                await writer.wait_closed()
@@ -0,0 +1,152 @@
+#
+# Licensed to Elasticsearch B.V. under one or more contributor
+# license agreements. See the NOTICE file distributed with
+# this work for additional information regarding copyright
+# ownership. Elasticsearch B.V. licenses this file to you under
+# the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# 	http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+"""
+Overhead -- what perf8 itself costs.
+
+The watcher and the runner record the CPU and wall time of each of
+their parts in an OverheadTracker: the probes and statsd flushes (CPU
+time of the thread running them), and the plugins reports, which can
+run subprocesses like py-spy or dot.
+
+The CPU time of the command is what's left of the CPU time of the
+watcher children, once the subprocesses of perf8 and the reports
+built by the runner are deducted. In-process plugins also slow the
+command down while it runs, that part can't be told apart.
+"""
+
+import json
+import os
+import resource
+import sys
+import time
+from contextlib import contextmanager
+
+import humanize
+
+
+def cpu_times():
+    """Returns the CPU seconds of the process and of its waited children."""
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return own.ru_utime + own.ru_stime, children.ru_utime + children.ru_stime
+
+
+def peak_rss():
+    """Returns the peak RSS of the process in bytes."""
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return rss if sys.platform == "darwin" else rss * 1024
+
+
+def load_run_summary(run_summary):
+    """Returns what the runner wrote in report.json, if it's there.
+
+    "overhead" has the entries of the runner OverheadTracker, "command"
+    the wall time, CPU time and peak RSS of the command.
+    """
+    if run_summary is None or not os.path.exists(run_summary):
+        return {}
+    with open(run_summary) as f:
+        return json.load(f)
+
+
+class OverheadTracker:
+    """Accumulates the CPU and wall time of the parts of perf8.
+
+    `cpu` is spent in the process, `children_cpu` in the subprocesses
+    that were waited for during the measure.
+    """
+
+    def __init__(self, process="watcher"):
+        self.process = process
+        self.components = {}
+        self._started_cpu = cpu_times()
+        self._started = time.perf_counter()
+
+    def add(self, name, cpu=0.0, wall=0.0, calls=1, children_cpu=0.0):
+        entry = self.components.get(name)
+        if entry is None:
+            entry = self.components[name] = {
+                "name": name,
+                "process": self.process,
+                "calls": 0,
+                "cpu": 0.0,
+                "children_cpu": 0.0,
+                "wall": 0.0,
+            }
+        entry["calls"] += calls
+        entry["cpu"] += cpu
+        entry["children_cpu"] += children_cpu
+        entry["wall"] += wall
+
+    @contextmanager
+    def measure(self, name):
+        own, children = cpu_times()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - start
+            own_end, children_end = cpu_times()
+            self.add(
+                name,
+                cpu=own_end - own,
+                wall=wall,
+                children_cpu=children_end - children,
+            )
+
+    def add_probes(self, stats):
+        """Adds the probes of a ProbeScheduler."""
+        for probe in stats.values():
+            self.add(
+                f"{probe.name} probe",
+                cpu=probe.cpu_total,
+                wall=probe.duration_total,
+                calls=probe.ticks,
+            )
+
+    def entries(self):
+        return list(self.components.values())
+
+    def summary(self, runner_entries=()):
+        """Returns the overhead of the run, for the report.
+
+        `runner_entries` are the entries measured in the runner process,
+        which is one of the watcher children.
+        """
+        own, children = cpu_times()
+        own -= self._started_cpu[0]
+        children -= self._started_cpu[1]
+
+        entries = self.entries()
+        subprocesses = sum(entry["children_cpu"] for entry in entries)
+        runner = sum(entry["cpu"] + entry["children_cpu"] for entry in runner_entries)
+        perf8_cpu = own + subprocesses + runner
+        command_cpu = max(children - subprocesses - runner, 0.0)
+        rss = peak_rss()
+        return {
+            "components": entries + list(runner_entries),
+            "watcher_cpu": own,
+            "perf8_cpu": perf8_cpu,
+            "command_cpu": command_cpu,
+            "ratio": perf8_cpu / command_cpu if command_cpu else None,
+            "wall": time.perf_counter() - self._started,
+            "peak_rss": humanize.naturalsize(rss, binary=True),
+            "peak_rss_bytes": rss,
+        }
@@ -16,33 +16,142 @@
 # specific language governing permissions and limitations
 # under the License.
 #
-import csv
 import os
-import matplotlib.pyplot as plt
+import json
+import multiprocessing
+import pickle
+from concurrent.futures import ProcessPoolExecutor
+
+import humanize
 import matplotlib.ticker as tkr
+import numpy as np
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.colors import to_hex
+from matplotlib.figure import Figure
+
+from perf8.datafile import load_datafile
+from perf8.downsample import lttb, minmax_envelope
 
-plt.figure(figsize=(14, 10))
+MAX_MARKERS = 500
+MAX_POINTS = 2000
+# with fewer graphs, starting the workers costs more than it saves
+MIN_PARALLEL_GRAPHS = 4
 
 
 class Line:
-    def __init__(self, samples_or_extractor, title, threshold, color):
-        if callable(samples_or_extractor):
-            self.extractor = samples_or_extractor
-            self.samples = None
-        else:
-            self.samples = samples_or_extractor
-            self.extractor = None
+    """A line of a graph.
+
+    `source` is either:
+
+    - a column name of the data file records
+    - a callable receiving all the records and returning a vector,
+      e.g. `lambda data: data["read_bytes"] + data["write_bytes"]`
+    - samples, as a sequence of (x, y) tuples or a (xs, ys) tuple of arrays
+
+    Values are multiplied by `scale`. `band` is an optional (low, high)
+    pair of column names, callables or vectors aligned with the line
+    points, drawn as a shaded area, e.g. percentiles around a median.
+    """
+
+    def __init__(self, source, title, threshold, color, scale=1, band=None):
+        self.source = source
         self.title = title
         self.threshold = threshold
         self.color = color
+        self.scale = scale
+        self.band = band
+
+    def get_xy(self, data=None):
+        if isinstance(self.source, str):
+            y = data[self.source]
+            x = get_x(data)
+        elif callable(self.source):
+            y = self.source(data)
+            x = get_x(data)
+        else:
+            samples = self.source
+            if isinstance(samples, tuple) and len(samples) == 2:
+                x, y = samples
+            else:
+                samples = np.asarray(samples, dtype=float).reshape(-1, 2)
+                x, y = samples[:, 0], samples[:, 1]
+
+        x = np.asarray(x, dtype=float)
+        y = np.asarray(y, dtype=float)
+        if self.scale != 1:
+            y = y * self.scale
+        return x, y
+
+    def get_band(self, data=None):
+        if self.band is None:
+            return None
+        band = []
+        for source in self.band:
+            if isinstance(source, str):
+                values = data[source]
+            elif callable(source):
+                values = source(data)
+            else:
+                values = source
+            band.append(np.asarray(values, dtype=float) * self.scale)
+        return tuple(band)
+
+
+def stacked_lines(x, layers):
+    """Returns lines drawing `layers` as stacked areas.
+
+    `layers` is a list of (title, y, color). Each line is the top of its
+    layer, and its band is the area between the layer below and itself.
+    """
+    lines = []
+    bottom = np.zeros(len(x))
+    for title, y, color in layers:
+        top = bottom + np.nan_to_num(np.asarray(y, dtype=float))
+        lines.append(Line((x, top), title, None, color, band=(bottom, top)))
+        bottom = top
+    return lines
+
+
+def _compact(values):
+    # 6 significant digits are plenty for a chart, NaN is not valid JSON
+    return [
+        None if np.isnan(value) else float(f"{value:.6g}")
+        for value in np.asarray(values, dtype=float)
+    ]
+
+
+def get_x(data):
+    # the x axis is the duration since the start of the probing
+    if "since" in data.dtype.names:
+        return data["since"]
+    return data[data.dtype.names[-1]]
 
 
 class Graph:
-    def __init__(self, title, target_dir, target_file, ylabel, yformatter, *lines):
+    def __init__(
+        self,
+        title,
+        target_dir,
+        target_file,
+        ylabel,
+        yformatter,
+        *lines,
+        max_points=None,
+        hlines=None,
+        xlabel="Duration (s)",
+    ):
         self.lines = lines
+        # (value, title, color) horizontal lines, e.g. a limit
+        self.hlines = list(hlines or ())
+        # longer series are downsampled, see perf8.downsample
+        self.max_points = max_points
         self.target_file = target_file
         self.target_dir = target_dir
         self.plot_file = os.path.join(target_dir, target_file)
+        self.series_file = os.path.join(
+            target_dir, "series", os.path.splitext(target_file)[0] + ".js"
+        )
+        self.xlabel = xlabel
         self.ylabel = ylabel
         self.title = title
         self.yformatter = yformatter
@@ -66,77 +175,240 @@ class Graph:
             bbox=dict(boxstyle="square,pad=0.3", fc="w", ec="red"),
         )
 
-    def generate(self, plugin, path_or_rows=None):
-        if isinstance(path_or_rows, str):
-            with open(path_or_rows) as cvsfile:
-                samples = [line for line in csv.reader(cvsfile, delimiter=",")]
-        else:
-            samples = path_or_rows
+    def _prepare(self, line, data):
+        x, y = line.get_xy(data)
+        band = line.get_band(data)
+        prepared = {"x": x, "y": y, "envelope": None, "band": band}
 
-        plt.clf()
+        if len(y) > 0 and not np.isnan(y).all():
+            i_max = int(np.nanargmax(y))
+            prepared["max"] = x[i_max], y[i_max]
+        else:
+            i_max = 0
+            prepared["max"] = 0, 0
 
-        ax = plt.gca()
+        max_points = self.max_points or MAX_POINTS
+        if len(x) > max_points:
+            # the band already shows the spread of the values
+            if band is None:
+                prepared["envelope"] = minmax_envelope(x, y, max_points // 2)
+            # the max point is always kept, so the line reaches it
+            indices = np.union1d(lttb(x, y, max_points), [i_max])
+            prepared["x"], prepared["y"] = x[indices], y[indices]
+            if band is not None:
+                prepared["band"] = tuple(values[indices] for values in band)
 
-        for line in self.lines:
-            x = []
-            y = []
-            y_max = x_max = 0
+        prepared["crossed"] = line.threshold is not None and bool(
+            np.any(y > line.threshold)
+        )
+        return prepared
 
-            if samples is None:
-                line_samples = line.samples
-                extract = False
-            else:
-                extract = True
-                line_samples = samples
+    def render(self, data=None):
+        # data is a Datafile records array or the path of its .npy file,
+        # or None when lines have samples
+        if isinstance(data, str):
+            data = load_datafile(data)
 
-            for i, row in enumerate(line_samples):
-                if extract and i == 0:
-                    continue
+        # one figure per graph, no pyplot global state
+        fig = Figure(figsize=(14, 10))
+        FigureCanvasAgg(fig)
+        ax = fig.add_subplot()
+        lines = []
 
-                if extract:
-                    value = line.extractor(row)
-                    x_value = row[-1]
-                else:
-                    x_value, value = row
+        for line in self.lines:
+            prepared = self._prepare(line, data)
+            lines.append((line, prepared))
+            x, y = prepared["x"], prepared["y"]
 
-                if value > y_max:
-                    y_max = value
-                    x_max = x_value
+            if prepared["envelope"] is not None:
+                ax.fill_between(
+                    *prepared["envelope"],
+                    step="post",
+                    color=line.color,
+                    alpha=0.2,
+                    linewidth=0,
+                )
 
-                x.append(x_value)
-                y.append(value)
+            if prepared["band"] is not None:
+                ax.fill_between(
+                    x, *prepared["band"], color=line.color, alpha=0.2, linewidth=0
+                )
 
-            plt.plot(
-                x, y, color=line.color, linestyle="dashed", marker="o", label=line.title
+            # markers are unreadable and slow to draw on long series
+            marker = "o" if len(x) <= MAX_MARKERS else None
+            ax.plot(
+                x,
+                y,
+                color=line.color,
+                linestyle="dashed",
+                marker=marker,
+                label=line.title,
             )
-            if x:
-                xtick_step = int(len(x) / 10) if len(x) > 9 else 1
-                existing_ticks = ax.get_xticks()
-                ticks = list(existing_ticks[::xtick_step])
-                # If last tick is missing, add it!
-                if ticks[-1] != x[-1]:
-                    ticks.append(existing_ticks[-1])
-                ax.set_xticks(ticks)
-
-            if line.threshold is not None and line.threshold < y_max:
-                plt.axhline(line.threshold, color="r")
-
-            plt.plot(x_max, y_max, "ro")
+            if len(x) > 0:
+                ax.xaxis.set_major_locator(tkr.MaxNLocator(nbins=min(len(x), 10)))
+
+            if prepared["crossed"]:
+                ax.axhline(line.threshold, color="r")
+
+            x_max, y_max = prepared["max"]
+            ax.plot(x_max, y_max, "ro")
             self.annotate_max(x_max, y_max, ax, ax.yaxis)
 
-        plt.legend(loc=3)
-        plt.xticks(rotation=25)
-        plt.xlabel("Duration (s)")
-        plt.ylabel(self.ylabel)
-        ax = plt.gca()
+        for value, title, color in self.hlines:
+            ax.axhline(value, color=color, linestyle="dotted", label=title)
+
+        ax.legend(loc=3)
+        ax.tick_params(axis="x", labelrotation=25)
+        ax.set_xlabel(self.xlabel)
+        ax.set_ylabel(self.ylabel)
 
         if self.yformatter:
             ax.yaxis.set_major_formatter(self.yformatter)
         else:
             ax.yaxis.set_major_formatter(tkr.StrMethodFormatter("{x:,g}"))
 
-        plt.title(self.title, fontsize=20)
-        plt.grid()
+        ax.set_title(self.title, fontsize=20)
+        ax.grid()
+        # zlib level 1 encodes faster than the default level 6, for files
+        # about 10% larger
+        fig.savefig(self.plot_file, pil_kwargs={"compress_level": 1})
+        self.export_series(lines)
+        return self.plot_file
+
+    def _value_format(self):
+        # tells the chart script how to display values
+        if isinstance(self.yformatter, tkr.PercentFormatter):
+            return "percent"
+        if isinstance(self.yformatter, tkr.FuncFormatter):
+            if self.yformatter.func is humanize.naturalsize:
+                return "bytes"
+        return "number"
+
+    def live_spec(self):
+        """Describes the graph for the live server, see perf8.live.
+
+        Only lines drawing a column can be updated as records arrive,
+        the graph is skipped when it has none.
+        """
+        lines = [
+            {"column": line.source, "title": line.title, "color": to_hex(line.color)}
+            for line in self.lines
+            if isinstance(line.source, str)
+        ]
+        if not lines:
+            return None
+        return {
+            "title": self.title,
+            "ylabel": self.ylabel,
+            "format": self._value_format(),
+            "lines": lines,
+            "hlines": [
+                {"value": value, "title": title, "color": to_hex(color)}
+                for value, title, color in self.hlines
+            ],
+        }
+
+    def export_series(self, lines):
+        """Writes the plotted series in a sidecar script for interactive reports.
+
+        The script calls `perf8Charts.register(name, spec)`. It is loaded
+        with a <script> tag only when its tab is opened, which also works
+        for reports opened from the local filesystem.
+        """
+        spec = {
+            "title": self.title,
+            "ylabel": self.ylabel,
+            "format": self._value_format(),
+            "lines": [],
+            "hlines": [
+                {"value": value, "title": title, "color": to_hex(color)}
+                for value, title, color in self.hlines
+            ],
+        }
+        for line, prepared in lines:
+            item = {
+                "title": line.title,
+                "color": to_hex(line.color),
+                "x": _compact(prepared["x"]),
+                "y": _compact(prepared["y"]),
+                "max": _compact(prepared["max"]),
+                "threshold": line.threshold if prepared["crossed"] else None,
+            }
+            if prepared["envelope"] is not None:
+                env_x, env_min, env_max = prepared["envelope"]
+                item["envelope"] = {
+                    "x": _compact(env_x),
+                    "min": _compact(env_min),
+                    "max": _compact(env_max),
+                }
+            if prepared["band"] is not None:
+                low, high = prepared["band"]
+                item["band"] = {"low": _compact(low), "high": _compact(high)}
+            spec["lines"].append(item)
+
+        os.makedirs(os.path.dirname(self.series_file), exist_ok=True)
+        name = os.path.basename(self.series_file)
+        with open(self.series_file, "w") as f:
+            f.write(f"perf8Charts.register({json.dumps(name)}, ")
+            f.write(json.dumps(spec, separators=(",", ":")))
+            f.write(");\n")
+        return self.series_file
+
+    def as_report(self):
+        return {
+            "label": self.title,
+            "file": self.plot_file,
+            "series": self.series_file,
+            "type": "image",
+        }
+
+    def generate(self, plugin, data=None):
+        self.render(data)
         plugin.info(f"Saved plot file at {self.plot_file}")
-        plt.savefig(self.plot_file)
         return self.plot_file
+
+
+def _render(graph, data):
+    return graph.render(data)
+
+
+def _mp_context():
+    # workers are not forked: the watcher runs threads, and forking a
+    # multithreaded process can deadlock
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context("forkserver")
+        # the server imports matplotlib once, workers are forked from it
+        context.set_forkserver_preload([__name__])
+        return context
+    return multiprocessing.get_context("spawn")
+
+
+def render_graphs(plugin, graphs, data=None, workers=None):
+    """Renders graphs in a process pool.
+
+    `data` is passed to every graph. Give the path of the Datafile rather
+    than its records so workers memory-map it instead of receiving a copy.
+    Falls back to rendering in the current process for a single CPU, for
+    a few graphs, or for graphs that can't be pickled (lines with lambdas).
+    """
+    if workers is None:
+        workers = min(len(graphs), os.cpu_count() or 1)
+        if len(graphs) < MIN_PARALLEL_GRAPHS:
+            workers = 1
+
+    if workers > 1:
+        try:
+            pickle.dumps((graphs, data))
+        except (pickle.PicklingError, AttributeError, TypeError) as e:
+            plugin.debug(f"Can't render graphs in parallel: {e}")
+            workers = 1
+
+    if workers <= 1:
+        return [graph.generate(plugin, data) for graph in graphs]
+
+    with ProcessPoolExecutor(max_workers=workers, mp_context=_mp_context()) as executor:
+        files = list(executor.map(_render, graphs, [data] * len(graphs)))
+
+    for file in files:
+        plugin.info(f"Saved plot file at {file}")
+    return files
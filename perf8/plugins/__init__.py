@@ -17,4 +17,12 @@
 # under the License.
 #
 # loads plugins
-from perf8.plugins import _psutil, _cprofile, _memray, _pyspy, _asyncstats  # NOQA
+from perf8.plugins import (  # NOQA
+    _psutil,
+    _procfs,
+    _cgroup,
+    _cprofile,
+    _memray,
+    _pyspy,
+    _asyncstats,
+)
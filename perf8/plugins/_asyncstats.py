@@ -22,7 +22,7 @@ import asyncio
 
 from perf8.plugins.base import AsyncBasePlugin, register_plugin
 from perf8.plot import Graph, Line
-from perf8.reporter import Datafile
+from perf8.datafile import Datafile
 
 
 class EventLoopMonitoring(AsyncBasePlugin):
@@ -36,14 +36,15 @@ class EventLoopMonitoring(AsyncBasePlugin):
         self._idle_time = 5
         self._running = False
         self.proc_info = None
+        self.data_path = os.path.join(args.target_dir, "loop.npy")
         self.report_file = os.path.join(args.target_dir, "loop.csv")
         self.rows = (
             "lag",
-            "num_tasks",
+            ("num_tasks", "<i8"),
             "when",
             "since",
         )
-        self.data_file = Datafile(self.report_file, self.rows)
+        self.data_file = Datafile(self.data_path, self.rows)
 
     async def _probe(self):
         while self._running:
@@ -55,12 +56,12 @@ class EventLoopMonitoring(AsyncBasePlugin):
                 lag,
                 len(asyncio.all_tasks(self.loop)),
                 when,
-                int(when - self.started_at),
+                round(when - self.started_at, 3),
             )
             try:
                 self.data_file.add(metrics)
             except ValueError:
-                self.warning(f"Failed to write in {self.report_file}")
+                self.warning(f"Failed to write in {self.data_path}")
 
     async def _enable(self, loop):
         self.loop = loop
@@ -80,12 +81,7 @@ class EventLoopMonitoring(AsyncBasePlugin):
             return []
 
         self.data_file.close()
-
-        def extract_lag(row):
-            return float(row[0])
-
-        def extract_tasks(row):
-            return int(row[1])
+        self.data_file.export_csv(self.report_file)
 
         graphs = [
             Graph(
@@ -94,7 +90,7 @@ class EventLoopMonitoring(AsyncBasePlugin):
                 "loop_lag.png",
                 "Seconds",
                 None,
-                Line(extract_lag, "Event loop lag", None, "g"),
+                Line("lag", "Event loop lag", None, "g"),
             ),
             Graph(
                 "Tasks concurrency",
@@ -102,20 +98,22 @@ class EventLoopMonitoring(AsyncBasePlugin):
                 "loop_coro.png",
                 "Tasks",
                 None,
-                Line(extract_tasks, "Tasks concurrency", None, "g"),
+                Line("num_tasks", "Tasks concurrency", None, "g"),
             ),
         ]
 
-        self.generate_plots(self.report_file, *graphs)
-        return [
-            {"label": graph.title, "file": graph.plot_file, "type": "image"}
-            for graph in graphs
-        ] + [
+        self.generate_plots(self.data_file, *graphs)
+        return [graph.as_report() for graph in graphs] + [
             {
                 "label": "Event loop CSV data",
                 "file": self.report_file,
                 "type": "artifact",
             },
+            {
+                "label": "Event loop NumPy data",
+                "file": self.data_path,
+                "type": "artifact",
+            },
         ]
 
 
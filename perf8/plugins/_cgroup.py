@@ -0,0 +1,185 @@
+#
+# Licensed to Elasticsearch B.V. under one or more contributor
+# license agreements. See the NOTICE file distributed with
+# this work for additional information regarding copyright
+# ownership. Elasticsearch B.V. licenses this file to you under
+# the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# 	http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+"""
+cgroup -- container limits, CPU throttling and pressure stalls (Linux).
+
+Samples the cgroup of the watched process: memory usage against its
+limit, the CFS quota and how often the process was throttled by it, and
+the share of time tasks were stalled on CPU, memory and I/O (PSI).
+"""
+
+import os
+import time
+from sys import platform
+
+import humanize
+import matplotlib.ticker as tkr
+
+from perf8.cgroup import Cgroup
+from perf8.plugins.base import BasePlugin, register_plugin
+from perf8.plot import Graph, Line
+from perf8.rates import Rates
+
+# rates of the cumulative fields of Cgroup.read(), in percent of the time
+PRESSURE_ROWS = (
+    "cpu_pressure_some_pct",
+    "memory_pressure_some_pct",
+    "memory_pressure_full_pct",
+    "io_pressure_some_pct",
+    "io_pressure_full_pct",
+)
+
+
+class CgroupWatcher(BasePlugin):
+    name = "cgroup"
+    in_process = False
+    description = "cgroup limits, CPU throttling and pressure stall information"
+    priority = 0
+    supported = platform.startswith("linux")
+
+    def __init__(self, args):
+        super().__init__(args)
+        self.cgroup = None
+        self.memory_limit = 0
+        self.data_file = None
+        self.data_path = os.path.join(self.target_dir, "cgroup.npy")
+        self.report_file = os.path.join(self.target_dir, "cgroup.csv")
+        self.rows = (
+            *((field, "<i8") for field in Cgroup.FIELDS),
+            "cpu_limit",
+            "throttled_pct",
+            "throttled_periods_pct",
+            *PRESSURE_ROWS,
+            "when",
+            "since",
+        )
+
+    def _start(self, pid):
+        self.cgroup = Cgroup(pid)
+        if not self.cgroup.available:
+            self.warning(f"Could not find the cgroup of {pid}")
+        else:
+            self.debug(f"Reading cgroup v{self.cgroup.version} files")
+        self.started_at = time.time()
+        self.rates = Rates(8)
+        self.data_file = self.open_datafile(self.data_path, self.rows)
+
+    # cgroup files are in memory, reading them doesn't block
+    async def probe(self, pid):
+        try:
+            metrics = self.cgroup.read()
+        except (OSError, ValueError) as e:
+            self.warning(f"Could not read the cgroup files: {e!r}")
+            return
+
+        memory_max, quota, period = metrics[1:4]
+        self.memory_limit = memory_max
+        cpu_limit = quota / period if quota and period else 0
+
+        periods, throttled, throttled_usec, *pressures = self.rates.update(metrics[4:])
+        # microseconds per second to percent of the time
+        throttled_pct = throttled_usec / 10000
+        periods_pct = throttled / periods * 100 if periods else 0
+        pressures = tuple(usec / 10000 for usec in pressures)
+
+        probed_at = time.time()
+        since = round(probed_at - self.started_at, 3)
+        self.data_file.add(
+            (
+                *metrics,
+                cpu_limit,
+                throttled_pct,
+                periods_pct,
+                *pressures,
+                probed_at,
+                since,
+            )
+        )
+
+    def get_graphs(self):
+        hlines = []
+        if self.memory_limit:
+            limit = humanize.naturalsize(self.memory_limit, binary=True)
+            hlines.append((self.memory_limit, f"limit ({limit})", "r"))
+
+        return [
+            Graph(
+                "cgroup Memory",
+                self.target_dir,
+                "cgroup_memory.png",
+                "Bytes",
+                tkr.FuncFormatter(humanize.naturalsize),
+                Line("memory_current", "usage", None, "g"),
+                hlines=hlines,
+            ),
+            Graph(
+                "cgroup CPU Throttling",
+                self.target_dir,
+                "cgroup_throttling.png",
+                "%",
+                tkr.PercentFormatter(),
+                Line("throttled_pct", "throttled time", None, "r"),
+                Line("throttled_periods_pct", "throttled periods", None, "b"),
+            ),
+            Graph(
+                "cgroup CPU Limit",
+                self.target_dir,
+                "cgroup_cpu_limit.png",
+                "cores",
+                None,
+                Line("cpu_limit", "CFS quota (0 = none)", None, "g"),
+            ),
+            Graph(
+                "cgroup Pressure Stalls",
+                self.target_dir,
+                "cgroup_pressure.png",
+                "% of time",
+                tkr.PercentFormatter(),
+                Line("cpu_pressure_some_pct", "cpu some", None, "g"),
+                Line("memory_pressure_some_pct", "memory some", None, "b"),
+                Line("memory_pressure_full_pct", "memory full", None, "c"),
+                Line("io_pressure_some_pct", "io some", None, "r"),
+                Line("io_pressure_full_pct", "io full", None, "m"),
+            ),
+        ]
+
+    def _stop(self, pid):
+        if self.cgroup is not None:
+            self.cgroup.close()
+
+        if self.data_file is None or self.data_file.count == 0:
+            self.warning("No data collected for cgroup")
+            return []
+
+        self.data_file.close()
+        self.data_file.export_csv(self.report_file)
+        graphs = self.get_graphs()
+        self.generate_plots(self.data_file, *graphs)
+
+        return [graph.as_report() for graph in graphs] + [
+            {"label": "cgroup CSV data", "file": self.report_file, "type": "artifact"},
+            {
+                "label": "cgroup NumPy data",
+                "file": self.data_file.location,
+                "type": "artifact",
+            },
+        ]
+
+
+register_plugin(CgroupWatcher)
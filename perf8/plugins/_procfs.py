@@ -0,0 +1,300 @@
+#
+# Licensed to Elasticsearch B.V. under one or more contributor
+# license agreements. See the NOTICE file distributed with
+# this work for additional information regarding copyright
+# ownership. Elasticsearch B.V. licenses this file to you under
+# the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# 	http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+"""
+procfs -- low overhead process metrics read directly from /proc (Linux).
+
+The /proc/<pid> files are opened once and re-read with pread() into
+buffers allocated at start, then parsed in place with precompiled
+patterns. A probe takes a few dozen microseconds, so the process can be
+sampled at 100Hz and more.
+"""
+
+import os
+import re
+import time
+from sys import platform
+
+import humanize
+import matplotlib.ticker as tkr
+
+from perf8.plugins.base import BasePlugin, register_plugin
+from perf8.plot import Graph, Line
+from perf8.rates import Rates
+
+BUFFER_SIZE = 4096
+
+# /proc/<pid>/stat fields after the command name, see proc(5): utime (14),
+# stime (15), num_threads (20) and rss (24)
+_SKIP = rb" \S+"
+STAT = re.compile(
+    b"".join(
+        (
+            rb"\)",
+            _SKIP * 11,
+            rb" (\d+) (\d+)",
+            _SKIP * 4,
+            rb" (\d+)",
+            _SKIP * 3,
+            rb" (\d+)",
+        )
+    )
+)
+CTX_SWITCHES = re.compile(
+    rb"voluntary_ctxt_switches:\s+(\d+)\s+nonvoluntary_ctxt_switches:\s+(\d+)"
+)
+IO = re.compile(
+    rb"rchar: (\d+)\s+wchar: (\d+)\s+syscr: \d+\s+syscw: \d+\s+"
+    rb"read_bytes: (\d+)\s+write_bytes: (\d+)"
+)
+
+
+class ProcFiles:
+    """Reads the metrics of a process from its /proc files.
+
+    `read()` returns a tuple of integers in the order of `FIELDS`. The
+    io file is optional: it is only readable for our own processes.
+    """
+
+    FIELDS = (
+        "rss",
+        "num_threads",
+        "num_fds",
+        "ctx_switch",
+        "ctx_switch_involuntary",
+        "cpu_user",
+        "cpu_system",
+        "io_read_chars",
+        "io_write_chars",
+        "io_read_bytes",
+        "io_write_bytes",
+    )
+
+    def __init__(self, pid, root="/proc"):
+        self.pid = pid
+        self.path = os.path.join(root, str(pid))
+        self.clock_ticks = os.sysconf("SC_CLK_TCK")
+        self.page_size = os.sysconf("SC_PAGE_SIZE")
+        self._fds = {}
+        self._buffers = {}
+        for name in ("stat", "status", "io"):
+            try:
+                self._fds[name] = os.open(os.path.join(self.path, name), os.O_RDONLY)
+            except PermissionError:
+                continue
+            self._buffers[name] = [bytearray(BUFFER_SIZE)]
+        # since Linux 6.2 the size of the fd directory is the number of fds
+        self._fd_dir = os.path.join(self.path, "fd")
+        self._fd_dir_size = os.stat(self._fd_dir).st_size > 0
+
+    def _read(self, name):
+        buffers = self._buffers[name]
+        size = os.preadv(self._fds[name], buffers, 0)
+        if size == len(buffers[0]):
+            # the file did not fit, we grow the buffer and read again
+            buffers[0] = bytearray(len(buffers[0]) * 2)
+            return self._read(name)
+        return buffers[0], size
+
+    def num_fds(self):
+        if self._fd_dir_size:
+            return os.stat(self._fd_dir).st_size
+        return len(os.listdir(self._fd_dir))
+
+    def read(self):
+        buffer, size = self._read("stat")
+        utime, stime, num_threads, rss = STAT.search(
+            buffer, buffer.rfind(b")", 0, size), size
+        ).groups()
+
+        buffer, size = self._read("status")
+        voluntary, involuntary = CTX_SWITCHES.search(buffer, 0, size).groups()
+
+        if "io" in self._fds:
+            buffer, size = self._read("io")
+            io = IO.search(buffer, 0, size).groups()
+        else:
+            io = (0, 0, 0, 0)
+
+        return (
+            int(rss) * self.page_size,
+            int(num_threads),
+            self.num_fds(),
+            int(voluntary),
+            int(involuntary),
+            int(utime) / self.clock_ticks,
+            int(stime) / self.clock_ticks,
+            *map(int, io),
+        )
+
+    def close(self):
+        for fd in self._fds.values():
+            os.close(fd)
+        self._fds.clear()
+
+
+class ProcfsWatcher(BasePlugin):
+    name = "procfs"
+    in_process = False
+    description = "Process metrics read from /proc, with a low overhead"
+    priority = 0
+    supported = platform.startswith("linux")
+
+    def __init__(self, args):
+        super().__init__(args)
+        self.files = None
+        self.data_file = None
+        self.data_path = os.path.join(self.target_dir, "procfs.npy")
+        self.report_file = os.path.join(self.target_dir, "procfs.csv")
+        self.rows = (
+            *((field, "<i8") for field in ProcFiles.FIELDS[:5]),
+            "cpu_user",
+            "cpu_system",
+            *((field, "<i8") for field in ProcFiles.FIELDS[7:]),
+            "cpu_user_rate",
+            "cpu_system_rate",
+            "ctx_switch_rate",
+            "ctx_switch_involuntary_rate",
+            "probe_time",
+            "when",
+            "since",
+        )
+
+    def _start(self, pid):
+        self.files = ProcFiles(pid)
+        self.started_at = time.time()
+        self.rates = Rates(4)
+        self.data_file = self.open_datafile(self.data_path, self.rows)
+
+    # /proc reads don't block and are cheaper than a hop to the thread pool,
+    # so the probe runs in the event loop
+    async def probe(self, pid):
+        started = time.perf_counter()
+        try:
+            metrics = self.files.read()
+        except (OSError, AttributeError) as e:
+            # the process is gone, or the file format is unexpected
+            self.warning(f"Could not read /proc/{pid}: {e!r}")
+            return
+        rates = self.rates.update(metrics[5:7] + metrics[3:5])
+        probe_time = time.perf_counter() - started
+        probed_at = time.time()
+        since = round(probed_at - self.started_at, 3)
+        self.data_file.add(metrics + rates + (probe_time, probed_at, since))
+
+    def get_graphs(self):
+        bytes_formatter = tkr.FuncFormatter(humanize.naturalsize)
+        return [
+            Graph(
+                "procfs Memory Usage",
+                self.target_dir,
+                "procfs_rss.png",
+                "Bytes",
+                bytes_formatter,
+                Line("rss", "RSS", None, "g"),
+            ),
+            Graph(
+                "procfs CPU Usage",
+                self.target_dir,
+                "procfs_cpu_rate.png",
+                f"CPU seconds/s (of {os.cpu_count()} cores)",
+                None,
+                Line("cpu_user_rate", "user", None, "g"),
+                Line("cpu_system_rate", "system", None, "r"),
+            ),
+            Graph(
+                "procfs CPU Time",
+                self.target_dir,
+                "procfs_cpu.png",
+                "seconds",
+                None,
+                Line("cpu_user", "user", None, "g"),
+                Line("cpu_system", "system", None, "r"),
+            ),
+            Graph(
+                "procfs Threads and Files",
+                self.target_dir,
+                "procfs_threads.png",
+                "Count",
+                None,
+                Line("num_threads", "threads", None, "g"),
+                Line("num_fds", "file descriptors", None, "b"),
+            ),
+            Graph(
+                "procfs Context Switches",
+                self.target_dir,
+                "procfs_ctx_switch_rate.png",
+                "switches/s",
+                None,
+                Line("ctx_switch_rate", "voluntary", None, "b"),
+                Line("ctx_switch_involuntary_rate", "involuntary", None, "r"),
+            ),
+            Graph(
+                "procfs Context Switches (total)",
+                self.target_dir,
+                "procfs_ctx_switch.png",
+                "Count",
+                None,
+                Line("ctx_switch", "voluntary", None, "b"),
+                Line("ctx_switch_involuntary", "involuntary", None, "r"),
+            ),
+            Graph(
+                "procfs I/O",
+                self.target_dir,
+                "procfs_io.png",
+                "Bytes",
+                bytes_formatter,
+                Line("io_read_chars", "read (all)", None, "c"),
+                Line("io_write_chars", "written (all)", None, "y"),
+                Line("io_read_bytes", "read (storage)", None, "b"),
+                Line("io_write_bytes", "written (storage)", None, "r"),
+            ),
+            Graph(
+                "procfs probe cost",
+                self.target_dir,
+                "procfs_probe.png",
+                "µs",
+                None,
+                Line("probe_time", "Wall time", None, "b", scale=1000000),
+            ),
+        ]
+
+    def _stop(self, pid):
+        if self.files is not None:
+            self.files.close()
+
+        if self.data_file is None or self.data_file.count == 0:
+            self.warning("No data collected for procfs")
+            return []
+
+        self.data_file.close()
+        self.data_file.export_csv(self.report_file)
+        graphs = self.get_graphs()
+        self.generate_plots(self.data_file, *graphs)
+
+        return [graph.as_report() for graph in graphs] + [
+            {"label": "procfs CSV data", "file": self.report_file, "type": "artifact"},
+            {
+                "label": "procfs NumPy data",
+                "file": self.data_file.location,
+                "type": "artifact",
+            },
+        ]
+
+
+register_plugin(ProcfsWatcher)
@@ -16,6 +16,7 @@
 # specific language governing permissions and limitations
 # under the License.
 #
+import argparse
 import time
 import os
 import psutil
@@ -23,33 +24,113 @@ import humanize
 import tempfile
 
 import matplotlib.ticker as tkr
+import numpy as np
 
 from perf8.plugins.base import BasePlugin, register_plugin
-from perf8.plot import Graph, Line
-from perf8.reporter import Datafile
+from perf8.plot import Graph, Line, stacked_lines
+from perf8.cgroup import memory_limit
+from perf8.diskusage import DiskUsage
+from perf8.proctree import ProcessTree
+from perf8.rates import Rates, TreeCounters
 
+# metric groups for --psutil-metrics: the columns they add to report.npy
+# and the process attributes they read
+METRIC_GROUPS = {
+    "disk": ((("disk_usage", "<i8"),), ()),
+    # I/O of the process, or of the whole tree with --psutil-tree
+    "io": (
+        (
+            ("io_read_count", "<i8"),
+            ("io_write_count", "<i8"),
+            ("io_read_bytes", "<i8"),
+            ("io_write_bytes", "<i8"),
+            ("io_read_chars", "<i8"),
+            ("io_write_chars", "<i8"),
+            "io_read_bytes_rate",
+            "io_write_bytes_rate",
+            "io_read_chars_rate",
+            "io_write_chars_rate",
+        ),
+        ("io_counters",),
+    ),
+    "memory": ((("rss", "<i8"),), ("memory_info",)),
+    "fds": ((("num_fds", "<i8"),), ("num_fds",)),
+    # cumulative context switches, and their rates per second
+    "threads": (
+        (
+            ("num_threads", "<i8"),
+            ("ctx_switch", "<i8"),
+            ("ctx_switch_involuntary", "<i8"),
+            "ctx_switch_rate",
+            "ctx_switch_involuntary_rate",
+        ),
+        ("num_threads", "num_ctx_switches"),
+    ),
+    # cumulative CPU times, and the CPU seconds used per second
+    "cpu": (
+        ("cpu_user", "cpu_system", "cpu_percent", "cpu_user_rate", "cpu_system_rate"),
+        ("cpu_times", "cpu_percent"),
+    ),
+}
 
-def scantree(path):
-    try:
-        for entry in os.scandir(path):
-            if entry.is_dir(follow_symlinks=False):
-                yield from scantree(entry.path)
-            else:
-                if not entry.name.startswith("."):
-                    yield entry
-    except (FileNotFoundError, PermissionError):
-        pass
+# wall and CPU time spent in the probe, then the probe time
+PROBE_ROWS = ("probe_time", "probe_cpu_time", "when", "since")
 
+# aggregated over the process tree, in report.npy
+TREE_ROWS = (
+    ("tree_processes", "<i8"),
+    ("tree_rss", "<i8"),
+    ("tree_uss", "<i8"),
+    ("tree_pss", "<i8"),
+    "tree_cpu_percent",
+    ("tree_num_fds", "<i8"),
+    ("tree_num_threads", "<i8"),
+)
 
-# XXX expensive
-def disk_usage(path):
-    size = 0
-    for entry in scantree(path):
-        try:
-            size += entry.stat().st_size
-        except (OSError, PermissionError, FileNotFoundError):
-            pass
-    return size
+# one record per process and per probe, in tree.npy
+PROCESS_ROWS = (
+    ("pid", "<i8"),
+    ("role", "<U32"),
+    ("rss", "<i8"),
+    ("uss", "<i8"),
+    ("pss", "<i8"),
+    "cpu_percent",
+    ("num_fds", "<i8"),
+    ("num_threads", "<i8"),
+    "cpu_user",
+    "cpu_system",
+    "when",
+    "since",
+)
+
+ROLE_COLORS = ("g", "b", "c", "m", "y", "r", "k")
+
+
+def io_values(io):
+    # read_chars and write_chars are only provided on Linux
+    return (
+        io.read_count,
+        io.write_count,
+        io.read_bytes,
+        io.write_bytes,
+        getattr(io, "read_chars", 0),
+        getattr(io, "write_chars", 0),
+    )
+
+
+def naturalrate(value, pos=None):
+    return f"{humanize.naturalsize(value)}/s"
+
+
+def metric_groups(value):
+    """argparse type of --psutil-metrics, so unknown groups are usage errors."""
+    groups = {group.strip() for group in value.split(",") if group.strip()}
+    unknown = groups - set(METRIC_GROUPS)
+    if unknown:
+        raise argparse.ArgumentTypeError(
+            f"Unknown psutil metric groups: {', '.join(sorted(unknown))}"
+        )
+    return value
 
 
 def to_rss_bytes(data):
@@ -75,82 +156,190 @@ class ResourceWatcher(BasePlugin):
             "disk-path",
             {"type": str, "default": tempfile.gettempdir(), "help": "Path to watch"},
         ),
+        (
+            "tree",
+            {
+                "action": "store_true",
+                "default": False,
+                "help": "Track the whole process tree, with USS/PSS per process",
+            },
+        ),
+        (
+            "metrics",
+            {
+                "type": metric_groups,
+                "default": ",".join(METRIC_GROUPS),
+                "help": "Comma-separated metric groups to collect, "
+                f"among {', '.join(METRIC_GROUPS)} (default: all)",
+            },
+        ),
     ]
 
     def __init__(self, args):
         super().__init__(args)
         self.max_allowed_rss = to_rss_bytes(args.psutil_max_rss)
         self.proc_info = None
+        self.memory_limit = 0
         self.path = args.psutil_disk_path
         self.target_dir = args.target_dir
         self.data_file = None
+        self.disk_usage = None
+        self.data_path = os.path.join(self.args.target_dir, "report.npy")
         self.report_file = os.path.join(self.args.target_dir, "report.csv")
+        self.track_tree = getattr(args, "psutil_tree", False)
+        self.tree = None
+        self.tree_file = None
+        self.tree_path = os.path.join(self.args.target_dir, "tree.npy")
+
+        metrics = getattr(args, "psutil_metrics", None) or ",".join(METRIC_GROUPS)
+        self.groups = [group.strip() for group in metrics.split(",") if group.strip()]
+        unknown = set(self.groups) - set(METRIC_GROUPS)
+        if unknown:
+            raise ValueError(f"Unknown psutil metric groups: {', '.join(unknown)}")
+
+        # only the process attributes needed by the selected groups are read
+        self.attrs = []
+        self.rows = ()
+        for group in self.groups:
+            rows, attrs = METRIC_GROUPS[group]
+            self.rows += rows
+            self.attrs.extend(attr for attr in attrs if attr not in self.attrs)
+        if self.track_tree:
+            self.rows += TREE_ROWS
+        self.rows += PROBE_ROWS
+        self.columns = {row if isinstance(row, str) else row[0] for row in self.rows}
+        self._collectors = [getattr(self, f"_collect_{group}") for group in self.groups]
 
     def _start(self, pid):
         self.proc_info = psutil.Process(pid)
+        self.memory_limit = memory_limit(pid)
         self.started_at = time.time()
-        self.initial_disk_usage = disk_usage(self.path)
-        self.initial_disk_io = psutil.disk_io_counters()
-
-        self.rows = (
-            "disk_usage",
-            "disk_io_read_count",
-            "disk_io_write_count",
-            "disk_io_read_bytes",
-            "disk_io_write_bytes",
-            "rss",
-            "num_fds",
-            "num_threads",
-            "ctx_switch",
-            "cpu_user",
-            "cpu_system",
-            "cpu_percent",
-            "when",
-            "since",
-        )
-        self.data_file = Datafile(self.report_file, self.rows)
-        self.data_file.open()
+        if "disk" in self.groups:
+            self.disk_usage = DiskUsage(self.path)
+            self.initial_disk_usage = self.disk_usage.total
+            self.debug(
+                f"Tracking disk usage of {self.path} using {self.disk_usage.mode}"
+            )
+
+        # I/O counters are cumulative, summed over processes that come and go
+        self.io_counters = TreeCounters(6)
+        self.io_rates = Rates(4)
+        self._tree_io = {}
+        self.ctx_switch_rates = Rates(2)
+        self.cpu_rates = Rates(2)
+
+        if self.track_tree:
+            self.tree = ProcessTree(pid)
+            self.tree_file = self.open_datafile(self.tree_path, PROCESS_ROWS)
+        self.data_file = self.open_datafile(self.data_path, self.rows)
         self.max_rss = 0
 
-    async def probe(self, pid):
-        try:
-            info = self.proc_info.as_dict()
-        except Exception as e:
-            self.warning(f"Could not get info {e}")
-            return
+    def _collect_disk(self, info):
+        return (self.disk_usage.refresh() - self.initial_disk_usage,)
+
+    def _collect_io(self, info):
+        ppids = None
+        if self.tree is not None:
+            samples = self._tree_io
+            ppids = self.tree.parents()
+        else:
+            samples = {self.proc_info.pid: io_values(info["io_counters"])}
+        totals = self.io_counters.update(samples, ppids)
+        return totals + self.io_rates.update(totals[2:])
+
+    def _collect_memory(self, info):
+        current_rss = info["memory_info"].rss
+        if current_rss > self.max_rss:
+            self.max_rss = current_rss
+        return (current_rss,)
+
+    def _collect_fds(self, info):
+        return (info["num_fds"],)
+
+    def _collect_threads(self, info):
+        switches = info["num_ctx_switches"]
+        totals = (switches.voluntary, switches.involuntary)
+        return (info["num_threads"], *totals) + self.ctx_switch_rates.update(totals)
+
+    def _collect_cpu(self, info):
+        times = (info["cpu_times"].user, info["cpu_times"].system)
+        return (*times, info["cpu_percent"]) + self.cpu_rates.update(times)
+
+    def probe(self, pid):
+        # the cost of the probe is recorded, it's time taken from the target
+        started = time.perf_counter()
+        cpu_started = time.thread_time()
+        # as_dict() reads the attributes in a oneshot() context, so each
+        # /proc file is read once. With no attribute it reads all of them.
+        info = {}
+        if self.attrs:
+            try:
+                info = self.proc_info.as_dict(attrs=self.attrs)
+            except Exception as e:
+                self.warning(f"Could not get info {e}")
+                return
 
         self.debug("Probing")
         probed_at = time.time()
-        if info.get("memory_info") is None:
+        if any(info.get(attr) is None for attr in self.attrs):
             self.warning("Proc info is empty")
             return
-        current_rss = info["memory_info"].rss
-        if current_rss > self.max_rss:
-            self.max_rss = current_rss
 
-        disk_io = psutil.disk_io_counters()
-
-        metrics = (
-            disk_usage(self.path) - self.initial_disk_usage,
-            disk_io.read_count - self.initial_disk_io.read_count,
-            disk_io.write_count - self.initial_disk_io.write_count,
-            disk_io.read_bytes - self.initial_disk_io.read_bytes,
-            disk_io.write_bytes - self.initial_disk_io.write_bytes,
-            current_rss,
-            info["num_fds"],
-            info["num_threads"],
-            info["num_ctx_switches"].voluntary,
-            info["cpu_times"].user,
-            info["cpu_times"].system,
-            info["cpu_percent"],
+        since = round(probed_at - self.started_at, 3)
+        if self.tree is not None:
+            tree_totals = self._probe_tree(probed_at, since)
+
+        metrics = ()
+        for collect in self._collectors:
+            metrics += collect(info)
+
+        if self.tree is not None:
+            metrics += tree_totals
+
+        metrics += (
+            time.perf_counter() - started,
+            time.thread_time() - cpu_started,
             probed_at,
-            int(probed_at - self.started_at),
+            since,
         )
 
         try:
             self.data_file.add(metrics)
         except ValueError:
-            self.warning(f"Failed to write in {self.report_file}")
+            self.warning(f"Failed to write in {self.data_path}")
+
+    def _probe_tree(self, probed_at, since):
+        # one record per process in tree.npy, and the totals in report.npy
+        totals = [0] * len(TREE_ROWS)
+        self._tree_io = {}
+        for proc in self.tree.refresh():
+            try:
+                with proc.oneshot():
+                    if "io" in self.groups:
+                        self._tree_io[proc.pid] = io_values(proc.io_counters())
+                    memory = proc.memory_full_info()
+                    cpu_times = proc.cpu_times()
+                    values = (
+                        memory.rss,
+                        memory.uss,
+                        getattr(memory, "pss", memory.uss),
+                        proc.cpu_percent(),
+                        proc.num_fds(),
+                        proc.num_threads(),
+                    )
+            except psutil.Error:
+                # the process exited or is not ours
+                continue
+
+            record = (proc.pid, self.tree.role(proc.pid), *values)
+            self.tree_file.add(
+                record + (cpu_times.user, cpu_times.system, probed_at, since)
+            )
+            totals[0] += 1
+            for i, value in enumerate(values, 1):
+                totals[i] += value
+
+        return tuple(totals)
 
     def success(self):
         if self.max_allowed_rss == 0:
@@ -162,19 +351,18 @@ class ResourceWatcher(BasePlugin):
             msg = "Excellent job, you did not kill the resources!"
         return res, msg
 
-    def _stop(self, pid):
-        if self.data_file is not None:
-            if self.data_file.count == 0:
-                self.warning("No data collected for psutil")
-                return []
-            else:
-                self.data_file.close()
-
+    def get_graphs(self):
         if self.max_allowed_rss == 0:
             threshold = None
         else:
             threshold = self.max_allowed_rss
 
+        # RSS is marked against the container limit rather than host RAM
+        hlines = []
+        if self.memory_limit:
+            limit = humanize.naturalsize(self.memory_limit, binary=True)
+            hlines.append((self.memory_limit, f"cgroup limit ({limit})", "k"))
+
         graphs = [
             Graph(
                 "Memory Usage",
@@ -182,12 +370,11 @@ class ResourceWatcher(BasePlugin):
                 "rss.png",
                 "Bytes",
                 tkr.FuncFormatter(humanize.naturalsize),
-                Line(
-                    lambda row: float(row[5]),
-                    "RSS",
-                    threshold,
-                    "g",
-                ),
+                Line("rss", "RSS", threshold, "g"),
+                Line("tree_rss", "Tree RSS", None, "b"),
+                Line("tree_uss", "Tree USS", None, "c"),
+                Line("tree_pss", "Tree PSS", None, "m"),
+                hlines=hlines,
             ),
             Graph(
                 "CPU",
@@ -195,7 +382,44 @@ class ResourceWatcher(BasePlugin):
                 "cpu.png",
                 "%",
                 tkr.PercentFormatter(),
-                Line(lambda row: float(row[11]), "CPU%", None, "g"),
+                Line("cpu_percent", "CPU%", None, "g"),
+                Line("tree_cpu_percent", "Tree CPU%", None, "b"),
+            ),
+            Graph(
+                "CPU Usage",
+                self.target_dir,
+                "cpu_rate.png",
+                f"CPU seconds/s (of {psutil.cpu_count()} cores)",
+                None,
+                Line("cpu_user_rate", "user", None, "g"),
+                Line("cpu_system_rate", "system", None, "r"),
+            ),
+            Graph(
+                "CPU Time",
+                self.target_dir,
+                "cpu_time.png",
+                "seconds",
+                None,
+                Line("cpu_user", "user", None, "g"),
+                Line("cpu_system", "system", None, "r"),
+            ),
+            Graph(
+                "Context Switches",
+                self.target_dir,
+                "ctx_switch_rate.png",
+                "switches/s",
+                None,
+                Line("ctx_switch_rate", "voluntary", None, "b"),
+                Line("ctx_switch_involuntary_rate", "involuntary", None, "r"),
+            ),
+            Graph(
+                "Context Switches (total)",
+                self.target_dir,
+                "ctx_switch.png",
+                "Count",
+                None,
+                Line("ctx_switch", "voluntary", None, "b"),
+                Line("ctx_switch_involuntary", "involuntary", None, "r"),
             ),
             Graph(
                 "Threads",
@@ -203,33 +427,41 @@ class ResourceWatcher(BasePlugin):
                 "threads.png",
                 "Count",
                 None,
-                Line(
-                    lambda row: int(row[8]) / 100000000,
-                    "context switch (10k)",
-                    None,
-                    "b",
-                ),
-                Line(lambda row: int(row[7]), "threads", None, "g"),
+                Line("num_threads", "threads", None, "g"),
+                Line("tree_num_threads", "Tree threads", None, "c"),
+                Line("tree_processes", "Tree processes", None, "m"),
             ),
             Graph(
-                "Disk I/O",
+                "I/O Calls",
                 self.target_dir,
                 "disk_io.png",
-                "I/O Count",
+                "Count",
                 None,
-                Line(
-                    lambda row: float(row[1]) / 100000,
-                    "Read Count (10M)",
-                    None,
-                    "r",
-                ),
-                Line(
-                    lambda row: float(row[2]) / 100000,
-                    "Write Count (10M)",
-                    None,
-                    "b",
-                ),
-                Line(lambda row: int(row[6]), "File Descriptors", None, "g"),
+                Line("io_read_count", "Read calls", None, "r"),
+                Line("io_write_count", "Write calls", None, "b"),
+                Line("num_fds", "File Descriptors", None, "g"),
+            ),
+            Graph(
+                "I/O",
+                self.target_dir,
+                "io.png",
+                "Bytes",
+                tkr.FuncFormatter(humanize.naturalsize),
+                Line("io_read_bytes", "Read (storage)", None, "c"),
+                Line("io_write_bytes", "Written (storage)", None, "y"),
+                Line("io_read_chars", "Read (all)", None, "b"),
+                Line("io_write_chars", "Written (all)", None, "r"),
+            ),
+            Graph(
+                "I/O Throughput",
+                self.target_dir,
+                "io_rate.png",
+                "Bytes/s",
+                tkr.FuncFormatter(naturalrate),
+                Line("io_read_bytes_rate", "Read (storage)", None, "c"),
+                Line("io_write_bytes_rate", "Written (storage)", None, "y"),
+                Line("io_read_chars_rate", "Read (all)", None, "b"),
+                Line("io_write_chars_rate", "Written (all)", None, "r"),
             ),
             Graph(
                 "Disk Usage",
@@ -237,33 +469,99 @@ class ResourceWatcher(BasePlugin):
                 "disk.png",
                 "Disk Usage",
                 tkr.FuncFormatter(humanize.naturalsize),
-                Line(
-                    lambda row: float(row[0]),
-                    "Usage",
-                    None,
-                    "g",
-                ),
-                Line(
-                    lambda row: float(row[3]),
-                    "Reads",
-                    None,
-                    "c",
-                ),
-                Line(
-                    lambda row: float(row[4]),
-                    "Writes",
-                    None,
-                    "y",
-                ),
+                Line("disk_usage", "Usage", None, "g"),
+            ),
+            Graph(
+                "psutil probe cost",
+                self.target_dir,
+                "psutil_probe.png",
+                "ms",
+                None,
+                Line("probe_time", "Wall time", None, "b", scale=1000),
+                Line("probe_cpu_time", "CPU time", None, "r", scale=1000),
             ),
         ]
 
-        self.generate_plots(self.report_file, *graphs)
+        # lines of the metric groups that were not collected are dropped
+        for graph in graphs:
+            graph.lines = [line for line in graph.lines if line.source in self.columns]
+        return [graph for graph in graphs if graph.lines]
+
+    def get_tree_graphs(self, data=None):
+        if data is None:
+            data = self.tree_file.load()
+        if len(data) == 0:
+            return []
+
+        ticks, tick = np.unique(data["since"], return_inverse=True)
+        roles = sorted(set(data["role"].tolist()))
+        graphs = []
+        for column, title, ylabel, formatter in (
+            (
+                "uss",
+                "Memory (USS) per role",
+                "Bytes",
+                tkr.FuncFormatter(humanize.naturalsize),
+            ),
+            ("cpu_percent", "CPU per role", "%", tkr.PercentFormatter()),
+        ):
+            layers = []
+            for i, role in enumerate(roles):
+                mask = data["role"] == role
+                y = np.bincount(
+                    tick[mask], weights=data[column][mask], minlength=len(ticks)
+                )
+                layers.append((role, y, ROLE_COLORS[i % len(ROLE_COLORS)]))
+            graphs.append(
+                Graph(
+                    title,
+                    self.target_dir,
+                    f"tree_{column}.png",
+                    ylabel,
+                    formatter,
+                    *stacked_lines(ticks, layers),
+                )
+            )
+        return graphs
+
+    def _stop(self, pid):
+        if self.disk_usage is not None:
+            self.disk_usage.close()
+
+        if self.data_file is not None:
+            if self.data_file.count == 0:
+                self.warning("No data collected for psutil")
+                self.data_file.close()
+                if self.tree_file is not None:
+                    self.tree_file.close()
+                return []
+            else:
+                self.data_file.close()
+                self.data_file.export_csv(self.report_file)
+
+        graphs = self.get_graphs()
+        artifacts = [
+            {"label": "psutil CSV data", "file": self.report_file, "type": "artifact"},
+            {
+                "label": "psutil NumPy data",
+                "file": self.data_file.location,
+                "type": "artifact",
+            },
+        ]
+        if self.tree_file is not None:
+            self.tree_file.close()
+            self.debug(f"Process tree refreshed {self.tree.refreshes} times")
+            graphs += self.get_tree_graphs()
+            artifacts.append(
+                {
+                    "label": "psutil process tree NumPy data",
+                    "file": self.tree_file.location,
+                    "type": "artifact",
+                }
+            )
+        self.generate_plots(self.data_file, *graphs)
 
-        return [
-            {"label": graph.title, "file": graph.plot_file, "type": "image"}
-            for graph in graphs
-        ] + [{"label": "psutil CSV data", "file": self.report_file, "type": "artifact"}]
+        return [graph.as_report() for graph in graphs] + artifacts
 
 
 register_plugin(ResourceWatcher)
@@ -18,7 +18,6 @@
 #
 import importlib
 import asyncio
-import csv
 import os
 import contextlib
 
@@ -103,6 +102,10 @@ class BasePlugin:
         self.args = args
         self.target_dir = args.target_dir
         self.enabled = False
+        # probing rate in seconds, falls back to --refresh-rate
+        self.rate = getattr(args, f"{self.name.replace('-', '_')}_rate", None)
+        if self.rate is None:
+            self.rate = getattr(args, "refresh_rate", 5.0)
 
     def check_pid(self, pid):
         try:
@@ -161,22 +164,58 @@ class BasePlugin:
     def report(self):
         raise NotImplementedError
 
+    # called periodically by perf8.scheduler -- coroutines run in the
+    # event loop, regular methods are executed in a thread pool
     async def probe(self, pid):
         pass
 
-    def generate_plots(self, path_or_rows, *graphs):
-        # load lines once
-        if isinstance(path_or_rows, str):
-            rows = []
-            with open(path_or_rows) as csvfile:
-                lines = csv.reader(csvfile, delimiter=",")
-                for row in lines:
-                    rows.append(row)
+    def get_graphs(self):
+        """Returns the graphs of the records of the plugin data file."""
+        return []
+
+    def open_datafile(self, path, fields):
+        """Opens a Datafile, which is split in segments in daemon mode."""
+        from perf8.datafile import Datafile
+        from perf8.segments import SegmentedDatafile, segments_dir
+
+        if getattr(self.args, "daemon", False):
+            data_file = SegmentedDatafile(
+                segments_dir(self.target_dir, path),
+                fields,
+                self.args.segment_duration,
+            )
         else:
-            rows = path_or_rows
+            data_file = Datafile(path, fields)
+        data_file.open()
+        return data_file
+
+    def generate_plots(self, data, *graphs):
+        from perf8.datafile import Datafile, load_datafile
+        from perf8.plot import render_graphs
+        from perf8.segments import SegmentedDatafile
+
+        # data is a Datafile, a path to its .npy file, or records. Graphs
+        # are rendered in worker processes that memory-map the file
+        if isinstance(data, SegmentedDatafile):
+            data = data.load()
+        elif isinstance(data, Datafile):
+            data.flush()
+            data = data.report_file
+
+        if isinstance(data, str):
+            self.info(f"Loaded {len(load_datafile(data))} data points from {data}")
+        else:
+            self.info(f"Loaded {len(data)} data points")
+
+        max_points = getattr(self.args, "plot_points", None)
+        for graph in graphs:
+            if graph.max_points is None:
+                graph.max_points = max_points
 
-        self.info(f"Loaded {len(rows)} data points from {path_or_rows}")
-        return [graph.generate(self, rows) for graph in graphs]
+        # in-process plugins run in the target process, which is not
+        # ours to start worker processes from
+        workers = 1 if self.in_process else None
+        return render_graphs(self, graphs, data, workers)
 
 
 class AsyncBasePlugin(BasePlugin):
@@ -0,0 +1,105 @@
+#
+# Licensed to Elasticsearch B.V. under one or more contributor
+# license agreements. See the NOTICE file distributed with
+# this work for additional information regarding copyright
+# ownership. Elasticsearch B.V. licenses this file to you under
+# the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# 	http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+"""
+Process tree -- the processes started by the watched process.
+
+The list of descendants is only rebuilt when the system pid table
+changes, and parents are looked up once per new pid. Processes that are
+re-parented when their parent exits are kept in the tree.
+"""
+
+from collections import defaultdict
+
+import psutil
+
+MAIN_ROLE = "main"
+WORKER_ROLE = "worker"
+
+
+class ProcessTree:
+    def __init__(self, pid):
+        self.root = psutil.Process(pid)
+        self.processes = {pid: self.root}
+        self.roles = {pid: MAIN_ROLE}
+        self.refreshes = 0
+        self._root_name = self._name(self.root)
+        self._ppids = {}
+        self._pids = None
+
+    def _name(self, proc):
+        try:
+            return proc.name()
+        except psutil.Error:
+            return ""
+
+    def role(self, pid):
+        """Returns the role of a process of the tree.
+
+        Children running the same executable as the root are workers,
+        e.g. multiprocessing or forked workers, others are named after
+        their executable.
+        """
+        role = self.roles.get(pid)
+        if role is None:
+            name = self._name(self.processes[pid])
+            role = WORKER_ROLE if name == self._root_name else name or WORKER_ROLE
+            self.roles[pid] = role
+        return role
+
+    def parents(self):
+        """Returns the parent pid of each process of the tree."""
+        return {pid: self._ppids.get(pid) for pid in self.processes}
+
+    def refresh(self):
+        """Returns the processes of the tree, updated if pids changed."""
+        pids = frozenset(psutil.pids())
+        if pids == self._pids:
+            return list(self.processes.values())
+
+        self._pids = pids
+        self.refreshes += 1
+
+        for known in (self._ppids, self.processes, self.roles):
+            for pid in [pid for pid in known if pid not in pids]:
+                del known[pid]
+
+        for pid in pids:
+            if pid in self._ppids:
+                continue
+            try:
+                self._ppids[pid] = psutil.Process(pid).ppid()
+            except psutil.Error:
+                continue
+
+        children = defaultdict(list)
+        for pid, ppid in self._ppids.items():
+            children[ppid].append(pid)
+
+        stack = list(self.processes)
+        while stack:
+            for pid in children.get(stack.pop(), ()):
+                if pid in self.processes:
+                    continue
+                try:
+                    self.processes[pid] = psutil.Process(pid)
+                except psutil.Error:
+                    continue
+                stack.append(pid)
+
+        return list(self.processes.values())
@@ -0,0 +1,117 @@
+#
+# Licensed to Elasticsearch B.V. under one or more contributor
+# license agreements. See the NOTICE file distributed with
+# this work for additional information regarding copyright
+# ownership. Elasticsearch B.V. licenses this file to you under
+# the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# 	http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+"""
+Rates -- deltas and per-second rates of cumulative counters.
+"""
+
+import time
+
+
+class Rates:
+    """Per-interval rates of a fixed set of cumulative counters.
+
+    Intervals are measured on the monotonic clock so they are not
+    affected by wall clock adjustments. The first update and counters
+    going backwards (a reset) give a zero rate.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self._last = None
+        self._last_time = None
+
+    def update(self, values, now=None):
+        if now is None:
+            now = time.monotonic()
+        last, last_time = self._last, self._last_time
+        self._last, self._last_time = tuple(values), now
+
+        if last is None or now <= last_time:
+            return (0.0,) * self.size
+
+        elapsed = now - last_time
+        return tuple(
+            max(value - previous, 0) / elapsed
+            for value, previous in zip(self._last, last)
+        )
+
+
+class TreeCounters:
+    """Totals of cumulative counters over a changing set of processes.
+
+    Each process adds what it did since it was last seen. Processes
+    present at the first update are the baseline: only what they do
+    afterwards is counted, new processes are counted from zero.
+
+    On Linux, the I/O of a process that exits is added to its parent
+    once reaped. What was already counted for an exited process is a
+    debt of its parent, deducted from the parent's next increments so
+    it's not counted twice. A process whose parent is not tracked, e.g.
+    re-parented to init, adds to no tracked process: its debt is dropped.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.totals = [0] * size
+        self._debts = {}
+        self._ppids = {}
+        self._last = None
+
+    def update(self, samples, ppids=None):
+        """Takes a {pid: counters} dict and returns the updated totals.
+
+        `ppids` is a {pid: parent pid} dict of the processes.
+        """
+        ppids = {**self._ppids, **(ppids or {})}
+        if self._last is None:
+            self._last = dict(samples)
+            self._ppids = {pid: ppids[pid] for pid in samples if pid in ppids}
+            return tuple(self.totals)
+
+        deltas = {}
+        for pid, values in samples.items():
+            last = self._last.pop(pid, None)
+            if last is None or any(v < p for v, p in zip(values, last)):
+                # a new process, or a pid that was reused
+                last = (0,) * self.size
+                self._debts.pop(pid, None)
+            deltas[pid] = [value - previous for value, previous in zip(values, last)]
+
+        # the processes left in _last exited
+        for pid, last in self._last.items():
+            debt = self._debts.pop(pid, (0,) * self.size)
+            parent = self._ppids.get(pid)
+            if parent not in samples:
+                continue
+            owed = self._debts.setdefault(parent, [0] * self.size)
+            for i in range(self.size):
+                owed[i] += last[i] + debt[i]
+
+        for pid, delta in deltas.items():
+            owed = self._debts.get(pid)
+            for i in range(self.size):
+                paid = 0
+                if owed is not None:
+                    paid = min(owed[i], delta[i])
+                    owed[i] -= paid
+                self.totals[i] += delta[i] - paid
+
+        self._last = dict(samples)
+        self._ppids = {pid: ppids[pid] for pid in samples if pid in ppids}
+        return tuple(self.totals)
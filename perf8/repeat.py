@@ -0,0 +1,243 @@
+#
+# Licensed to Elasticsearch B.V. under one or more contributor
+# license agreements. See the NOTICE file distributed with
+# this work for additional information regarding copyright
+# ownership. Elasticsearch B.V. licenses this file to you under
+# the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# 	http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+"""
+Repeat -- runs the command several times and aggregates the runs.
+
+With --repeat N the command runs --warmup times, runs that are not
+measured, then N times. Each run has its own report in
+<target_dir>/runs/<n>/, and the numbers of their summary.json are
+aggregated in repeat.json and repeat.html: mean, median, standard
+deviation and confidence interval.
+
+Verdicts are robust to an outlier run: --max-duration is checked
+against the median duration, and a plugin check passes when it passed
+in most runs.
+
+With --parallel K, K runs execute at the same time, each one pinned to
+its own set of CPUs (Linux).
+"""
+
+import argparse
+import asyncio
+import datetime
+import json
+import logging
+import multiprocessing
+import os
+from collections import defaultdict
+
+import humanize
+from jinja2 import Environment, FileSystemLoader
+
+from perf8 import __version__
+from perf8 import stats
+from perf8.logger import logger, set_logger
+from perf8.sketches import QUANTILES
+from perf8.watcher import WatchedProcess
+
+HERE = os.path.dirname(__file__)
+RUNS_DIR = "runs"
+SUMMARY_FILE = "summary.json"
+
+# the overtime check of a single run, replaced by the check of the median
+OVERTIME = "general"
+
+
+def cpu_sets(count, cpus=None):
+    """Splits the CPUs of the process in `count` disjoint sets."""
+    if cpus is None:
+        if not hasattr(os, "sched_getaffinity"):
+            raise ValueError("--parallel needs CPU affinity support (Linux)")
+        cpus = os.sched_getaffinity(0)
+    cpus = sorted(cpus)
+    if len(cpus) < count:
+        raise ValueError(f"Can't run {count} runs in parallel on {len(cpus)} CPU(s)")
+    size = len(cpus) // count
+    return [set(cpus[i * size : (i + 1) * size]) for i in range(count)]
+
+
+def _run(args, run_dir, cpus):
+    # executed in a child process
+    set_logger(logging.DEBUG if args.verbose > 0 else logging.INFO)
+    if cpus is not None:
+        # the runner and the command inherit it
+        os.sched_setaffinity(0, cpus)
+    run_args = argparse.Namespace(**vars(args))
+    run_args.target_dir = run_dir
+    run_args.repeat = 1
+    run_args.warmup = 0
+    run_args.live_port = None
+    asyncio.run(WatchedProcess(run_args).run())
+
+
+def run_all(args, run_dirs):
+    """Runs the command once per directory, --parallel runs at a time."""
+    sets = [None]
+    if args.parallel > 1:
+        sets = cpu_sets(args.parallel)
+
+    for start in range(0, len(run_dirs), len(sets)):
+        processes = []
+        for run_dir, cpus in zip(run_dirs[start:], sets):
+            logger.info(f"[repeat] Running in {run_dir}")
+            process = multiprocessing.Process(target=_run, args=(args, run_dir, cpus))
+            process.start()
+            processes.append((run_dir, process))
+        # the other runs of the batch finish before we report a failure
+        failed = []
+        for run_dir, process in processes:
+            process.join()
+            if not os.path.exists(os.path.join(run_dir, SUMMARY_FILE)):
+                failed.append(run_dir)
+        if failed:
+            raise RuntimeError(f"The runs in {', '.join(failed)} failed")
+
+
+def load_summaries(run_dirs):
+    summaries = []
+    for run_dir in run_dirs:
+        with open(os.path.join(run_dir, SUMMARY_FILE)) as f:
+            summaries.append(json.load(f))
+    return summaries
+
+
+def run_metrics(summary):
+    """Returns the numbers of a run summary that are aggregated."""
+    metrics = {"duration_s": summary["duration_s"]}
+    command = summary.get("command")
+    if command:
+        metrics["wall"] = command["wall"]
+        metrics["cpu"] = command["cpu"]
+        if command["wall"]:
+            metrics["cpu_percent"] = command["cpu"] / command["wall"] * 100
+        metrics["peak_rss"] = command["peak_rss"]
+    timers = summary.get("statsd", {}).get("timers", {})
+    for name, timer in sorted(timers.items()):
+        if timer.get("count"):
+            for quantile, _ in QUANTILES:
+                metrics[f"statsd.{name}.{quantile}"] = timer[quantile]
+    return metrics
+
+
+def unit(metric):
+    if metric == "peak_rss":
+        return "bytes"
+    if metric == "cpu_percent":
+        return "%"
+    if metric.startswith("statsd."):
+        return "ms"
+    return "s"
+
+
+def aggregate(summaries, max_duration=0):
+    """Aggregates the summaries of the runs and returns the verdicts."""
+    samples = defaultdict(list)
+    checks = defaultdict(list)
+    for summary in summaries:
+        for name, value in run_metrics(summary).items():
+            samples[name].append(value)
+        for result in summary.get("results", []):
+            checks[result["name"]].append(result["ok"])
+    checks.pop(OVERTIME, None)
+
+    metrics = {name: stats.summarize(values) for name, values in samples.items()}
+    verdicts = []
+    if max_duration > 0:
+        median = metrics["duration_s"]["median"]
+        verdicts.append(
+            {
+                "name": "duration",
+                "ok": median <= max_duration,
+                "message": (
+                    f"Median duration {humanize.precisedelta(median)}, "
+                    f"max {humanize.precisedelta(max_duration)}"
+                ),
+            }
+        )
+    for name, oks in checks.items():
+        verdicts.append(
+            {
+                "name": name,
+                "ok": sum(oks) * 2 > len(oks),
+                "message": f"Passed in {sum(oks)}/{len(oks)} runs",
+            }
+        )
+    return metrics, verdicts
+
+
+def format_value(value, unit):
+    if unit == "bytes":
+        return humanize.naturalsize(value, binary=True)
+    if unit == "%":
+        return f"{value:.1f}%"
+    return f"{value:.3f}{unit}"
+
+
+def render(args, result):
+    environment = Environment(loader=FileSystemLoader(os.path.join(HERE, "templates")))
+    environment.filters["value"] = format_value
+    environment.filters["unit"] = unit
+    template = environment.get_template("repeat.html")
+    content = template.render(
+        args=args,
+        version=__version__,
+        created_at=datetime.datetime.now().strftime("%d-%m-%y %H:%M:%S"),
+        result=result,
+    )
+    target = os.path.join(args.target_dir, "repeat.html")
+    with open(target, "w") as f:
+        f.write(content)
+    return target
+
+
+def repeat(args):
+    """Runs the benchmark, returns True if all the verdicts pass."""
+    if args.parallel > 1 and args.statsd:
+        raise ValueError("--statsd can't be used with --parallel, runs share the port")
+    if getattr(args, "daemon", False):
+        raise ValueError("--daemon can't be used with --repeat")
+
+    root = os.path.join(args.target_dir, RUNS_DIR)
+    warmups = [os.path.join(root, f"warmup-{i}") for i in range(args.warmup)]
+    runs = [os.path.join(root, str(i)) for i in range(args.repeat)]
+    if warmups:
+        logger.info(f"[repeat] {len(warmups)} warmup run(s)")
+        run_all(args, warmups)
+    run_all(args, runs)
+
+    metrics, verdicts = aggregate(load_summaries(runs), args.max_duration)
+    result = {
+        "repeat": args.repeat,
+        "warmup": args.warmup,
+        "parallel": args.parallel,
+        "runs": [os.path.relpath(run, args.target_dir) for run in runs],
+        "metrics": metrics,
+        "verdicts": verdicts,
+        "success": all(verdict["ok"] for verdict in verdicts),
+    }
+    with open(os.path.join(args.target_dir, "repeat.json"), "w") as f:
+        json.dump(stats.json_safe(result), f, indent=2, allow_nan=False)
+
+    for verdict in verdicts:
+        logger.info(
+            f"[repeat] {'✅' if verdict['ok'] else '❌'} "
+            f"{verdict['name']}: {verdict['message']}"
+        )
+    logger.info(f"Find the aggregated report at {render(args, result)}")
+    return result["success"]
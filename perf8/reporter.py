@@ -17,63 +17,44 @@
 # under the License.
 #
 import os
-import csv
 import json
 import datetime
 from collections import defaultdict
 import base64
 import mimetypes
 import platform
+import shutil
+import subprocess
+import time
 import psutil
 import humanize
 
 from jinja2 import Environment, FileSystemLoader
 from perf8 import __version__
 from perf8.logger import logger
-from perf8.plot import Graph, Line
-from matplotlib.colors import BASE_COLORS
+from perf8.plot import render_graphs
+from perf8.datafile import Datafile, load_datafile  # NOQA
+from perf8.statsd_report import statsd_graphs
+from perf8.cgroup import Cgroup, memory_limit
 
 
 HERE = os.path.dirname(__file__)
 
-# cgroup v1 file
-docker_memlimit = "/sys/fs/cgroup/memory/memory.limit_in_bytes"
 
-# cgroup v2 file
-docker_memlimit_v2 = "/sys/fs/cgroup/memory.max"
+def file_size(path):
+    # segmented data files are directories
+    if os.path.isdir(path):
+        return sum(entry.stat().st_size for entry in os.scandir(path))
+    return os.stat(path).st_size
 
-if os.path.exists(docker_memlimit):
-    with open(docker_memlimit) as f:
-        system_memory = int(f.read().strip())
-elif os.path.exists(docker_memlimit_v2):
-    with open(docker_memlimit_v2) as f:
-        system_memory = int(f.read().strip())
-else:
-    system_memory = psutil.virtual_memory().total
 
-
-class Datafile:
-    def __init__(self, report_file, fields):
-        self.report_file = report_file
-        self.rows = fields
-        self.writer = None
-        self.count = 0
-
-    def open(self):
-        self.report_fd = open(self.report_file, "w")
-        self.writer = csv.writer(self.report_fd)
-        self.writer.writerow(self.rows)
-
-    def add(self, values):
-        try:
-            self.writer.writerow(values)
-            self.report_fd.flush()
-        except ValueError:
-            logger.warning(f"Failed to write in {self.report_file}")
-        self.count += 1
-
-    def close(self):
-        self.report_fd.close()
+def get_system_memory():
+    """Returns the memory available to perf8: the cgroup limit, if any."""
+    total = psutil.virtual_memory().total
+    limit = memory_limit()
+    if limit:
+        return min(limit, total)
+    return total
 
 
 class Reporter:
@@ -91,6 +72,32 @@ class Reporter:
         self.failures = self.overtime and 1 or 0
         self.statsd_data = statsd_data
 
+    @property
+    def interactive(self):
+        return getattr(self.args, "report_mode", "embedded") == "interactive"
+
+    def embed(self, report):
+        """Adds what the index page needs to display an html or image report.
+
+        In embedded mode the file is inlined in base64. In interactive mode
+        the page links to the file, and to the series sidecar of graphs,
+        and only loads them when the tab is opened.
+        """
+        if self.interactive:
+            report["src"] = os.path.relpath(report["file"], self.args.target_dir)
+            series = report.get("series")
+            if series is not None and os.path.exists(series):
+                report["series_src"] = os.path.relpath(series, self.args.target_dir)
+            return
+
+        with open(report["file"], "rb") as f:
+            data = base64.b64encode(f.read()).decode("utf-8")
+        if report["type"] == "html":
+            report["html_b64"] = data
+        else:
+            report["image"] = data
+            report["mimetype"] = mimetypes.guess_type(report["file"])[0]
+
     @property
     def success(self):
         return self.failures == 0 and self.successes > 0
@@ -98,6 +105,21 @@ class Reporter:
     def get_arguments(self):
         return vars(self.args)
 
+    def get_git_sha(self):
+        """Returns the commit checked out in the current directory, if any."""
+        try:
+            result = subprocess.run(
+                ["git", "rev-parse", "HEAD"],
+                capture_output=True,
+                text=True,
+                timeout=5,
+            )
+        except (OSError, subprocess.TimeoutExpired):
+            return None
+        if result.returncode != 0:
+            return None
+        return result.stdout.strip()
+
     def get_system_info(self):
         # cpu_freq is broken on M1 see https://github.com/giampaolo/psutil/issues/1892
         # until this is resolved we can just ignore that info
@@ -107,17 +129,62 @@ class Reporter:
             logger.warning("Could not get the CPU frequency")
             freq = "N/A"
 
+        cgroup = Cgroup()
+        try:
+            quota, period = cgroup.cpu_limit()
+        finally:
+            cgroup.close()
+
         return {
             "OS Name": platform.system(),
             "Architecture": platform.architecture()[0],
             "Machine Type": platform.uname().machine,
             "Network Name": platform.uname().node,
             "Python Version": platform.python_version(),
-            "Physical Memory": humanize.naturalsize(system_memory, binary=True),
+            "Physical Memory": humanize.naturalsize(get_system_memory(), binary=True),
             "Number of Cores": psutil.cpu_count(),
+            "CPU Quota": f"{quota / period:g} cores" if quota and period else "None",
             "CPU Frequency": freq,
         }
 
+    def write_summary(self, reports, plugins):
+        """Writes summary.json, the numbers of the run for other tools."""
+        info = self.execution_info
+        overhead = info.get("overhead")
+        if overhead is not None:
+            overhead = {
+                key: overhead[key] for key in ("perf8_cpu", "command_cpu", "ratio")
+            }
+        timers = getattr(self.statsd_data, "timer_summaries", None)
+        summary = {
+            "title": getattr(self.args, "title", None),
+            "version": __version__,
+            "created_at": time.time(),
+            "git_sha": self.get_git_sha(),
+            "success": self.success,
+            "duration_s": info["duration_s"],
+            "command": info.get("command"),
+            "overhead": overhead,
+            "probes": info.get("probes", []),
+            "results": [
+                {
+                    "name": report["name"],
+                    "ok": report["result"][0],
+                    "message": report["result"][1],
+                }
+                for report in reports
+                if report["type"] == "result"
+            ],
+            "plugins": [plugin.name for plugin in plugins],
+            "statsd": {"timers": timers() if timers is not None else {}},
+            "system_info": self.get_system_info(),
+            "arguments": self.get_arguments(),
+        }
+        target = os.path.join(self.args.target_dir, "summary.json")
+        with open(target, "w") as f:
+            json.dump(summary, f, indent=2, default=str)
+        return target
+
     def render(self, name, **args):
         template = self.environment.get_template(name)
         args["args"] = self.args
@@ -146,12 +213,14 @@ class Reporter:
         reports = defaultdict(list)
         reports.update(out_reports)
 
-        # read report.json to extend the list
-        with open(run_summary) as f:
-            data = json.loads(f.read())
+        # read report.json to extend the list, there's none when the
+        # report is built from the data of a daemon session
+        if run_summary is not None:
+            with open(run_summary) as f:
+                data = json.loads(f.read())
 
-            for report in data["reports"]:
-                reports[report["name"]].append(report)
+                for report in data["reports"]:
+                    reports[report["name"]].append(report)
 
         logger.info("Reports generated:")
         for plugin in plugins:
@@ -183,20 +252,11 @@ class Reporter:
                 report["num"] = num
                 report["id"] = f"report-{num}"
                 num += 1
-                if report["type"] == "html":
-                    with open(report["file"]) as f:
-                        report["html"] = html = f.read()
-                        report["html_b64"] = base64.b64encode(
-                            html.encode("utf8")
-                        ).decode("utf-8")
-                elif report["type"] == "image":
-                    with open(report["file"], "rb") as f:
-                        data = base64.b64encode(f.read()).decode("utf-8")
-                        report["image"] = data
-                        report["mimetype"] = mimetypes.guess_type(report["file"])[0]
+                if report["type"] in ("html", "image"):
+                    self.embed(report)
                 elif report["type"] == "artifact":
                     report["file_size"] = humanize.naturalsize(
-                        os.stat(report["file"]).st_size, binary=True
+                        file_size(report["file"]), binary=True
                     )
                 elif report["type"] == "result":
                     if report["result"][0]:
@@ -206,52 +266,21 @@ class Reporter:
                 all_reports.append(report)
 
         # if we got stuff from statsd, we create one report per statsd type
+        # and namespace
         if self.statsd_data is not None:
-            by_dates = []
-            counter_keys = []
-
-            for series in self.statsd_data.get_series():
-                by_date = {}
-                for key, value in series["counters"].items():
-                    if key not in counter_keys:
-                        counter_keys.append(key)
-                    by_date[key] = value
-
-                by_dates.append((series["when"], by_date))
-
-            lines = []
-            colors = list(BASE_COLORS.keys())
-
-            for i, key in enumerate(counter_keys):
-                samples = []
-                for y, (when, data) in enumerate(by_dates):
-                    samples.append((when, data.get(key, 0)))
-                lines.append(Line(samples, key, None, colors[i]))
-
-            graph = Graph(
-                "Statsd Counters",
+            graphs = statsd_graphs(
+                self.statsd_data.get_series(),
                 self.args.target_dir,
-                "statsd.png",
-                "count",
-                None,
-                *lines,
+                max_points=getattr(self.args, "plot_points", None),
             )
-
-            report = {
-                "type": "image",
-                "file": graph.generate(logger),
-                "label": "Statsd Counters",
-            }
-            report["num"] = num
-            report["id"] = f"report-{num}"
-            num += 1
-
-            with open(report["file"], "rb") as f:
-                data = base64.b64encode(f.read()).decode("utf-8")
-                report["image"] = data
-                report["mimetype"] = mimetypes.guess_type(report["file"])[0]
-
-            all_reports.append(report)
+            render_graphs(logger, graphs)
+            for graph in graphs:
+                report = graph.as_report()
+                report["num"] = num
+                report["id"] = f"report-{num}"
+                num += 1
+                self.embed(report)
+                all_reports.append(report)
 
         def _s(report):
             if report["type"] == "artifact":
@@ -264,6 +293,13 @@ class Reporter:
             return int(f'{suffix}{report["num"]}')
 
         all_reports.sort(key=_s)
+
+        if self.interactive:
+            shutil.copy(
+                os.path.join(HERE, "templates", "charts.js"), self.args.target_dir
+            )
+
+        self.write_summary(all_reports, plugins)
         html_report = self.render(
             "index.html",
             reports=all_reports,
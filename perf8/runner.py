@@ -29,8 +29,10 @@ import runpy
 import pathlib
 import signal
 import logging
+import time
 
 from perf8.logger import logger, set_logger
+from perf8.overhead import OverheadTracker, cpu_times, peak_rss
 from perf8.plugins.base import get_plugin_klass, set_plugins
 
 
@@ -82,6 +84,12 @@ def main():
         type=str,
         help="report file",
     )
+    parser.add_argument(
+        "--plot-points",
+        type=int,
+        default=2000,
+        help="Longer series are downsampled to that many points in graphs",
+    )
     parser.add_argument(
         "-s",
         "--script",
@@ -118,11 +126,13 @@ def main():
 
     os.environ["PERF8"] = "1"
     async_plugins = []
+    overhead = OverheadTracker("runner")
 
     for plugin in plugins:
         # async plugins are activated inside the target app
         if not plugin.is_async:
-            plugin.enable()
+            with overhead.measure(f"{plugin.name} enable"):
+                plugin.enable()
         else:
             async_plugins.append(plugin.name)
 
@@ -141,9 +151,18 @@ def main():
     signal.signal(signal.SIGTERM, _exit)
 
     # no in-process plugins, we just run it
+    command_start = time.perf_counter()
     try:
         run_script(script, script_args)
     finally:
+        # what the command used, in-process plugins included, before
+        # the reports are built
+        own, children = cpu_times()
+        command = {
+            "wall": time.perf_counter() - command_start,
+            "cpu": own + children,
+            "peak_rss": peak_rss(),
+        }
         logger.info(f"Script is over -- sending a signal to {args.ppid}")
 
         # script is over, send a signal to the parent
@@ -154,19 +173,29 @@ def main():
 
         for plugin in reversed(plugins):
             if not plugin.is_async and plugin.in_process:
-                plugin.disable()
+                with overhead.measure(f"{plugin.name} disable"):
+                    plugin.disable()
 
         # sending back the reports to the main process through json
         reports = []
         for plugin in plugins:
-            for report in plugin.report():
-                report["name"] = plugin.name
-                reports.append(report)
-            reports.extend(plugin.stop())
+            with overhead.measure(f"{plugin.name} report"):
+                for report in plugin.report():
+                    report["name"] = plugin.name
+                    reports.append(report)
+                reports.extend(plugin.stop())
 
         report = os.path.join(args.target_dir, args.report)
         with open(report, "w") as f:
-            f.write(json.dumps({"reports": reports}))
+            f.write(
+                json.dumps(
+                    {
+                        "reports": reports,
+                        "overhead": overhead.entries(),
+                        "command": command,
+                    }
+                )
+            )
         logger.info(f"Wrote {report}")
 
 
@@ -0,0 +1,248 @@
+#
+# Licensed to Elasticsearch B.V. under one or more contributor
+# license agreements. See the NOTICE file distributed with
+# this work for additional information regarding copyright
+# ownership. Elasticsearch B.V. licenses this file to you under
+# the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# 	http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+"""
+Probe scheduler -- runs each probe in its own task, at its own rate.
+
+Blocking probes run in a thread pool so a slow plugin does not delay the
+others. The wall time and the CPU time of the thread running a probe
+are recorded in its stats. A probe that is still running when its next
+tick is due makes that tick skipped, so samples stay evenly spaced
+instead of piling up.
+"""
+
+import asyncio
+import functools
+import math
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from perf8.logger import logger
+
+
+class ProbeStats:
+    def __init__(self, name, every):
+        self.name = name
+        self.every = every
+        self.ticks = 0
+        self.skipped = 0
+        self.errors = 0
+        self.duration_total = 0.0
+        self.duration_max = 0.0
+        self.cpu_total = 0.0
+        # jitter mean and variance, using Welford's algorithm
+        self._jitter_mean = 0.0
+        self._jitter_m2 = 0.0
+        self.jitter_max = 0.0
+
+    def add_tick(self, jitter):
+        self.ticks += 1
+        delta = jitter - self._jitter_mean
+        self._jitter_mean += delta / self.ticks
+        self._jitter_m2 += delta * (jitter - self._jitter_mean)
+        self.jitter_max = max(self.jitter_max, jitter)
+
+    def add_duration(self, duration):
+        self.duration_total += duration
+        self.duration_max = max(self.duration_max, duration)
+
+    def add_cpu(self, cpu):
+        self.cpu_total += cpu
+
+    @property
+    def jitter_mean(self):
+        return self._jitter_mean
+
+    @property
+    def jitter_stdev(self):
+        if self.ticks < 2:
+            return 0.0
+        return math.sqrt(self._jitter_m2 / (self.ticks - 1))
+
+    @property
+    def duration_mean(self):
+        if self.ticks == 0:
+            return 0.0
+        return self.duration_total / self.ticks
+
+    @property
+    def cpu_mean(self):
+        if self.ticks == 0:
+            return 0.0
+        return self.cpu_total / self.ticks
+
+    def as_dict(self):
+        return {
+            "name": self.name,
+            "every": self.every,
+            "ticks": self.ticks,
+            "skipped": self.skipped,
+            "errors": self.errors,
+            "jitter_mean": self.jitter_mean,
+            "jitter_stdev": self.jitter_stdev,
+            "jitter_max": self.jitter_max,
+            "duration_mean": self.duration_mean,
+            "duration_max": self.duration_max,
+            "cpu_total": self.cpu_total,
+            "cpu_mean": self.cpu_mean,
+        }
+
+    def __str__(self):
+        return (
+            f"{self.name}: {self.ticks} probes, {self.skipped} skipped, "
+            f"{self.errors} errors, jitter {self.jitter_mean * 1000:.2f}ms "
+            f"(max {self.jitter_max * 1000:.2f}ms), "
+            f"duration {self.duration_mean * 1000:.2f}ms "
+            f"(max {self.duration_max * 1000:.2f}ms), "
+            f"cpu {self.cpu_mean * 1000:.2f}ms"
+        )
+
+
+def _thread_cpu(stats, func, *args):
+    # runs in the thread pool, thread_time() is the CPU time of that thread
+    start = time.thread_time()
+    try:
+        return func(*args)
+    finally:
+        stats.add_cpu(time.thread_time() - start)
+
+
+class Ticker:
+    """Drift-free ticker based on the loop monotonic clock.
+
+    Ticks happen at `start + n * every` whatever the time spent between
+    two ticks. If the loop was blocked for more than a period, the missed
+    ticks are counted in `missed` instead of being fired in a burst.
+    """
+
+    def __init__(self, every, loop=None):
+        self.every = every
+        self.loop = loop or asyncio.get_running_loop()
+        self.deadline = self.loop.time()
+        self.missed = 0
+
+    async def tick(self):
+        """Waits for the next tick and returns how late we are."""
+        delay = self.deadline - self.loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+        late = self.loop.time() - self.deadline
+        if late >= self.every:
+            missed = int(late // self.every)
+            self.missed += missed
+            self.deadline += missed * self.every
+            late -= missed * self.every
+
+        self.deadline += self.every
+        return max(0.0, late)
+
+
+class ProbeScheduler:
+    def __init__(self, every, max_workers=None):
+        self.every = every
+        self.max_workers = max_workers
+        self.stats = {}
+        self._jobs = []
+        self._tasks = []
+        self._pending = set()
+        self._executor = None
+        self._running = False
+
+    def add(self, name, func, *args, every=None, when=None):
+        """Registers `func(*args)` to be called every `every` seconds.
+
+        When `every` is not provided, the scheduler default is used.
+        Coroutine functions are awaited in the loop, other callables are
+        executed in the thread pool. If `when` is provided, ticks where
+        `when()` is false are ignored.
+        """
+        if every is None:
+            every = self.every
+        self.stats[name] = ProbeStats(name, every)
+        self._jobs.append((name, func, args, when))
+
+    def start(self):
+        self._running = True
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.max_workers, thread_name_prefix="perf8-probe"
+        )
+        for name, func, args, when in self._jobs:
+            self._tasks.append(
+                asyncio.create_task(self._schedule(name, func, args, when))
+            )
+
+    async def stop(self):
+        self._running = False
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        # we let running probes finish their work
+        await asyncio.gather(*self._pending, return_exceptions=True)
+        self._tasks[:] = []
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        for stats in self.stats.values():
+            logger.info(f"[scheduler] {stats}")
+
+    async def _call(self, name, func, args):
+        stats = self.stats[name]
+        start = time.perf_counter()
+        try:
+            if asyncio.iscoroutinefunction(func):
+                # includes what other tasks did if the probe awaits
+                cpu = time.thread_time()
+                try:
+                    await func(*args)
+                finally:
+                    stats.add_cpu(time.thread_time() - cpu)
+            else:
+                loop = asyncio.get_running_loop()
+                await loop.run_in_executor(
+                    self._executor, functools.partial(_thread_cpu, stats, func, *args)
+                )
+        except Exception as e:
+            stats.errors += 1
+            logger.warning(f"[scheduler] {name} probe failed: {e!r}")
+        finally:
+            stats.add_duration(time.perf_counter() - start)
+
+    async def _schedule(self, name, func, args, when):
+        stats = self.stats[name]
+        ticker = Ticker(stats.every)
+        pending = None
+
+        while self._running:
+            missed = ticker.missed
+            jitter = await ticker.tick()
+            stats.skipped += ticker.missed - missed
+
+            if when is not None and not when():
+                continue
+
+            if pending is not None and not pending.done():
+                # the previous probe missed its deadline
+                stats.skipped += 1
+                logger.debug(f"[scheduler] {name} is late, skipping a tick")
+                continue
+
+            stats.add_tick(jitter)
+            pending = asyncio.ensure_future(self._call(name, func, args))
+            self._pending.add(pending)
+            pending.add_done_callback(self._pending.discard)
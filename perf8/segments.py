@@ -0,0 +1,333 @@
+#
+# Licensed to Elasticsearch B.V. under one or more contributor
+# license agreements. See the NOTICE file distributed with
+# this work for additional information regarding copyright
+# ownership. Elasticsearch B.V. licenses this file to you under
+# the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# 	http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+"""
+Segments -- rolling storage for long-running sessions.
+
+In daemon mode every series is split in segments covering a fixed
+duration, in <target_dir>/segments/<series>/<start>.<ext> where start is
+a timestamp in milliseconds. Segments older than a delay are compacted
+into rollups, <start>.rollup.<ext>, with one record per interval, and
+the raw segment is removed. The retention policy then removes the
+oldest files of all series by age and total size.
+
+Series are .npy Datafiles, or statsd .json lines.
+"""
+
+import json
+import os
+import time
+
+import numpy as np
+
+from perf8.datafile import Datafile, load_datafile
+from perf8.logger import logger
+
+SEGMENTS_DIR = "segments"
+ROLLUP = "rollup"
+SIZE_UNITS = {"K": 1024, "M": 1024**2, "G": 1024**3, "T": 1024**4}
+
+
+def parse_size(value):
+    """Converts a size such as "500M" or "10G" to bytes."""
+    value = str(value).strip().upper()
+    if value[-1:] in SIZE_UNITS:
+        return int(float(value[:-1]) * SIZE_UNITS[value[-1]])
+    return int(value)
+
+
+def segments_dir(target_dir, path):
+    """Returns the segments directory of a series, named after its file."""
+    name = os.path.splitext(os.path.basename(path))[0]
+    return os.path.join(target_dir, SEGMENTS_DIR, name)
+
+
+def list_segments(directory):
+    """Returns the (start, is_rollup, path) of the files of a series.
+
+    Files are sorted by start time. A raw segment that was already
+    compacted, when compaction was interrupted, is left out.
+    """
+    if not os.path.isdir(directory):
+        return []
+    entries = {}
+    for filename in os.listdir(directory):
+        parts = filename.split(".")
+        if not parts[0].isdigit() or len(parts) not in (2, 3):
+            continue
+        is_rollup = len(parts) == 3 and parts[1] == ROLLUP
+        start = int(parts[0]) / 1000
+        if start in entries and not is_rollup:
+            continue
+        entries[start] = (start, is_rollup, os.path.join(directory, filename))
+    return sorted(entries.values())
+
+
+def rollup(records, interval, time_column="when"):
+    """Downsamples records to one record per `interval` seconds.
+
+    Numeric columns are averaged. Text columns, and a "pid" column, are
+    keys: records with different keys are kept apart, so per-process
+    series stay per process.
+    """
+    if len(records) == 0:
+        return np.array(records)
+
+    names = records.dtype.names
+    keys = [
+        name for name in names if records.dtype[name].kind not in "fiu" or name == "pid"
+    ]
+    buckets = np.floor(records[time_column] / interval).astype(np.int64)
+    groups = np.rec.fromarrays(
+        [buckets] + [records[key] for key in keys],
+        names=["bucket"] + keys,
+    )
+    _, first, group = np.unique(groups, return_index=True, return_inverse=True)
+    group = group.ravel()
+    counts = np.bincount(group)
+
+    result = np.zeros(len(counts), dtype=records.dtype)
+    for name in names:
+        column = records[name]
+        if name in keys:
+            result[name] = column[first]
+            continue
+        mean = np.bincount(group, weights=column.astype(float)) / counts
+        if column.dtype.kind in "iu":
+            mean = np.round(mean)
+        result[name] = mean
+    return result[np.argsort(result[time_column], kind="stable")]
+
+
+def rollup_entries(entries, interval):
+    """Downsamples statsd.json entries to one entry per `interval` seconds.
+
+    Counters are summed, gauges and sets keep their last value. Timers
+    keep the min, max, the count and the count-weighted mean, and the
+    maximum of each percentile, which overestimates them.
+    """
+    rolled = []
+    current = bucket = None
+    for entry in entries:
+        entry_bucket = int(entry.get("time", entry["when"]) // interval)
+        if entry_bucket != bucket:
+            bucket = entry_bucket
+            current = {"when": entry["when"], "time": entry.get("time")}
+            for kind in ("counters", "gauges", "timers", "sets"):
+                current[kind] = {}
+            rolled.append(current)
+
+        for name, value in entry.get("counters", {}).items():
+            current["counters"][name] = current["counters"].get(name, 0) + value
+        current["gauges"].update(entry.get("gauges", {}))
+        current["sets"].update(entry.get("sets", {}))
+        for name, summary in entry.get("timers", {}).items():
+            merged = current["timers"].get(name)
+            if merged is None or merged.get("count", 0) == 0:
+                current["timers"][name] = dict(summary)
+                continue
+            if summary.get("count", 0) == 0:
+                continue
+            count = merged["count"] + summary["count"]
+            merged["mean"] = (
+                merged["mean"] * merged["count"] + summary["mean"] * summary["count"]
+            ) / count
+            merged["count"] = count
+            merged["min"] = min(merged["min"], summary["min"])
+            for stat in ("max", "p50", "p90", "p99"):
+                merged[stat] = max(merged[stat], summary[stat])
+    return rolled
+
+
+def read_entries(path):
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def load_window(directory, since=None, until=None, time_column="when"):
+    """Returns the records of a .npy series between two timestamps.
+
+    Rollups are read instead of the raw segments they summarize.
+    """
+    segments = list_segments(directory)
+    arrays = []
+    for i, (start, _, path) in enumerate(segments):
+        if until is not None and start > until:
+            break
+        # a segment ends where the next one starts
+        if since is not None and i + 1 < len(segments):
+            if segments[i + 1][0] < since:
+                continue
+        if not path.endswith(".npy"):
+            continue
+        records = load_datafile(path)
+        mask = np.ones(len(records), dtype=bool)
+        if since is not None:
+            mask &= records[time_column] >= since
+        if until is not None:
+            mask &= records[time_column] <= until
+        arrays.append(records[mask])
+    if not arrays:
+        return None
+    return np.concatenate(arrays)
+
+
+def read_window(directory, since=None, until=None):
+    """Yields the statsd.json entries of a series between two timestamps."""
+    for _, _, path in list_segments(directory):
+        for entry in read_entries(path):
+            when = entry.get("time")
+            if since is not None and when is not None and when < since:
+                continue
+            if until is not None and when is not None and when > until:
+                return
+            yield entry
+
+
+class SegmentedDatafile(Datafile):
+    """A Datafile that starts a new segment every `segment_duration` seconds.
+
+    `load()` returns the records of all the segments and rollups.
+    """
+
+    def __init__(self, directory, fields, segment_duration, **kw):
+        super().__init__(None, fields, **kw)
+        self.directory = directory
+        self.segment_duration = segment_duration
+        self._segment_end = None
+
+    def open(self):
+        os.makedirs(self.directory, exist_ok=True)
+        started = time.time()
+        self.report_file = os.path.join(self.directory, f"{int(started * 1000)}.npy")
+        self._segment_end = started + self.segment_duration
+        self._flushed = 0
+        self._header = None
+        super().open()
+
+    def add(self, values):
+        if self.report_fd is not None and time.time() >= self._segment_end:
+            self.close()
+            self.open()
+        super().add(values)
+
+    @property
+    def location(self):
+        return self.directory
+
+    def load(self):
+        self.flush()
+        records = load_window(self.directory)
+        if records is None:
+            return np.zeros(0, dtype=self.dtype)
+        return records
+
+
+class Maintenance:
+    """Compacts old segments and applies the retention policy.
+
+    `rollup_after` and `retention` are in seconds, `max_size` in bytes;
+    0 disables them. The most recent raw segment of a series is never
+    touched, it's the one being written.
+    """
+
+    def __init__(self, root, rollup_after, rollup_interval, retention, max_size):
+        self.root = root
+        self.rollup_after = rollup_after
+        self.rollup_interval = rollup_interval
+        self.retention = retention
+        self.max_size = max_size
+
+    def _series(self):
+        if not os.path.isdir(self.root):
+            return []
+        return [
+            os.path.join(self.root, name)
+            for name in sorted(os.listdir(self.root))
+            if os.path.isdir(os.path.join(self.root, name))
+        ]
+
+    def compact(self, directory, now):
+        segments = list_segments(directory)
+        compacted = 0
+        # the last raw segment is the current one
+        for (start, is_rollup, path), following in zip(segments, segments[1:]):
+            end = following[0]
+            if is_rollup or end > now - self.rollup_after:
+                continue
+            base, ext = os.path.splitext(path)
+            target = f"{base}.{ROLLUP}{ext}"
+            # written aside then renamed, so an interrupted compaction never
+            # leaves a truncated rollup, which would be read instead of the
+            # raw segment. The dot prefix keeps it out of list_segments.
+            temporary = os.path.join(directory, f".{os.path.basename(target)}.tmp")
+            with open(temporary, "wb") as f:
+                if ext == ".npy":
+                    np.save(f, rollup(load_datafile(path), self.rollup_interval))
+                else:
+                    for entry in rollup_entries(
+                        read_entries(path), self.rollup_interval
+                    ):
+                        f.write((json.dumps(entry) + "\n").encode())
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temporary, target)
+            os.remove(path)
+            compacted += 1
+        return compacted
+
+    def enforce_retention(self, now):
+        files = []
+        total = 0
+        for directory in self._series():
+            segments = list_segments(directory)
+            for i, (start, is_rollup, path) in enumerate(segments):
+                size = os.stat(path).st_size
+                total += size
+                if i + 1 < len(segments):
+                    # a segment ends where the next one starts
+                    files.append((segments[i + 1][0], size, path))
+                elif is_rollup:
+                    files.append((now, size, path))
+
+        removed = 0
+        for end, size, path in sorted(files):
+            too_old = self.retention and end < now - self.retention
+            too_big = self.max_size and total > self.max_size
+            if not (too_old or too_big):
+                break
+            os.remove(path)
+            total -= size
+            removed += 1
+        return removed
+
+    def run(self, now=None):
+        if now is None:
+            now = time.time()
+        compacted = 0
+        if self.rollup_after:
+            for directory in self._series():
+                compacted += self.compact(directory, now)
+        removed = self.enforce_retention(now)
+        if compacted or removed:
+            logger.info(
+                f"[segments] {compacted} segment(s) compacted, {removed} removed"
+            )
+        return compacted, removed
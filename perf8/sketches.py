@@ -0,0 +1,171 @@
+#
+# Licensed to Elasticsearch B.V. under one or more contributor
+# license agreements. See the NOTICE file distributed with
+# this work for additional information regarding copyright
+# ownership. Elasticsearch B.V. licenses this file to you under
+# the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# 	http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+"""
+Sketches -- fixed-size summaries of statsd timers and sets.
+
+`TimerSketch` is a DDSketch: values are counted in logarithmic buckets so
+quantiles are within a relative accuracy, and the lowest buckets are
+collapsed when there are too many of them. `HyperLogLog` estimates the
+cardinality of a set with a fixed array of registers.
+"""
+
+import hashlib
+import math
+
+QUANTILES = (("p50", 0.5), ("p90", 0.9), ("p99", 0.99))
+
+
+class TimerSketch:
+    def __init__(self, relative_accuracy=0.01, max_bins=2048):
+        self.relative_accuracy = relative_accuracy
+        self.max_bins = max_bins
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._multiplier = 1 / math.log(self.gamma)
+        # values below this one are counted as zeros
+        self._min_indexable = 1e-9
+        self.bins = {}
+        self.zeros = 0
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add(self, value, weight=1):
+        """Adds a value, `weight` times when it comes from a sampled timer."""
+        # raises on non-finite values before the sketch is changed
+        if value < self._min_indexable:
+            key = None
+        else:
+            key = math.ceil(math.log(value) * self._multiplier)
+
+        self.count += weight
+        self.total += value * weight
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+        if key is None:
+            self.zeros += weight
+            return
+
+        bins = self.bins
+        if key in bins:
+            bins[key] += weight
+        else:
+            bins[key] = weight
+            if len(bins) > self.max_bins:
+                self._collapse()
+
+    def merge(self, other):
+        """Adds the values of another sketch with the same accuracy."""
+        self.count += other.count
+        self.total += other.total
+        self.zeros += other.zeros
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        for key, weight in other.bins.items():
+            self.bins[key] = self.bins.get(key, 0) + weight
+        while len(self.bins) > self.max_bins:
+            self._collapse()
+
+    def _collapse(self):
+        # merges the two lowest buckets, so high quantiles stay accurate
+        lowest, second = sorted(self.bins)[:2]
+        self.bins[second] += self.bins.pop(lowest)
+
+    def quantile(self, q):
+        if self.count == 0:
+            return None
+        rank = q * (self.count - 1)
+        seen = self.zeros
+        if rank < seen:
+            return max(self.min, 0.0)
+
+        for key in sorted(self.bins):
+            seen += self.bins[key]
+            if seen > rank:
+                value = 2 * self.gamma**key / (self.gamma + 1)
+                return min(max(value, self.min), self.max)
+        return self.max
+
+    @property
+    def mean(self):
+        if self.count == 0:
+            return None
+        return self.total / self.count
+
+    def summary(self):
+        if self.count == 0:
+            return {"count": 0}
+        summary = {
+            "count": self.count,
+            "min": self.min,
+            "max": self.max,
+            "mean": self.mean,
+        }
+        for name, q in QUANTILES:
+            summary[name] = self.quantile(q)
+        return summary
+
+    def __repr__(self):
+        return f"TimerSketch({self.summary()})"
+
+
+class HyperLogLog:
+    def __init__(self, precision=12):
+        self.precision = precision
+        self.size = 1 << precision
+        self.registers = bytearray(self.size)
+        self._rank_bits = 64 - precision
+        if self.size >= 128:
+            self._alpha = 0.7213 / (1 + 1.079 / self.size)
+        else:
+            self._alpha = {16: 0.673, 32: 0.697, 64: 0.709}[self.size]
+
+    def add(self, value):
+        if not isinstance(value, bytes):
+            value = str(value).encode("utf8")
+        hashed = int.from_bytes(
+            hashlib.blake2b(value, digest_size=8).digest(), "little"
+        )
+        index = hashed & (self.size - 1)
+        rest = hashed >> self.precision
+        rank = self._rank_bits - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def count(self):
+        total = 0.0
+        zeros = 0
+        for register in self.registers:
+            total += 2.0**-register
+            if register == 0:
+                zeros += 1
+        estimate = self._alpha * self.size * self.size / total
+        if estimate <= 2.5 * self.size and zeros > 0:
+            # small range correction
+            return round(self.size * math.log(self.size / zeros))
+        return round(estimate)
+
+    def __len__(self):
+        return self.count()
+
+    def __repr__(self):
+        return f"HyperLogLog({self.count()})"
@@ -0,0 +1,178 @@
+#
+# Licensed to Elasticsearch B.V. under one or more contributor
+# license agreements. See the NOTICE file distributed with
+# this work for additional information regarding copyright
+# ownership. Elasticsearch B.V. licenses this file to you under
+# the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# 	http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+"""
+Stats -- summaries and confidence intervals of small samples.
+
+Benchmarks have a handful of runs, so intervals use the Student t
+distribution. Confidence intervals are at 95%.
+"""
+
+import math
+
+# two-sided 95% critical values of the t distribution, per degrees of freedom
+T_95 = {
+    1: 12.706,
+    2: 4.303,
+    3: 3.182,
+    4: 2.776,
+    5: 2.571,
+    6: 2.447,
+    7: 2.365,
+    8: 2.306,
+    9: 2.262,
+    10: 2.228,
+    11: 2.201,
+    12: 2.179,
+    13: 2.160,
+    14: 2.145,
+    15: 2.131,
+    16: 2.120,
+    17: 2.110,
+    18: 2.101,
+    19: 2.093,
+    20: 2.086,
+    21: 2.080,
+    22: 2.074,
+    23: 2.069,
+    24: 2.064,
+    25: 2.060,
+    26: 2.056,
+    27: 2.052,
+    28: 2.048,
+    29: 2.045,
+    30: 2.042,
+    40: 2.021,
+    60: 2.000,
+    120: 1.980,
+}
+Z_95 = 1.960
+
+
+def t_critical(df):
+    """Returns the 95% two-sided critical value for `df` degrees of freedom.
+
+    Between two entries of the table the lower degrees of freedom are
+    used, which gives a slightly wider interval.
+    """
+    df = int(df)
+    if df < 1:
+        return math.inf
+    if df > 120:
+        return Z_95
+    while df not in T_95:
+        df -= 1
+    return T_95[df]
+
+
+def mean(values):
+    return sum(values) / len(values)
+
+
+def median(values):
+    ordered = sorted(values)
+    middle = len(ordered) // 2
+    if len(ordered) % 2:
+        return ordered[middle]
+    return (ordered[middle - 1] + ordered[middle]) / 2
+
+
+def stdev(values):
+    """Sample standard deviation, 0 for a single value."""
+    if len(values) < 2:
+        return 0.0
+    avg = mean(values)
+    return math.sqrt(sum((value - avg) ** 2 for value in values) / (len(values) - 1))
+
+
+def summarize(values):
+    """Returns the mean, median, stdev and mean confidence interval of values.
+
+    The interval is infinite with a single value.
+    """
+    values = [float(value) for value in values]
+    count = len(values)
+    avg = mean(values)
+    deviation = stdev(values)
+    margin = t_critical(count - 1) * deviation / math.sqrt(count)
+    if count < 2:
+        margin = math.inf
+    return {
+        "n": count,
+        "mean": avg,
+        "median": median(values),
+        "stdev": deviation,
+        "min": min(values),
+        "max": max(values),
+        "ci_low": avg - margin,
+        "ci_high": avg + margin,
+    }
+
+
+def compare(base, candidate):
+    """Compares the means of two samples with Welch's t-test.
+
+    Returns the difference of the means, in value and relative to the
+    base mean, its confidence interval, and whether it's significant,
+    i.e. whether the interval excludes 0.
+    """
+    base = [float(value) for value in base]
+    candidate = [float(value) for value in candidate]
+    base_mean, candidate_mean = mean(base), mean(candidate)
+    delta = candidate_mean - base_mean
+
+    base_var = stdev(base) ** 2 / len(base)
+    candidate_var = stdev(candidate) ** 2 / len(candidate)
+    error = math.sqrt(base_var + candidate_var)
+    if len(base) < 2 or len(candidate) < 2:
+        margin = math.inf
+    elif error == 0:
+        margin = 0.0
+    else:
+        # Welch-Satterthwaite degrees of freedom
+        df = (base_var + candidate_var) ** 2 / (
+            base_var**2 / (len(base) - 1) + candidate_var**2 / (len(candidate) - 1)
+        )
+        margin = t_critical(df) * error
+
+    def relative(value):
+        return value / base_mean * 100 if base_mean else None
+
+    return {
+        "delta": delta,
+        "delta_pct": relative(delta),
+        "ci_low": delta - margin,
+        "ci_high": delta + margin,
+        "ci_low_pct": relative(delta - margin),
+        "ci_high_pct": relative(delta + margin),
+        "significant": delta - margin > 0 or delta + margin < 0,
+    }
+
+
+def json_safe(data):
+    """Replaces the infinite and NaN floats of data with None.
+
+    They are not valid JSON, e.g. the interval of a single value.
+    """
+    if isinstance(data, float) and not math.isfinite(data):
+        return None
+    if isinstance(data, dict):
+        return {key: json_safe(value) for key, value in data.items()}
+    if isinstance(data, (list, tuple)):
+        return [json_safe(value) for value in data]
+    return data
@@ -0,0 +1,180 @@
+#
+# Licensed to Elasticsearch B.V. under one or more contributor
+# license agreements. See the NOTICE file distributed with
+# this work for additional information regarding copyright
+# ownership. Elasticsearch B.V. licenses this file to you under
+# the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# 	http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+"""
+Statsd report -- graphs for the metrics collected by the statsd server.
+
+Metrics are grouped by namespace, the first dotted part of their name,
+and each group gets one graph per metric type: counters, gauges, timers
+(median with a p90-p99 band) and sets cardinality.
+"""
+
+import re
+from array import array
+from collections import defaultdict
+from math import nan
+
+import numpy as np
+from matplotlib import colormaps
+
+from perf8.plot import Graph, Line
+
+DEFAULT_NAMESPACE = "statsd"
+TIMER_STATS = ("p50", "p90", "p99")
+COLORMAP = "tab20"
+
+KINDS = (
+    ("counters", "Counters", "count"),
+    ("gauges", "Gauges", "value"),
+    ("timers", "Timers", "ms"),
+    ("sets", "Sets", "unique values"),
+)
+
+
+def namespace(key):
+    name = key.split("{", 1)[0]
+    if "." not in name:
+        return DEFAULT_NAMESPACE
+    return name.split(".", 1)[0]
+
+
+def color(i):
+    # tab20 pairs a dark and a light shade of each hue, we use all the dark
+    # shades before the light ones
+    cmap = colormaps[COLORMAP]
+    return cmap((i * 2 + i // 10) % cmap.N)
+
+
+class StatsdSeries:
+    """Columnar view of the statsd.json entries, built in one pass.
+
+    Each metric type keeps a dict index of its metric names and three flat
+    columns: the interval, the metric index and the value. Nothing is
+    densified, so memory is linear in the number of values and not in
+    names x intervals.
+    """
+
+    def __init__(self, series):
+        whens = array("d")
+        columns = {}
+        for kind, _, _ in KINDS:
+            width = len(TIMER_STATS) if kind == "timers" else 1
+            columns[kind] = ({}, array("q"), array("q"), array("d"), width)
+
+        for row, entry in enumerate(series):
+            whens.append(entry["when"])
+            for kind, (index, rows, keys, values, width) in columns.items():
+                for key, value in entry.get(kind, {}).items():
+                    col = index.get(key)
+                    if col is None:
+                        col = index[key] = len(index)
+                    rows.append(row)
+                    keys.append(col)
+                    if width == 1:
+                        values.append(value)
+                    else:
+                        for stat in TIMER_STATS:
+                            stat_value = value.get(stat)
+                            values.append(nan if stat_value is None else stat_value)
+
+        self.whens = np.frombuffer(whens, dtype=float)
+        self.index = {}
+        self.names = {}
+        self._samples = {}
+        for kind, (index, rows, keys, values, width) in columns.items():
+            rows = np.frombuffer(rows, dtype=np.int64)
+            keys = np.frombuffer(keys, dtype=np.int64)
+            values = np.frombuffer(values, dtype=float).reshape(-1, width)
+            # groups the samples per metric
+            order = np.argsort(keys, kind="stable")
+            bounds = np.searchsorted(keys[order], np.arange(len(index) + 1))
+            self.index[kind] = index
+            self.names[kind] = list(index)
+            self._samples[kind] = (rows[order], values[order], bounds)
+
+    def __len__(self):
+        return len(self.whens)
+
+    def samples(self, kind, name):
+        """Returns the (x, values) of a metric.
+
+        Intervals where the metric is missing are filled with zeros for
+        counters and NaN otherwise, but only around each gap so the plot
+        is the same as with a dense vector.
+        """
+        rows, values, bounds = self._samples[kind]
+        col = self.index[kind][name] if isinstance(name, str) else name
+        rows = rows[bounds[col] : bounds[col + 1]]
+        values = values[bounds[col] : bounds[col + 1]]
+        fill = 0.0 if kind == "counters" else nan
+
+        edges = np.concatenate(([-1], rows, [len(self)]))
+        gaps = np.flatnonzero(np.diff(edges) > 1)
+        filled = np.unique(np.concatenate((edges[gaps] + 1, edges[gaps + 1] - 1)))
+        all_rows = np.concatenate((rows, filled))
+        all_values = np.concatenate(
+            (values, np.full((len(filled), values.shape[1]), fill))
+        )
+        order = np.argsort(all_rows, kind="stable")
+        all_values = all_values[order]
+        if kind != "timers":
+            all_values = all_values[:, 0]
+        return self.whens[all_rows[order]], all_values
+
+
+def statsd_graphs(series, target_dir, max_points=None):
+    if not isinstance(series, StatsdSeries):
+        series = StatsdSeries(series)
+    graphs = []
+
+    for kind, label, ylabel in KINDS:
+        groups = defaultdict(list)
+        for col, key in enumerate(series.names[kind]):
+            groups[namespace(key)].append((key, col))
+
+        for ns, keys in sorted(groups.items()):
+            lines = []
+            for i, (key, col) in enumerate(sorted(keys)):
+                x, values = series.samples(kind, col)
+                if kind == "timers":
+                    p50, p90, p99 = values.T
+                    line = Line(
+                        (x, p50),
+                        f"{key} p50 (p90-p99)",
+                        None,
+                        color(i),
+                        band=(p90, p99),
+                    )
+                else:
+                    line = Line((x, values), key, None, color(i))
+                lines.append(line)
+
+            filename = re.sub(r"[^\w.-]", "_", f"statsd_{kind}_{ns}") + ".png"
+            graphs.append(
+                Graph(
+                    f"Statsd {label} - {ns}",
+                    target_dir,
+                    filename,
+                    ylabel,
+                    None,
+                    *lines,
+                    max_points=max_points,
+                )
+            )
+
+    return graphs
@@ -3,10 +3,29 @@ import statsd
 from collections import defaultdict
 import functools
 import json
+import math
+import os
+import re
+import socket
 import time
 
+from perf8.sketches import TimerSketch, HyperLogLog
+from perf8.segments import read_window
+
 
 HOST, PORT = "localhost", 514
+RECEIVE_BUFFER = 8 * 1024 * 1024
+
+# name:value|type[|@sample_rate][|#tag1:value,tag2]
+METRIC = re.compile(
+    rb"([^:|#]+):([^|]+)\|(c|g|ms|h|d|s)(?:\|@([0-9.eE+-]+))?(?:\|#([^|]*))?\s*$"
+)
+
+
+def _number(raw):
+    if b"." in raw or b"e" in raw or b"E" in raw:
+        return float(raw)
+    return int(raw)
 
 
 async def write_messages():
@@ -15,49 +34,158 @@ async def write_messages():
     c.timing("stats.timed", 320)
 
 
+def read_series(report_file):
+    """Yields the statsd.json entries, one line at a time."""
+    with open(report_file) as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
 class StatsdData:
-    def __init__(self, report_file):
+    """Aggregates statsd metrics between two flushes.
+
+    Timers and sets are kept in fixed-size sketches, so the memory used
+    per interval does not depend on the ingest rate. Each flush writes
+    one JSON line with the timers summaries and the sets cardinalities.
+    The timers of every interval are also merged in sketches covering the
+    whole run, see `timer_summaries()`.
+
+    With a `segment_duration`, `report_file` is a directory and a new
+    file is started every `segment_duration` seconds, see perf8.segments.
+    """
+
+    def __init__(self, report_file, segment_duration=None):
         self.counters = defaultdict(int)
-        self.timers = defaultdict(list)
+        self.timers = defaultdict(TimerSketch)
+        self.run_timers = defaultdict(TimerSketch)
         self.gauges = defaultdict(int)
-        self.sets = defaultdict(set)
+        self.sets = defaultdict(HyperLogLog)
+        self.segment_duration = segment_duration
+        self.directory = None
+        if segment_duration is not None:
+            self.directory = report_file
+            os.makedirs(self.directory, exist_ok=True)
         self.report_file = report_file
-        self.report_db = open(self.report_file, "w")
+        self.report_db = None
+        self._segment_end = None
+        self._open()
         self.first = None
+        self.received = 0
+        self.malformed = 0
+        self._keys = {}
+
+    def _key(self, name, tags):
+        # DogStatsD tags are part of the key, sorted so their order does not matter
+        key = self._keys.get((name, tags))
+        if key is None:
+            key = name.decode("utf8")
+            if tags:
+                key += "{" + ",".join(sorted(tags.decode("utf8").split(","))) + "}"
+            self._keys[name, tags] = key
+        return key
+
+    def ingest(self, packet):
+        """Aggregates a statsd packet, which may contain several metrics."""
+        match = METRIC.match
+        for line in packet.split(b"\n"):
+            if not line:
+                continue
+            parsed = match(line)
+            if parsed is None:
+                self.malformed += 1
+                continue
+            name, value, kind, rate, tags = parsed.groups()
+            key = self._key(name, tags)
+            try:
+                if kind == b"s":
+                    self.sets[key].add(value)
+                    self.received += 1
+                    continue
+                number = _number(value)
+                if not math.isfinite(number):
+                    raise ValueError(f"{value!r} is not a finite number")
+                if rate is not None:
+                    rate = float(rate)
+                    if not 0 < rate < math.inf:
+                        raise ValueError(f"{rate} is not a valid sample rate")
+                if kind == b"c":
+                    if rate is None:
+                        self.counters[key] += number
+                    else:
+                        self.counters[key] += number / rate
+                elif kind == b"g":
+                    if value[:1] in (b"+", b"-"):
+                        self.gauges[key] += number
+                    else:
+                        self.gauges[key] = number
+                elif rate is None:
+                    self.timers[key].add(float(number))
+                else:
+                    self.timers[key].add(float(number), 1 / rate)
+            except (ValueError, OverflowError):
+                self.malformed += 1
+                continue
+            self.received += 1
+
+    def _open(self):
+        if self.directory is not None:
+            started = time.time()
+            self.report_file = os.path.join(
+                self.directory, f"{int(started * 1000)}.json"
+            )
+            self._segment_end = started + self.segment_duration
+        self.report_db = open(self.report_file, "w")
 
     def flush(self):
         if self.report_db is None:
             return
 
+        now = time.time()
+        if self._segment_end is not None and now >= self._segment_end:
+            self.report_db.close()
+            self._open()
+
         if self.first is None:
-            self.first = time.time()
+            self.first = now
             when = 0
         else:
-            when = time.time() - self.first
+            when = now - self.first
         entry = json.dumps(
             {
                 "when": when,
+                "time": now,
                 "counters": dict(self.counters),
-                "timers": dict(self.timers),
+                "timers": {
+                    name: sketch.summary() for name, sketch in self.timers.items()
+                },
                 "gauges": dict(self.gauges),
-                "sets": dict(self.sets),
+                "sets": {name: hll.count() for name, hll in self.sets.items()},
             }
         )
         self.report_db.write(f"{entry}\n")
+        self.report_db.flush()
+        for name, sketch in self.timers.items():
+            self.run_timers[name].merge(sketch)
         self.counters.clear()
         self.timers.clear()
-        self.gauges.clear()
+        # gauges keep their value until they are updated, as in statsd
         self.sets.clear()
 
     def close(self):
         self.report_db.close()
         self.report_db = None
 
+    def timer_summaries(self):
+        """Returns the summaries of the timers over the whole run."""
+        return {name: sketch.summary() for name, sketch in self.run_timers.items()}
+
     def get_series(self):
         self.flush()
-        with open(self.report_file) as f:
-            for line in f.readlines():
-                yield json.loads(line.strip())
+        if self.directory is not None:
+            yield from read_window(self.directory)
+        else:
+            yield from read_series(self.report_file)
 
     def __str__(self):
         return (
@@ -77,31 +205,17 @@ class StatsdProtocol(asyncio.DatagramProtocol):
         self.transport = transport
 
     def datagram_received(self, data, addr):
-        data = data.split(b"|")
-        data_type = data[1]
-        ns, metric = data[0].split(b":")
-        ns = ns.decode("utf8")
-
-        if data_type == b"c":
-            self._data.counters[ns] += int(metric)
-
-        elif data_type == b"g":
-            if metric.startswith("+", "-"):
-                self._data.gauges[ns] += int(metric)
-            else:
-                self._data.gauges[ns] = int(metric)
-
-        elif data_type == b"ms":
-            self._data.timers[ns].append(float(metric))
-
-        elif data_type == b"s":
-            self._data.sets[ns].add(int(metric))
+        self._data.ingest(data)
 
 
 def start(data, port):
     loop = asyncio.get_event_loop()
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    # a large buffer absorbs bursts while the loop is busy elsewhere
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, RECEIVE_BUFFER)
+    sock.bind(("0.0.0.0", port))
     return loop.create_datagram_endpoint(
-        functools.partial(StatsdProtocol, data), local_addr=("0.0.0.0", port)
+        functools.partial(StatsdProtocol, data), sock=sock
     )
 
 
@@ -0,0 +1,411 @@
+/*
+ * Licensed to Elasticsearch B.V. under one or more contributor
+ * license agreements. See the NOTICE file distributed with
+ * this work for additional information regarding copyright
+ * ownership. Elasticsearch B.V. licenses this file to you under
+ * the Apache License, Version 2.0 (the "License"); you may
+ * not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ * 	http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing,
+ * software distributed under the License is distributed on an
+ * "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+ * KIND, either express or implied.  See the License for the
+ * specific language governing permissions and limitations
+ * under the License.
+ */
+
+/*
+ * Minimal canvas line charts for perf8 interactive reports.
+ *
+ * Series are sidecar scripts generated by perf8.plot.Graph.export_series
+ * that call perf8Charts.register(name, spec). They are loaded on demand
+ * with perf8Charts.load(element, src). The live page of perf8.live
+ * redraws its charts with perf8Charts.draw(element, spec).
+ */
+var perf8Charts = (function () {
+  var pending = {};
+  var MARGIN = { top: 50, right: 30, bottom: 50, left: 90 };
+
+  function formatter(format) {
+    if (format === "bytes") {
+      var units = ["Bytes", "kB", "MB", "GB", "TB", "PB"];
+      return function (value) {
+        var i = 0;
+        while (Math.abs(value) >= 1000 && i < units.length - 1) {
+          value /= 1000;
+          i++;
+        }
+        return i === 0 ? value.toFixed(0) + " Bytes" : value.toFixed(1) + " " + units[i];
+      };
+    }
+    if (format === "percent") {
+      return function (value) {
+        return value.toFixed(1) + "%";
+      };
+    }
+    return function (value) {
+      return value.toLocaleString(undefined, { maximumFractionDigits: 3 });
+    };
+  }
+
+  function niceTicks(min, max, count) {
+    if (min === max) {
+      max = min + 1;
+    }
+    var span = max - min;
+    var step = Math.pow(10, Math.floor(Math.log10(span / count)));
+    var error = (count * step) / span;
+    if (error <= 0.15) {
+      step *= 10;
+    } else if (error <= 0.35) {
+      step *= 5;
+    } else if (error <= 0.75) {
+      step *= 2;
+    }
+    var ticks = [];
+    for (var tick = Math.ceil(min / step) * step; tick <= max + step * 1e-9; tick += step) {
+      ticks.push(tick);
+    }
+    return ticks;
+  }
+
+  function bounds(spec) {
+    var b = { xmin: Infinity, xmax: -Infinity, ymin: Infinity, ymax: -Infinity };
+    function add(xs, ys) {
+      for (var i = 0; i < xs.length; i++) {
+        if (xs[i] === null || ys[i] === null) {
+          continue;
+        }
+        b.xmin = Math.min(b.xmin, xs[i]);
+        b.xmax = Math.max(b.xmax, xs[i]);
+        b.ymin = Math.min(b.ymin, ys[i]);
+        b.ymax = Math.max(b.ymax, ys[i]);
+      }
+    }
+    spec.lines.forEach(function (line) {
+      add(line.x, line.y);
+      if (line.envelope) {
+        add(line.envelope.x, line.envelope.min);
+        add(line.envelope.x, line.envelope.max);
+      }
+      if (line.band) {
+        add(line.x, line.band.low);
+        add(line.x, line.band.high);
+      }
+      if (line.threshold !== null) {
+        b.ymax = Math.max(b.ymax, line.threshold);
+      }
+    });
+    if (b.xmin === Infinity) {
+      b = { xmin: 0, xmax: 1, ymin: 0, ymax: 1 };
+    }
+    (spec.hlines || []).forEach(function (hline) {
+      b.ymax = Math.max(b.ymax, hline.value);
+    });
+    b.ymin = Math.min(0, b.ymin);
+    return b;
+  }
+
+  // index of the closest x, x being sorted
+  function closest(xs, x) {
+    var lo = 0;
+    var hi = xs.length - 1;
+    while (hi - lo > 1) {
+      var mid = (lo + hi) >> 1;
+      if (xs[mid] < x) {
+        lo = mid;
+      } else {
+        hi = mid;
+      }
+    }
+    return Math.abs(xs[lo] - x) <= Math.abs(xs[hi] - x) ? lo : hi;
+  }
+
+  function Chart(element, spec) {
+    this.spec = spec;
+    this.format = formatter(spec.format);
+    this.bounds = bounds(spec);
+    this.canvas = document.createElement("canvas");
+    this.width = Math.max(element.clientWidth, 600);
+    this.height = Math.round(this.width * 0.55);
+    var ratio = window.devicePixelRatio || 1;
+    this.canvas.width = this.width * ratio;
+    this.canvas.height = this.height * ratio;
+    this.canvas.style.width = this.width + "px";
+    this.canvas.style.height = this.height + "px";
+    this.ctx = this.canvas.getContext("2d");
+    this.ctx.scale(ratio, ratio);
+    element.appendChild(this.canvas);
+
+    var self = this;
+    this.canvas.addEventListener("mousemove", function (event) {
+      var rect = self.canvas.getBoundingClientRect();
+      self.draw(event.clientX - rect.left);
+    });
+    this.canvas.addEventListener("mouseleave", function () {
+      self.draw(null);
+    });
+    this.draw(null);
+  }
+
+  Chart.prototype.sx = function (x) {
+    var b = this.bounds;
+    var w = this.width - MARGIN.left - MARGIN.right;
+    return MARGIN.left + ((x - b.xmin) / (b.xmax - b.xmin || 1)) * w;
+  };
+
+  Chart.prototype.sy = function (y) {
+    var b = this.bounds;
+    var h = this.height - MARGIN.top - MARGIN.bottom;
+    return this.height - MARGIN.bottom - ((y - b.ymin) / (b.ymax - b.ymin || 1)) * h;
+  };
+
+  Chart.prototype.path = function (xs, ys) {
+    var ctx = this.ctx;
+    var started = false;
+    ctx.beginPath();
+    for (var i = 0; i < xs.length; i++) {
+      if (ys[i] === null) {
+        started = false;
+        continue;
+      }
+      if (started) {
+        ctx.lineTo(this.sx(xs[i]), this.sy(ys[i]));
+      } else {
+        ctx.moveTo(this.sx(xs[i]), this.sy(ys[i]));
+        started = true;
+      }
+    }
+  };
+
+  // shaded area between two series sharing the same x
+  Chart.prototype.area = function (xs, lows, highs, color) {
+    var ctx = this.ctx;
+    ctx.beginPath();
+    for (var i = 0; i < xs.length; i++) {
+      if (highs[i] !== null) {
+        ctx.lineTo(this.sx(xs[i]), this.sy(highs[i]));
+      }
+    }
+    for (var j = xs.length - 1; j >= 0; j--) {
+      if (lows[j] !== null) {
+        ctx.lineTo(this.sx(xs[j]), this.sy(lows[j]));
+      }
+    }
+    ctx.globalAlpha = 0.2;
+    ctx.fillStyle = color;
+    ctx.fill();
+    ctx.globalAlpha = 1;
+  };
+
+  Chart.prototype.drawAxes = function () {
+    var ctx = this.ctx;
+    var b = this.bounds;
+    ctx.font = "12px sans-serif";
+    ctx.fillStyle = "#333";
+    ctx.strokeStyle = "#ddd";
+    ctx.lineWidth = 1;
+
+    ctx.textAlign = "right";
+    ctx.textBaseline = "middle";
+    var self = this;
+    niceTicks(b.ymin, b.ymax, 8).forEach(function (tick) {
+      var y = self.sy(tick);
+      ctx.beginPath();
+      ctx.moveTo(MARGIN.left, y);
+      ctx.lineTo(self.width - MARGIN.right, y);
+      ctx.stroke();
+      ctx.fillText(self.format(tick), MARGIN.left - 8, y);
+    });
+
+    ctx.textAlign = "center";
+    ctx.textBaseline = "top";
+    niceTicks(b.xmin, b.xmax, 10).forEach(function (tick) {
+      var x = self.sx(tick);
+      ctx.beginPath();
+      ctx.moveTo(x, MARGIN.top);
+      ctx.lineTo(x, self.height - MARGIN.bottom);
+      ctx.stroke();
+      ctx.fillText(tick.toLocaleString(), x, self.height - MARGIN.bottom + 6);
+    });
+    ctx.fillText("Duration (s)", this.width / 2, this.height - 20);
+
+    ctx.font = "bold 18px sans-serif";
+    ctx.fillText(this.spec.title, this.width / 2, 12);
+  };
+
+  Chart.prototype.drawLegend = function () {
+    var ctx = this.ctx;
+    var x = MARGIN.left + 10;
+    ctx.font = "12px sans-serif";
+    ctx.textAlign = "left";
+    ctx.textBaseline = "middle";
+    this.spec.lines.forEach(function (line) {
+      ctx.fillStyle = line.color;
+      ctx.fillRect(x, MARGIN.top - 18, 12, 3);
+      ctx.fillStyle = "#333";
+      ctx.fillText(line.title, x + 16, MARGIN.top - 17);
+      x += ctx.measureText(line.title).width + 36;
+    });
+    (this.spec.hlines || []).forEach(function (hline) {
+      ctx.fillStyle = hline.color;
+      ctx.fillRect(x, MARGIN.top - 18, 3, 3);
+      ctx.fillRect(x + 5, MARGIN.top - 18, 3, 3);
+      ctx.fillRect(x + 10, MARGIN.top - 18, 2, 3);
+      ctx.fillStyle = "#333";
+      ctx.fillText(hline.title, x + 16, MARGIN.top - 17);
+      x += ctx.measureText(hline.title).width + 36;
+    });
+  };
+
+  Chart.prototype.drawTooltip = function (mouseX) {
+    var ctx = this.ctx;
+    var self = this;
+    var rows = [];
+    var x = null;
+    this.spec.lines.forEach(function (line) {
+      if (line.x.length === 0) {
+        return;
+      }
+      var b = self.bounds;
+      var w = self.width - MARGIN.left - MARGIN.right;
+      var value = b.xmin + ((mouseX - MARGIN.left) / w) * (b.xmax - b.xmin);
+      var i = closest(line.x, value);
+      if (line.y[i] === null) {
+        return;
+      }
+      x = line.x[i];
+      rows.push([line.color, line.title + ": " + self.format(line.y[i])]);
+      ctx.fillStyle = line.color;
+      ctx.beginPath();
+      ctx.arc(self.sx(line.x[i]), self.sy(line.y[i]), 4, 0, 2 * Math.PI);
+      ctx.fill();
+    });
+    if (x === null) {
+      return;
+    }
+    rows.unshift(["#333", x.toLocaleString() + "s"]);
+
+    ctx.strokeStyle = "#999";
+    ctx.beginPath();
+    ctx.moveTo(this.sx(x), MARGIN.top);
+    ctx.lineTo(this.sx(x), this.height - MARGIN.bottom);
+    ctx.stroke();
+
+    ctx.font = "12px sans-serif";
+    ctx.textAlign = "left";
+    ctx.textBaseline = "top";
+    var width = 0;
+    rows.forEach(function (row) {
+      width = Math.max(width, ctx.measureText(row[1]).width);
+    });
+    var left = this.sx(x) + 10;
+    if (left + width + 16 > this.width) {
+      left = this.sx(x) - width - 26;
+    }
+    ctx.fillStyle = "rgba(255, 255, 255, 0.9)";
+    ctx.fillRect(left, MARGIN.top + 10, width + 16, rows.length * 16 + 8);
+    rows.forEach(function (row, i) {
+      ctx.fillStyle = row[0];
+      ctx.fillText(row[1], left + 8, MARGIN.top + 14 + i * 16);
+    });
+  };
+
+  Chart.prototype.draw = function (mouseX) {
+    var ctx = this.ctx;
+    var self = this;
+    ctx.clearRect(0, 0, this.width, this.height);
+    this.drawAxes();
+
+    this.spec.lines.forEach(function (line) {
+      if (line.envelope) {
+        self.area(line.envelope.x, line.envelope.min, line.envelope.max, line.color);
+      }
+      if (line.band) {
+        self.area(line.x, line.band.low, line.band.high, line.color);
+      }
+
+      self.path(line.x, line.y);
+      ctx.strokeStyle = line.color;
+      ctx.lineWidth = 1.5;
+      ctx.stroke();
+
+      if (line.threshold !== null) {
+        ctx.strokeStyle = "red";
+        ctx.beginPath();
+        ctx.moveTo(MARGIN.left, self.sy(line.threshold));
+        ctx.lineTo(self.width - MARGIN.right, self.sy(line.threshold));
+        ctx.stroke();
+      }
+
+      if (line.x.length > 0) {
+        var mx = self.sx(line.max[0]);
+        var my = self.sy(line.max[1]);
+        var label = self.format(line.max[1]);
+        ctx.fillStyle = "red";
+        ctx.beginPath();
+        ctx.arc(mx, my, 4, 0, 2 * Math.PI);
+        ctx.fill();
+        ctx.font = "12px sans-serif";
+        ctx.textAlign = "center";
+        ctx.textBaseline = "bottom";
+        ctx.fillStyle = "#333";
+        ctx.fillText(label, mx, my - 6);
+      }
+    });
+
+    (this.spec.hlines || []).forEach(function (hline) {
+      ctx.strokeStyle = hline.color;
+      ctx.setLineDash([2, 4]);
+      ctx.beginPath();
+      ctx.moveTo(MARGIN.left, self.sy(hline.value));
+      ctx.lineTo(self.width - MARGIN.right, self.sy(hline.value));
+      ctx.stroke();
+      ctx.setLineDash([]);
+    });
+
+    this.drawLegend();
+    if (mouseX !== null) {
+      this.drawTooltip(mouseX);
+    }
+  };
+
+  return {
+    // draws a spec built by the page, replacing the previous chart
+    draw: function (element, spec) {
+      element.innerHTML = "";
+      spec.lines.forEach(function (line) {
+        if (line.max === undefined) {
+          var best = null;
+          for (var i = 0; i < line.y.length; i++) {
+            if (line.y[i] !== null && (best === null || line.y[i] > line.y[best])) {
+              best = i;
+            }
+          }
+          line.max = best === null ? [0, 0] : [line.x[best], line.y[best]];
+        }
+        if (line.threshold === undefined) {
+          line.threshold = null;
+        }
+      });
+      return new Chart(element, spec);
+    },
+    load: function (element, src) {
+      var name = src.split("/").pop();
+      pending[name] = element;
+      var script = document.createElement("script");
+      script.src = src;
+      document.body.appendChild(script);
+    },
+    register: function (name, spec) {
+      var element = pending[name];
+      delete pending[name];
+      if (element !== undefined) {
+        new Chart(element, spec);
+      }
+    },
+  };
+})();
@@ -0,0 +1,129 @@
+#
+# Licensed to Elasticsearch B.V. under one or more contributor
+# license agreements. See the NOTICE file distributed with
+# this work for additional information regarding copyright
+# ownership. Elasticsearch B.V. licenses this file to you under
+# the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# 	http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+import os
+import shutil
+import tempfile
+from types import SimpleNamespace
+
+import pytest
+
+from perf8.cgroup import Cgroup
+from perf8.plugins._cgroup import CgroupWatcher
+
+PRESSURE = (
+    "some avg10=1.00 avg60=0.50 avg300=0.10 total={}\n"
+    "full avg10=0.00 avg60=0.00 avg300=0.00 total={}\n"
+)
+
+
+def _write(root, path, content):
+    path = os.path.join(root, path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        f.write(content)
+
+
+@pytest.fixture
+def fs():
+    root = tempfile.mkdtemp()
+    try:
+        yield root
+    finally:
+        shutil.rmtree(root)
+
+
+def test_cgroup_v2(fs):
+    _write(fs, "proc/12/cgroup", "0::/kubepods/pod1\n")
+    _write(fs, "sys/cgroup.procs", "")
+    _write(fs, "sys/kubepods/pod1/memory.current", "1048576\n")
+    _write(fs, "sys/kubepods/pod1/memory.max", "max\n")
+    _write(fs, "sys/kubepods/pod1/cpu.max", "50000 100000\n")
+    _write(
+        fs,
+        "sys/kubepods/pod1/cpu.stat",
+        "usage_usec 90\nnr_periods 10\nnr_throttled 4\nthrottled_usec 2500\n",
+    )
+    _write(fs, "sys/kubepods/pod1/cpu.pressure", PRESSURE.format(7, 0))
+    _write(fs, "sys/kubepods/pod1/memory.pressure", PRESSURE.format(5, 3))
+    # the cgroup has no io.pressure, the system-wide one is used
+    _write(fs, "proc/pressure/io", PRESSURE.format(2, 1))
+
+    cgroup = Cgroup(12, root=os.path.join(fs, "sys"), proc=os.path.join(fs, "proc"))
+    try:
+        assert cgroup.version == 2 and cgroup.available
+        assert dict(zip(Cgroup.FIELDS, cgroup.read())) == {
+            "memory_current": 1048576,
+            "memory_max": 0,
+            "cpu_quota": 50000,
+            "cpu_period": 100000,
+            "nr_periods": 10,
+            "nr_throttled": 4,
+            "throttled_usec": 2500,
+            "cpu_pressure_some": 7,
+            "memory_pressure_some": 5,
+            "memory_pressure_full": 3,
+            "io_pressure_some": 2,
+            "io_pressure_full": 1,
+        }
+    finally:
+        cgroup.close()
+
+
+def test_cgroup_v1(fs):
+    _write(fs, "proc/12/cgroup", "5:memory:/docker/c1\n4:cpu,cpuacct:/docker/c1\n")
+    _write(fs, "sys/memory/docker/c1/memory.usage_in_bytes", "4096\n")
+    _write(fs, "sys/memory/docker/c1/memory.limit_in_bytes", "9223372036854771712\n")
+    # in a cgroup namespace, the cgroup is at the root of the mount
+    _write(fs, "sys/cpu,cpuacct/cpu.cfs_quota_us", "200000\n")
+    _write(fs, "sys/cpu,cpuacct/cpu.cfs_period_us", "100000\n")
+    _write(
+        fs,
+        "sys/cpu,cpuacct/cpu.stat",
+        "nr_periods 3\nnr_throttled 1\nthrottled_time 5000000\n",
+    )
+
+    cgroup = Cgroup(12, root=os.path.join(fs, "sys"), proc=os.path.join(fs, "proc"))
+    try:
+        assert cgroup.version == 1
+        assert cgroup.memory_limit() == 0
+        assert cgroup.cpu_limit() == (200000, 100000)
+        assert cgroup.read()[:7] == (4096, 0, 200000, 100000, 3, 1, 5000)
+    finally:
+        cgroup.close()
+
+
+@pytest.mark.skipif(not CgroupWatcher.supported, reason="cgroups are Linux only")
+@pytest.mark.asyncio
+async def test_cgroup_plugin():
+    target_dir = tempfile.mkdtemp()
+    try:
+        plugin = CgroupWatcher(SimpleNamespace(target_dir=target_dir, refresh_rate=1))
+        plugin.start(os.getpid())
+        if not plugin.cgroup.available:
+            plugin.stop(os.getpid())
+            pytest.skip("no cgroup found")
+        for _ in range(3):
+            await plugin.probe(os.getpid())
+        reports = plugin.stop(os.getpid())
+        data = plugin.data_file.load()
+        assert len(data) == 3
+        assert (data["io_pressure_some_pct"] >= 0).all()
+        assert len([r for r in reports if r["type"] == "image"]) == 4
+    finally:
+        shutil.rmtree(target_dir)
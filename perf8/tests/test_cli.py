@@ -16,12 +16,15 @@
 # specific language governing permissions and limitations
 # under the License.
 #
+import json
 import os
 import shutil
 import tempfile
 import sys
 
-from perf8.cli import main
+import pytest
+
+from perf8.cli import main, parser
 
 
 def test_main():
@@ -49,3 +52,140 @@ def test_main():
     finally:
         sys.argv = old_sys
         shutil.rmtree(target_dir)
+
+
+@pytest.mark.parametrize("flag", ["--refresh-rate", "--psutil-rate", "--statsd-rate"])
+@pytest.mark.parametrize("value", ["0", "-1"])
+def test_rates_are_positive(flag, value, capsys):
+    assert parser().parse_args([f"{flag}=0.5"])
+    with pytest.raises(SystemExit):
+        parser().parse_args([f"{flag}={value}"])
+    assert "is not a positive number" in capsys.readouterr().err
+
+
+@pytest.mark.parametrize("flag", ["--repeat", "--parallel", "--calibrate-runs"])
+@pytest.mark.parametrize("value", ["0", "-1"])
+def test_counts_are_positive(flag, value, capsys):
+    assert parser().parse_args([f"{flag}=2"])
+    with pytest.raises(SystemExit):
+        parser().parse_args([f"{flag}={value}"])
+    assert "is not a positive integer" in capsys.readouterr().err
+
+
+def test_psutil_metrics(capsys):
+    assert parser().parse_args(["--psutil-metrics=memory, io"])
+    with pytest.raises(SystemExit):
+        parser().parse_args(["--psutil-metrics=memory,environ"])
+    assert "Unknown psutil metric groups: environ" in capsys.readouterr().err
+
+
+def test_retention_size(capsys):
+    assert parser().parse_args([]).retention_size == 5 * 1024**3
+    assert parser().parse_args(["--retention-size=500M"]).retention_size == (
+        500 * 1024**2
+    )
+    with pytest.raises(SystemExit):
+        parser().parse_args(["--retention-size=5GB"])
+    assert "invalid parse_size value: '5GB'" in capsys.readouterr().err
+
+
+def test_interactive_report():
+    target_dir = tempfile.mkdtemp()
+    os.environ["RANGE"] = "1000"
+
+    args = [
+        "perf8",
+        "--psutil",
+        "--report-mode=interactive",
+        "--refresh-rate=0.1",
+        "-t",
+        target_dir,
+        "-c",
+        os.path.join(os.path.dirname(__file__), "demo.py"),
+    ]
+
+    old_sys = sys.argv
+    sys.argv = args
+    try:
+        main()
+        assert os.path.exists(os.path.join(target_dir, "charts.js"))
+        with open(os.path.join(target_dir, "index.html")) as f:
+            index = f.read()
+        assert 'data-series="series/rss.js"' in index
+        assert "base64" not in index
+    finally:
+        sys.argv = old_sys
+        shutil.rmtree(target_dir)
+
+
+def test_calibrate():
+    target_dir = tempfile.mkdtemp()
+    os.environ["RANGE"] = "1000"
+
+    args = [
+        "perf8",
+        "--calibrate",
+        "--calibrate-runs=2",
+        "--calibrate-set=psutil,procfs",
+        "--calibrate-threshold=1000",
+        "--refresh-rate=0.1",
+        "-t",
+        target_dir,
+        "-c",
+        os.path.join(os.path.dirname(__file__), "demo.py"),
+    ]
+
+    old_sys = sys.argv
+    sys.argv = args
+    try:
+        assert main()
+        with open(os.path.join(target_dir, "calibration.json")) as f:
+            results = json.load(f)["results"]
+        assert [result["name"] for result in results] == ["baseline", "psutil+procfs"]
+        baseline, plugins = results
+        assert len(baseline["runs"]) == len(plugins["runs"]) == 2
+        assert baseline["metrics"]["wall"]["mean"] > 0
+        assert plugins["metrics"]["peak_rss"]["mean"] > 0
+        assert "delta" in plugins["metrics"]["cpu"]
+        assert plugins["safe"]
+        assert os.path.exists(os.path.join(target_dir, "calibration.html"))
+        for run in plugins["runs"]:
+            assert os.path.exists(os.path.join(target_dir, run["report"]))
+    finally:
+        sys.argv = old_sys
+        shutil.rmtree(target_dir)
+
+
+def _reject(constant):
+    raise ValueError(f"{constant} is not valid JSON")
+
+
+def test_calibrate_single_run():
+    target_dir = tempfile.mkdtemp()
+    os.environ["RANGE"] = "1000"
+
+    args = [
+        "perf8",
+        "--calibrate",
+        "--calibrate-runs=1",
+        "--calibrate-set=psutil",
+        "--refresh-rate=0.1",
+        "-t",
+        target_dir,
+        "-c",
+        os.path.join(os.path.dirname(__file__), "demo.py"),
+    ]
+
+    old_sys = sys.argv
+    sys.argv = args
+    try:
+        # a single run can't tell the overhead is below the threshold
+        assert not main()
+        with open(os.path.join(target_dir, "calibration.json")) as f:
+            results = json.load(f, parse_constant=_reject)["results"]
+        wall = results[1]["metrics"]["wall"]
+        assert wall["ci_high"] is None
+        assert wall["delta"]["ci_high_pct"] is None
+    finally:
+        sys.argv = old_sys
+        shutil.rmtree(target_dir)
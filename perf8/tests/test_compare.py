@@ -0,0 +1,122 @@
+#
+# Licensed to Elasticsearch B.V. under one or more contributor
+# license agreements. See the NOTICE file distributed with
+# this work for additional information regarding copyright
+# ownership. Elasticsearch B.V. licenses this file to you under
+# the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# 	http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+import json
+import os
+import shutil
+import sys
+import tempfile
+
+import numpy as np
+import pytest
+
+from perf8.cli import main
+from perf8.compare import REGRESSION, UNCHANGED, get_tolerance, judge
+from perf8.compare import block_means, parse_tolerances
+from perf8.datafile import Datafile
+
+
+def _reject(constant):
+    raise ValueError(f"{constant} is not valid JSON")
+
+
+def _report(target_dir, duration, rss):
+    os.makedirs(target_dir)
+    summary = {
+        "duration_s": duration,
+        "command": {"wall": duration, "cpu": duration, "peak_rss": 1024},
+        "statsd": {"timers": {}},
+    }
+    with open(os.path.join(target_dir, "summary.json"), "w") as f:
+        json.dump(summary, f)
+    data_file = Datafile(
+        os.path.join(target_dir, "report.npy"), ("rss", "cpu_percent", "since")
+    )
+    data_file.open()
+    for i, value in enumerate(rss):
+        data_file.add((value, 50.0, i * 0.5))
+    data_file.close()
+
+
+def test_judge():
+    base = [10.0, 10.2, 9.9, 10.1]
+    delta, status = judge(base, [12.0, 12.1, 11.9, 12.2], 5)
+    assert delta["tested"] and delta["significant"]
+    assert status == REGRESSION
+
+    # significant but within the tolerance
+    assert judge(base, [10.3, 10.4, 10.2, 10.5], 5)[1] == UNCHANGED
+    # above the tolerance but noisy
+    assert judge(base, [8.0, 16.0, 9.0, 14.0], 5)[1] == UNCHANGED
+    # a single run per side, the tolerance decides
+    delta, status = judge([10.0], [11.0], 5)
+    assert not delta["tested"]
+    assert status == REGRESSION
+
+    # the points of slowly moving series: 1% apart, which the points
+    # taken as independent samples would find significant
+    base_points = np.linspace(100, 110, 1000)
+    delta, status = judge([105.0], [106.0], 0.5, base_points, base_points + 1)
+    assert delta["tested"] and not delta["significant"]
+    assert status == UNCHANGED
+    assert block_means(np.arange(20), 4) == [2.0, 7.0, 12.0, 17.0]
+
+
+def test_tolerances():
+    tolerances = parse_tolerances(["statsd.*=10", "statsd.db.*=20"])
+    assert get_tolerance("statsd.db.query.p99", 5, tolerances) == 20
+    assert get_tolerance("statsd.http.p99", 5, tolerances) == 10
+    assert get_tolerance("rss.peak", 5, tolerances) == 5
+    with pytest.raises(ValueError):
+        parse_tolerances(["rss"])
+
+
+def test_compare():
+    root = tempfile.mkdtemp()
+    baseline = os.path.join(root, "baseline")
+    candidate = os.path.join(root, "candidate")
+    target_dir = os.path.join(root, "compare")
+    _report(baseline, 10.0, [100.0, 101.0, 99.0, 100.0] * 10)
+    _report(candidate, 10.1, [150.0, 149.0, 151.0, 150.0] * 8)
+
+    old_sys = sys.argv
+    sys.argv = ["perf8", "compare", baseline, candidate, "-t", target_dir]
+    try:
+        with pytest.raises(SystemExit) as exit:
+            main()
+        assert exit.value.code == 1
+
+        with open(os.path.join(target_dir, "verdict.json")) as f:
+            # strict JSON, as CI tools parse it
+            verdict = json.load(f, parse_constant=_reject)
+        assert not verdict["success"]
+        assert verdict["regressions"] == ["rss.mean", "rss.peak"]
+        metrics = {metric["name"]: metric for metric in verdict["metrics"]}
+        assert metrics["rss.mean"]["delta"]["tested"]
+        # a single run has no interval
+        assert metrics["duration_s"]["baseline"]["ci_high"] is None
+        assert metrics["duration_s"]["status"] == UNCHANGED
+        assert os.path.exists(os.path.join(target_dir, "compare.html"))
+        assert os.path.exists(os.path.join(target_dir, "compare_rss.png"))
+
+        sys.argv = ["perf8", "compare", baseline, candidate, "-t", target_dir]
+        sys.argv.append("--tolerance-for=rss.*=60")
+        assert main()
+    finally:
+        sys.argv = old_sys
+        shutil.rmtree(root)
@@ -0,0 +1,80 @@
+#
+# Licensed to Elasticsearch B.V. under one or more contributor
+# license agreements. See the NOTICE file distributed with
+# this work for additional information regarding copyright
+# ownership. Elasticsearch B.V. licenses this file to you under
+# the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# 	http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+import csv
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+from perf8.datafile import Datafile, load_datafile
+
+
+def test_datafile():
+    target_dir = tempfile.mkdtemp()
+    path = os.path.join(target_dir, "data.npy")
+    try:
+        data_file = Datafile(path, ("value", ("count", "<i8"), "when"), batch_size=10)
+        data_file.open()
+        assert len(load_datafile(path)) == 0
+
+        for i in range(25):
+            data_file.add((i * 1.5, i, 1000.0 + i))
+
+        # two batches are on disk, the last five records are buffered
+        assert data_file.count == 25
+        assert len(np.load(path, mmap_mode="r")) == 20
+
+        data_file.close()
+        data = load_datafile(path)
+        assert isinstance(data, np.memmap)
+        assert data.dtype.names == ("value", "count", "when")
+        assert data["count"].dtype == np.int64
+        assert list(data["count"]) == list(range(25))
+        assert data["value"][-1] == 36.0
+
+        csv_file = data_file.export_csv(os.path.join(target_dir, "data.csv"))
+        with open(csv_file) as f:
+            rows = list(csv.reader(f))
+        assert rows[0] == ["value", "count", "when"]
+        assert rows[1] == ["0.0", "0", "1000.0"]
+        assert len(rows) == 26
+    finally:
+        shutil.rmtree(target_dir)
+
+
+def test_invalid_records():
+    target_dir = tempfile.mkdtemp()
+    path = os.path.join(target_dir, "data.npy")
+    try:
+        data_file = Datafile(path, ("value", ("count", "<i8")), batch_size=4)
+        data_file.open()
+        data_file.add((1.0, 1))
+        data_file.add(None)
+        data_file.add((2.0, None))
+        data_file.add(("x", 3))
+        data_file.add((4.0, 4))
+        data_file.add((5.0, 5))
+        data_file.close()
+
+        data = load_datafile(path)
+        assert list(data["count"]) == [1, 4, 5]
+        assert data_file.count == 3
+    finally:
+        shutil.rmtree(target_dir)
@@ -0,0 +1,150 @@
+#
+# Licensed to Elasticsearch B.V. under one or more contributor
+# license agreements. See the NOTICE file distributed with
+# this work for additional information regarding copyright
+# ownership. Elasticsearch B.V. licenses this file to you under
+# the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# 	http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+import os
+import shutil
+import tempfile
+import time
+
+import pytest
+
+from perf8.diskusage import DiskUsage, disk_usage
+
+BENCHMARK = "PERF8_BENCHMARK" in os.environ
+
+
+def _write(path, size):
+    with open(path, "w") as f:
+        f.write("x" * size)
+
+
+def _touch_dir(path):
+    # make sure the mtime moves even on coarse grained filesystems
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000000))
+
+
+@pytest.mark.parametrize("use_inotify", [True, False])
+def test_disk_usage_index(use_inotify):
+    root = tempfile.mkdtemp()
+    try:
+        os.makedirs(os.path.join(root, "a", "b"))
+        _write(os.path.join(root, "one"), 10)
+        _write(os.path.join(root, "a", "two"), 20)
+        _write(os.path.join(root, "a", "b", "three"), 30)
+        _write(os.path.join(root, "a", ".hidden"), 1000)
+
+        usage = DiskUsage(root, use_inotify=use_inotify)
+        try:
+            assert usage.total == disk_usage(root) == 60
+            assert usage.refresh() == 60
+
+            os.makedirs(os.path.join(root, "a", "c"))
+            _write(os.path.join(root, "a", "c", "four"), 40)
+            _touch_dir(os.path.join(root, "a"))
+            assert usage.refresh() == disk_usage(root) == 100
+
+            shutil.rmtree(os.path.join(root, "a", "b"))
+            _touch_dir(os.path.join(root, "a"))
+            assert usage.refresh() == disk_usage(root) == 70
+
+            os.remove(os.path.join(root, "one"))
+            _touch_dir(root)
+            assert usage.refresh() == disk_usage(root) == 60
+        finally:
+            usage.close()
+    finally:
+        shutil.rmtree(root)
+
+
+def test_replaced_dir_watch():
+    root = tempfile.mkdtemp()
+    elsewhere = tempfile.mkdtemp()
+    try:
+        os.makedirs(os.path.join(root, "a"))
+        _write(os.path.join(root, "a", "one"), 10)
+
+        usage = DiskUsage(root)
+        if usage.mode != "inotify":
+            usage.close()
+            pytest.skip("inotify is not available")
+        try:
+            removed = []
+            rm_watch = usage._inotify.rm_watch
+
+            def _rm_watch(wd):
+                removed.append(wd)
+                rm_watch(wd)
+
+            usage._inotify.rm_watch = _rm_watch
+            old_wd = usage._dirs[os.path.join(root, "a")].wd
+
+            os.rename(os.path.join(root, "a"), os.path.join(elsewhere, "a"))
+            os.makedirs(os.path.join(root, "a"))
+            _write(os.path.join(root, "a", "two"), 20)
+            # the old watch still reports the old directory as root/a
+            _write(os.path.join(elsewhere, "a", "three"), 30)
+            assert usage.refresh() == disk_usage(root) == 20
+
+            assert removed == [old_wd]
+            assert old_wd not in usage._wds
+            assert len(usage._wds) == len(usage._dirs) == 2
+        finally:
+            usage.close()
+    finally:
+        shutil.rmtree(root)
+        shutil.rmtree(elsewhere)
+
+
+@pytest.mark.skipif(not BENCHMARK, reason="set PERF8_BENCHMARK to run")
+def test_disk_usage_benchmark():
+    num_files = int(os.environ.get("PERF8_BENCH_FILES", 500000))
+    per_dir = 1000
+    root = tempfile.mkdtemp()
+    try:
+        for i in range(num_files):
+            if i % per_dir == 0:
+                current = os.path.join(root, f"dir{i // per_dir}")
+                os.makedirs(current)
+            _write(os.path.join(current, f"file{i}"), i % 100)
+
+        start = time.perf_counter()
+        expected = disk_usage(root)
+        scantree_duration = time.perf_counter() - start
+
+        for use_inotify in (True, False):
+            usage = DiskUsage(root, use_inotify=use_inotify)
+            mode = usage.mode
+            try:
+                _write(os.path.join(root, "dir0", "new"), 100)
+                _touch_dir(os.path.join(root, "dir0"))
+                start = time.perf_counter()
+                total = usage.refresh()
+                refresh_duration = time.perf_counter() - start
+            finally:
+                usage.close()
+                os.remove(os.path.join(root, "dir0", "new"))
+
+            assert total == expected + 100
+            print(
+                f"{num_files} files -- scantree: {scantree_duration:.3f}s, "
+                f"{mode} refresh: {refresh_duration:.3f}s"
+            )
+            assert refresh_duration < scantree_duration
+    finally:
+        shutil.rmtree(root)
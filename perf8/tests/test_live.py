@@ -0,0 +1,157 @@
+#
+# Licensed to Elasticsearch B.V. under one or more contributor
+# license agreements. See the NOTICE file distributed with
+# this work for additional information regarding copyright
+# ownership. Elasticsearch B.V. licenses this file to you under
+# the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# 	http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+import asyncio
+import json
+import os
+import shutil
+import tempfile
+import time
+
+import pytest
+
+from perf8.datafile import Datafile
+from perf8.live import LinesTail, LiveServer, NpyTail, Stream
+from perf8.segments import SegmentedDatafile
+
+
+def test_tails():
+    target_dir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(target_dir, "data.npy")
+        data_file = Datafile(path, ("value", ("count", "<i8"), "when"))
+        data_file.open()
+        tail = NpyTail(path)
+        assert tail.read() is None
+
+        for i in range(5):
+            data_file.add((i * 1.5, i, 1000.0 + i))
+        data_file.flush()
+        assert list(tail.read()["count"]) == [0, 1, 2, 3, 4]
+        assert tail.read() is None
+
+        data_file.add((1.0, 5, 1005.0))
+        data_file.close()
+        assert list(tail.read()["count"]) == [5]
+        tail.close()
+
+        path = os.path.join(target_dir, "statsd.json")
+        with open(path, "w") as f:
+            f.write('{"when": 0}\n{"when"')
+            f.flush()
+            tail = LinesTail(path)
+            assert tail.read() == [{"when": 0}]
+            f.write(": 1}\n")
+            f.flush()
+            assert tail.read() == [{"when": 1}]
+            assert tail.read() is None
+            tail.close()
+    finally:
+        shutil.rmtree(target_dir)
+
+
+def test_stream_segments():
+    target_dir = tempfile.mkdtemp()
+    try:
+        directory = os.path.join(target_dir, "series")
+        data_file = SegmentedDatafile(directory, ("value", "when"), 0.05)
+        data_file.open()
+        stream = Stream("series", directory, time.time())
+        data_file.add((1.0, time.time()))
+        data_file.flush()
+        assert [list(chunk["value"]) for chunk in stream.read()] == [[1.0]]
+
+        # the end of the previous segment is read before the new one
+        data_file.add((2.0, time.time()))
+        time.sleep(0.1)
+        data_file.add((3.0, time.time()))
+        data_file.flush()
+        assert [list(chunk["value"]) for chunk in stream.read()] == [[2.0], [3.0]]
+        stream.close()
+        data_file.close()
+    finally:
+        shutil.rmtree(target_dir)
+
+
+async def _request(port, path):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(f"GET {path} HTTP/1.1\r\nHost: localhost\r\n\r\n".encode())
+    await writer.drain()
+    return reader, writer
+
+
+async def _next_event(reader):
+    kind = data = None
+    while True:
+        line = (await asyncio.wait_for(reader.readline(), 5)).decode().rstrip("\n")
+        if line.startswith("event: "):
+            kind = line[len("event: ") :]
+        elif line.startswith("data: "):
+            data = json.loads(line[len("data: ") :])
+        elif line == "" and kind is not None:
+            return kind, data
+
+
+@pytest.mark.asyncio
+async def test_live_server():
+    target_dir = tempfile.mkdtemp()
+    # a leftover of a previous run
+    stale = os.path.join(target_dir, "old.npy")
+    Datafile(stale, ("value",)).open()
+    os.utime(stale, (0, 0))
+
+    server = LiveServer(
+        target_dir, 0, interval=0.05, graphs={"report": [{"title": "RSS"}]}
+    )
+    await server.start()
+    data_file = Datafile(os.path.join(target_dir, "report.npy"), ("rss", "since"))
+    data_file.open()
+    try:
+        reader, writer = await _request(server.port, "/")
+        response = await reader.read()
+        assert response.startswith(b"HTTP/1.1 200 OK")
+        assert b"EventSource" in response
+        writer.close()
+
+        reader, writer = await _request(server.port, "/events")
+        assert await reader.readline() == b"HTTP/1.1 200 OK\r\n"
+        assert await _next_event(reader) == ("graphs", {"report": [{"title": "RSS"}]})
+
+        data_file.add((1024.0, 0.0))
+        data_file.add((2048.0, 1.0))
+        data_file.flush()
+        kind, payload = await _next_event(reader)
+        assert kind == "records"
+        assert payload == {
+            "stream": "report",
+            "columns": {"rss": [1024.0, 2048.0], "since": [0.0, 1.0]},
+        }
+
+        data_file.add((4096.0, 2.0))
+        data_file.flush()
+        await server.close()
+        assert await _next_event(reader) == (
+            "records",
+            {"stream": "report", "columns": {"rss": [4096.0], "since": [2.0]}},
+        )
+        assert await _next_event(reader) == ("end", {})
+        assert server.clients == 0
+        writer.close()
+    finally:
+        data_file.close()
+        shutil.rmtree(target_dir)
@@ -0,0 +1,77 @@
+#
+# Licensed to Elasticsearch B.V. under one or more contributor
+# license agreements. See the NOTICE file distributed with
+# this work for additional information regarding copyright
+# ownership. Elasticsearch B.V. licenses this file to you under
+# the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# 	http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+import subprocess
+import sys
+import time
+
+from perf8.overhead import OverheadTracker
+from perf8.scheduler import ProbeStats
+
+BURN = "import time\nstart = time.process_time()\nwhile time.process_time() - start < {}: pass"
+
+
+def _burn(seconds):
+    start = time.process_time()
+    while time.process_time() - start < seconds:
+        pass
+
+
+def test_overhead():
+    tracker = OverheadTracker()
+
+    with tracker.measure("probe"):
+        _burn(0.2)
+    # a subprocess of perf8, like py-spy
+    with tracker.measure("pyspy report"):
+        subprocess.check_call([sys.executable, "-c", BURN.format(0.3)])
+    # the command
+    subprocess.check_call([sys.executable, "-c", BURN.format(0.5)])
+
+    stats = ProbeStats("psutil", 1.0)
+    stats.add_tick(0.0)
+    stats.add_duration(0.01)
+    stats.add_cpu(0.005)
+    tracker.add_probes({"psutil": stats})
+
+    runner = [
+        {
+            "name": "cprofile report",
+            "process": "runner",
+            "calls": 1,
+            "cpu": 0.1,
+            "children_cpu": 0.0,
+            "wall": 0.1,
+        }
+    ]
+    summary = tracker.summary(runner)
+
+    names = [entry["name"] for entry in summary["components"]]
+    assert names == ["probe", "pyspy report", "psutil probe", "cprofile report"]
+    probe, pyspy, psutil_probe, _ = summary["components"]
+    assert probe["cpu"] >= 0.2
+    assert probe["calls"] == 1
+    assert pyspy["children_cpu"] >= 0.3
+    assert psutil_probe["cpu"] == 0.005
+    assert psutil_probe["wall"] == 0.01
+
+    # the command is what's left of the children CPU time
+    assert 0.4 <= summary["command_cpu"] < 0.5
+    assert summary["perf8_cpu"] >= 0.2 + 0.3 + 0.1
+    assert summary["ratio"] == summary["perf8_cpu"] / summary["command_cpu"]
+    assert summary["peak_rss_bytes"] > 0
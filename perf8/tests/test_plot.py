@@ -0,0 +1,212 @@
+#
+# Licensed to Elasticsearch B.V. under one or more contributor
+# license agreements. See the NOTICE file distributed with
+# this work for additional information regarding copyright
+# ownership. Elasticsearch B.V. licenses this file to you under
+# the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# 	http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+import os
+import shutil
+import tempfile
+import time
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from perf8.downsample import lttb, minmax_envelope
+from perf8 import plot
+from perf8.logger import logger
+from perf8.plot import Graph, Line, render_graphs
+from perf8.plugins._psutil import ResourceWatcher
+
+BENCHMARK = "PERF8_BENCHMARK" in os.environ
+
+
+def _psutil_datafile(target_dir, num_rows):
+    args = SimpleNamespace(
+        target_dir=target_dir,
+        psutil_max_rss="0",
+        psutil_disk_path=target_dir,
+        refresh_rate=1.0,
+    )
+    plugin = ResourceWatcher(args)
+    plugin._start(os.getpid())
+    plugin.data_file.batch_size = 4096
+    names = plugin.data_file.dtype.names
+    for i in range(num_rows):
+        record = dict.fromkeys(names, i)
+        record.update(rss=1000 + i % 7000, cpu_percent=(i % 100) * 1.0)
+        record.update(probe_time=0.001, probe_cpu_time=0.0005, when=1000.0 + i)
+        plugin.data_file.add(record[name] for name in names)
+    plugin.data_file.close()
+    return plugin
+
+
+def test_line_sources():
+    records = np.zeros(
+        5, dtype=[("rss", "<i8"), ("cpu", "<f8"), ("when", "<f8"), ("since", "<f8")]
+    )
+    records["rss"] = [1, 5, 3, 2, 4]
+    records["cpu"] = [10, 20, 30, 40, 50]
+    records["since"] = [0, 1, 2, 3, 4]
+
+    x, y = Line("rss", "RSS", None, "g", scale=2).get_xy(records)
+    assert list(x) == [0, 1, 2, 3, 4]
+    assert list(y) == [2, 10, 6, 4, 8]
+
+    x, y = Line(lambda data: data["rss"] + data["cpu"], "sum", None, "g").get_xy(
+        records
+    )
+    assert list(y) == [11, 25, 33, 42, 54]
+
+    x, y = Line([(0, 1), (2, 3)], "samples", None, "g").get_xy()
+    assert list(x) == [0, 2] and list(y) == [1, 3]
+
+
+def test_graph_generate():
+    target_dir = tempfile.mkdtemp()
+    try:
+        plugin = _psutil_datafile(target_dir, 100)
+        files = plugin.generate_plots(plugin.data_file, *plugin.get_graphs())
+        assert len(files) == 12
+        for file in files:
+            assert os.path.exists(file)
+
+        graph = Graph(
+            "samples",
+            target_dir,
+            "samples.png",
+            "count",
+            None,
+            Line([(0, 1), (1, 3), (2, 2)], "samples", 2, "g"),
+            hlines=[(4, "limit", "k")],
+        )
+        assert os.path.exists(graph.generate(logger))
+
+        # interactive reports load the series sidecar
+        with open(graph.series_file) as f:
+            series = f.read()
+        assert series.startswith('perf8Charts.register("samples.js", {')
+        assert '"x":[0.0,1.0,2.0]' in series and '"threshold":2' in series
+        assert '"hlines":[{"value":4,"title":"limit","color":"#000000"}]' in series
+    finally:
+        shutil.rmtree(target_dir)
+
+
+def test_render_graphs_workers(monkeypatch):
+    pools = []
+
+    class Executor:
+        def __init__(self, max_workers, mp_context):
+            pools.append(mp_context.get_start_method())
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc):
+            return False
+
+        def map(self, func, *iterables):
+            return map(func, *iterables)
+
+    monkeypatch.setattr(plot, "ProcessPoolExecutor", Executor)
+    monkeypatch.setattr(os, "cpu_count", lambda: 8)
+    target_dir = tempfile.mkdtemp()
+    try:
+        graphs = [
+            Graph(
+                f"graph {i}",
+                target_dir,
+                f"graph{i}.png",
+                "count",
+                None,
+                Line([(0, 1), (1, 3)], "samples", None, "g"),
+            )
+            for i in range(plot.MIN_PARALLEL_GRAPHS)
+        ]
+        # a few graphs are rendered in the current process
+        render_graphs(logger, graphs[:2])
+        assert pools == []
+
+        # workers are never forked from the watcher threads
+        assert len(render_graphs(logger, graphs)) == len(graphs)
+        assert pools in (["forkserver"], ["spawn"])
+
+        monkeypatch.setattr(os, "cpu_count", lambda: 1)
+        render_graphs(logger, graphs)
+        assert len(pools) == 1
+    finally:
+        shutil.rmtree(target_dir)
+
+
+def test_downsampling():
+    x = np.arange(100000, dtype=float)
+    y = np.sin(x / 1000)
+    y[54321] = 10
+
+    indices = lttb(x, y, 2000)
+    assert len(indices) == 2000
+    assert indices[0] == 0 and indices[-1] == 99999
+    assert np.all(np.diff(indices) > 0)
+    assert 54321 in indices
+
+    x_env, y_min, y_max = minmax_envelope(x, y, 500)
+    assert len(x_env) == len(y_min) == len(y_max) == 500
+    assert y_max.max() == 10
+    assert y_min.min() == y.min()
+
+    # short series are left alone
+    assert list(lttb(x[:10], y[:10], 2000)) == list(range(10))
+
+
+@pytest.mark.skipif(not BENCHMARK, reason="set PERF8_BENCHMARK to run")
+def test_graph_benchmark():
+    # 24 hours of psutil data sampled at 1Hz
+    target_dir = tempfile.mkdtemp()
+    try:
+        plugin = _psutil_datafile(target_dir, 86400)
+        start = time.perf_counter()
+        plugin.generate_plots(plugin.data_file, *plugin.get_graphs())
+        duration = time.perf_counter() - start
+        print(f"Rendered the psutil graphs for 86400 samples in {duration:.2f}s")
+        # about 2s on a single core, the 1s target is not met, see CHANGELOG
+        assert duration < 5
+    finally:
+        shutil.rmtree(target_dir)
+
+
+@pytest.mark.skipif(not BENCHMARK, reason="set PERF8_BENCHMARK to run")
+def test_parallel_rendering_benchmark():
+    target_dir = tempfile.mkdtemp()
+    try:
+        plugin = _psutil_datafile(target_dir, 86400)
+        graphs = plugin.get_graphs()
+        path = plugin.data_file.report_file
+
+        start = time.perf_counter()
+        render_graphs(logger, graphs, path, workers=1)
+        serial = time.perf_counter() - start
+
+        start = time.perf_counter()
+        render_graphs(logger, graphs, path, workers=len(graphs))
+        parallel = time.perf_counter() - start
+
+        print(
+            f"Rendered {len(graphs)} graphs on {os.cpu_count()} cores -- "
+            f"serial: {serial:.2f}s, process pool: {parallel:.2f}s "
+            f"(x{serial / parallel:.1f})"
+        )
+    finally:
+        shutil.rmtree(target_dir)
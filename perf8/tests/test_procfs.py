@@ -0,0 +1,95 @@
+#
+# Licensed to Elasticsearch B.V. under one or more contributor
+# license agreements. See the NOTICE file distributed with
+# this work for additional information regarding copyright
+# ownership. Elasticsearch B.V. licenses this file to you under
+# the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# 	http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+import os
+import shutil
+import tempfile
+import time
+from types import SimpleNamespace
+
+import psutil
+import pytest
+
+from perf8.plugins._procfs import ProcFiles, ProcfsWatcher
+
+BENCHMARK = "PERF8_BENCHMARK" in os.environ
+
+pytestmark = pytest.mark.skipif(
+    not ProcfsWatcher.supported, reason="procfs is only available on Linux"
+)
+
+
+def test_proc_files():
+    files = ProcFiles(os.getpid())
+    try:
+        metrics = dict(zip(ProcFiles.FIELDS, files.read()))
+        proc = psutil.Process()
+        with open(os.devnull):
+            assert files.num_fds() == metrics["num_fds"] + 1
+        assert abs(metrics["rss"] - proc.memory_info().rss) < 10 * 1024 * 1024
+        assert metrics["num_threads"] == proc.num_threads()
+        assert metrics["ctx_switch"] <= proc.num_ctx_switches().voluntary
+        assert 0 < metrics["cpu_user"] <= proc.cpu_times().user
+        assert metrics["io_read_chars"] > 0
+    finally:
+        files.close()
+
+
+@pytest.mark.asyncio
+async def test_procfs_plugin():
+    target_dir = tempfile.mkdtemp()
+    try:
+        plugin = ProcfsWatcher(SimpleNamespace(target_dir=target_dir, refresh_rate=1))
+        plugin.start(os.getpid())
+        for _ in range(5):
+            await plugin.probe(os.getpid())
+        reports = plugin.stop(os.getpid())
+        data = plugin.data_file.load()
+        assert len(data) == 5
+        assert (data["rss"] > 0).all() and (data["probe_time"] > 0).all()
+        # rates start at zero, and are per second of the interval
+        assert data["cpu_user_rate"][0] == 0
+        assert (data["cpu_user_rate"] >= 0).all()
+        assert (data["cpu_user_rate"] + data["cpu_system_rate"] < os.cpu_count()).all()
+        assert len([r for r in reports if r["type"] == "image"]) == 8
+    finally:
+        shutil.rmtree(target_dir)
+
+
+@pytest.mark.skipif(not BENCHMARK, reason="set PERF8_BENCHMARK to run")
+def test_procfs_benchmark():
+    proc = psutil.Process()
+    files = ProcFiles(os.getpid())
+    runs = 5000
+
+    start = time.perf_counter()
+    for _ in range(runs):
+        files.read()
+    procfs = (time.perf_counter() - start) / runs
+    files.close()
+
+    start = time.perf_counter()
+    for _ in range(runs // 10):
+        proc.as_dict()
+    as_dict = (time.perf_counter() - start) / (runs // 10)
+
+    print(
+        f"procfs probe: {procfs * 1e6:.1f}µs, "
+        f"psutil as_dict(): {as_dict * 1e6:.1f}µs (x{as_dict / procfs:.0f})"
+    )
+    assert procfs < 100e-6
@@ -0,0 +1,114 @@
+#
+# Licensed to Elasticsearch B.V. under one or more contributor
+# license agreements. See the NOTICE file distributed with
+# this work for additional information regarding copyright
+# ownership. Elasticsearch B.V. licenses this file to you under
+# the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# 	http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+import numpy as np
+import psutil
+
+from perf8.plugins._psutil import ResourceWatcher
+from perf8.proctree import ProcessTree
+
+# a python process with a python child and a sleep grandchild
+TREE = """
+import subprocess, sys, time
+subprocess.Popen(["sleep", "30"])
+subprocess.Popen([sys.executable, "-c", "import time; time.sleep(30)"])
+time.sleep(30)
+"""
+
+
+def _start_tree():
+    proc = subprocess.Popen([sys.executable, "-c", TREE])
+    tree = ProcessTree(proc.pid)
+    deadline = time.time() + 10
+    while len(tree.refresh()) < 3 and time.time() < deadline:
+        time.sleep(0.05)
+    return proc, tree
+
+
+def _kill(proc, tree):
+    for child in tree.refresh():
+        child.kill()
+    proc.wait()
+
+
+def test_process_tree(monkeypatch):
+    proc, tree = _start_tree()
+    try:
+        processes = tree.refresh()
+        assert len(processes) == 3
+        roles = sorted(tree.role(p.pid) for p in processes)
+        assert roles == ["main", "sleep", "worker"]
+
+        # the pid table is only walked again when it changes
+        pids = psutil.pids()
+        monkeypatch.setattr(psutil, "pids", lambda: pids)
+        tree.refresh()
+        refreshes = tree.refreshes
+        assert len(tree.refresh()) == 3
+        assert tree.refreshes == refreshes
+
+        sleep = [p for p in processes if tree.role(p.pid) == "sleep"][0]
+        monkeypatch.setattr(psutil, "pids", lambda: [p for p in pids if p != sleep.pid])
+        assert len(tree.refresh()) == 2
+        assert tree.refreshes == refreshes + 1
+    finally:
+        monkeypatch.undo()
+        _kill(proc, tree)
+
+
+def test_psutil_tree_probe():
+    target_dir = tempfile.mkdtemp()
+    proc, tree = _start_tree()
+    try:
+        args = SimpleNamespace(
+            target_dir=target_dir,
+            psutil_max_rss="0",
+            psutil_disk_path=target_dir,
+            psutil_tree=True,
+            refresh_rate=1.0,
+        )
+        plugin = ResourceWatcher(args)
+        plugin.start(proc.pid)
+        for _ in range(3):
+            plugin.probe(proc.pid)
+        plugin.tree_file.close()
+
+        records = np.load(plugin.tree_path)
+        assert len(records) == 9
+        assert set(records["role"].tolist()) == {"main", "sleep", "worker"}
+        assert (records["uss"] > 0).all() and (records["pss"] > 0).all()
+
+        totals = plugin.data_file.load()
+        assert list(totals["tree_processes"]) == [3, 3, 3]
+        first = records[records["since"] == records["since"][0]]
+        assert totals["tree_uss"][0] == first["uss"].sum()
+
+        reports = plugin.stop(proc.pid)
+        files = [report["file"] for report in reports if "file" in report]
+        assert os.path.join(target_dir, "tree_uss.png") in files
+    finally:
+        _kill(proc, tree)
+        shutil.rmtree(target_dir)
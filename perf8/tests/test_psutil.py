@@ -0,0 +1,115 @@
+#
+# Licensed to Elasticsearch B.V. under one or more contributor
+# license agreements. See the NOTICE file distributed with
+# this work for additional information regarding copyright
+# ownership. Elasticsearch B.V. licenses this file to you under
+# the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# 	http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+import os
+import shutil
+import tempfile
+from types import SimpleNamespace
+
+import pytest
+
+from perf8.plugins._psutil import ResourceWatcher
+
+
+def _args(target_dir, metrics):
+    return SimpleNamespace(
+        target_dir=target_dir,
+        psutil_max_rss="0",
+        psutil_disk_path=target_dir,
+        psutil_metrics=metrics,
+        refresh_rate=1.0,
+    )
+
+
+def test_metric_groups():
+    target_dir = tempfile.mkdtemp()
+    try:
+        plugin = ResourceWatcher(_args(target_dir, "memory,cpu"))
+        assert plugin.attrs == ["memory_info", "cpu_times", "cpu_percent"]
+        assert plugin.data_file is None
+
+        plugin.start(os.getpid())
+        for _ in range(3):
+            plugin.probe(os.getpid())
+        data = plugin.data_file.load()
+        assert data.dtype.names == (
+            "rss",
+            "cpu_user",
+            "cpu_system",
+            "cpu_percent",
+            "cpu_user_rate",
+            "cpu_system_rate",
+            "probe_time",
+            "probe_cpu_time",
+            "when",
+            "since",
+        )
+        assert len(data) == 3
+        assert (data["rss"] > 0).all() and (data["probe_time"] > 0).all()
+
+        titles = [graph.title for graph in plugin.get_graphs()]
+        assert titles == [
+            "Memory Usage",
+            "CPU",
+            "CPU Usage",
+            "CPU Time",
+            "psutil probe cost",
+        ]
+        assert data["cpu_user_rate"][0] == 0
+        assert (data["cpu_user_rate"] >= 0).all()
+        plugin.stop(os.getpid())
+
+        with pytest.raises(ValueError):
+            ResourceWatcher(_args(target_dir, "memory,environ"))
+    finally:
+        shutil.rmtree(target_dir)
+
+
+def test_disk_only():
+    target_dir = tempfile.mkdtemp()
+    try:
+        plugin = ResourceWatcher(_args(target_dir, "disk"))
+        assert plugin.attrs == []
+        plugin.start(os.getpid())
+
+        def as_dict(*args, **kw):
+            raise AssertionError("no process attribute is needed")
+
+        plugin.proc_info.as_dict = as_dict
+        plugin.probe(os.getpid())
+        data = plugin.data_file.load()
+        assert len(data) == 1
+        assert data["disk_usage"][0] >= 0
+        plugin.stop(os.getpid())
+    finally:
+        shutil.rmtree(target_dir)
+
+
+def test_stop_without_data():
+    target_dir = tempfile.mkdtemp()
+    try:
+        args = _args(target_dir, "memory")
+        args.psutil_tree = True
+        plugin = ResourceWatcher(args)
+        plugin.start(os.getpid())
+        results = plugin.stop(os.getpid())
+        assert [result["type"] for result in results] == ["result"]
+        assert plugin.data_file.report_fd is None
+        assert plugin.tree_file.report_fd is None
+    finally:
+        shutil.rmtree(target_dir)
@@ -0,0 +1,55 @@
+#
+# Licensed to Elasticsearch B.V. under one or more contributor
+# license agreements. See the NOTICE file distributed with
+# this work for additional information regarding copyright
+# ownership. Elasticsearch B.V. licenses this file to you under
+# the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# 	http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+from perf8.rates import Rates, TreeCounters
+
+
+def test_rates():
+    rates = Rates(2)
+    assert rates.update((100, 10), now=1.0) == (0.0, 0.0)
+    assert rates.update((300, 10), now=3.0) == (100.0, 0.0)
+    # a counter reset is not a negative rate
+    assert rates.update((50, 20), now=4.0) == (0.0, 10.0)
+    # no time elapsed
+    assert rates.update((60, 20), now=4.0) == (0.0, 0.0)
+
+
+def test_tree_counters():
+    counters = TreeCounters(2)
+    # the processes running at start are the baseline
+    assert counters.update({1: (100, 5)}) == (0, 0)
+    assert counters.update({1: (150, 5), 2: (10, 1)}, {1: 0, 2: 1}) == (60, 1)
+    # pid 2 does 5 more reads and exits, then pid 1 reaps it and gets all
+    # its counters added
+    assert counters.update({1: (150, 5)}) == (60, 1)
+    assert counters.update({1: (165, 6)}) == (65, 1)
+    # pid 1 is reused by a new process
+    assert counters.update({1: (5, 0)}) == (70, 1)
+
+
+def test_tree_counters_reparented():
+    counters = TreeCounters(1)
+    counters.update({1: (0,)}, {1: 0})
+    # pid 3 is a daemonized worker, its parent 2 exited and it's re-parented
+    assert counters.update({1: (0,), 2: (5,), 3: (10,)}, {2: 1, 3: 2}) == (15,)
+    assert counters.update({1: (0,), 3: (20,)}) == (25,)
+    # pid 1 reaps pid 2 and gets its 5 reads, not counted again
+    assert counters.update({1: (5,), 3: (20,)}) == (25,)
+    # pid 3 exits and adds to no tracked process: the reads of pid 1 count
+    assert counters.update({1: (5,)}) == (25,)
+    assert counters.update({1: (12,)}) == (32,)
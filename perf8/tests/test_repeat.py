@@ -0,0 +1,177 @@
+#
+# Licensed to Elasticsearch B.V. under one or more contributor
+# license agreements. See the NOTICE file distributed with
+# this work for additional information regarding copyright
+# ownership. Elasticsearch B.V. licenses this file to you under
+# the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# 	http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from perf8.cli import main
+from perf8 import repeat
+from perf8.repeat import SUMMARY_FILE, aggregate, cpu_sets, run_all
+
+
+def _summary(duration, rss_ok=True, timer_p99=None):
+    summary = {
+        "duration_s": duration,
+        "command": {"wall": duration, "cpu": duration / 2, "peak_rss": 1024},
+        "results": [
+            {"name": "general", "ok": duration < 10, "message": ""},
+            {"name": "psutil", "ok": rss_ok, "message": ""},
+        ],
+        "statsd": {"timers": {}},
+    }
+    if timer_p99 is not None:
+        summary["statsd"]["timers"]["db.query"] = {
+            "count": 10,
+            "p50": 1.0,
+            "p90": 2.0,
+            "p99": timer_p99,
+        }
+    return summary
+
+
+def test_aggregate():
+    # one slow run out of five
+    summaries = [
+        _summary(d, timer_p99=p) for d, p in ((8, 3), (9, 4), (8.5, 5), (30, 6), (9, 7))
+    ]
+    summaries[3]["results"][1]["ok"] = False
+
+    metrics, verdicts = aggregate(summaries, max_duration=10)
+    assert metrics["duration_s"]["median"] == 9
+    assert metrics["duration_s"]["mean"] == 12.9
+    assert metrics["cpu_percent"]["mean"] == 50
+    assert metrics["peak_rss"]["stdev"] == 0
+    assert metrics["statsd.db.query.p99"]["median"] == 5
+
+    verdicts = {verdict["name"]: verdict for verdict in verdicts}
+    # the single-run overtime check is replaced by the median
+    assert "general" not in verdicts
+    assert verdicts["duration"]["ok"]
+    assert verdicts["psutil"]["ok"]
+    assert verdicts["psutil"]["message"] == "Passed in 4/5 runs"
+
+    _, verdicts = aggregate(summaries[:2] + [_summary(20), _summary(21)], 10)
+    assert [verdict["ok"] for verdict in verdicts] == [False, True]
+
+
+def test_cpu_sets():
+    assert cpu_sets(2, {0, 1, 2, 3, 4}) == [{0, 1}, {2, 3}]
+    with pytest.raises(ValueError):
+        cpu_sets(4, {0, 1})
+
+
+def test_repeat():
+    target_dir = tempfile.mkdtemp()
+    os.environ["RANGE"] = "1000"
+
+    args = [
+        "perf8",
+        "--psutil",
+        "--repeat=2",
+        "--warmup=1",
+        "--max-duration=600",
+        "--refresh-rate=0.1",
+        "-t",
+        target_dir,
+        "-c",
+        os.path.join(os.path.dirname(__file__), "demo.py"),
+    ]
+
+    old_sys = sys.argv
+    sys.argv = args
+    try:
+        assert main()
+        with open(os.path.join(target_dir, "repeat.json")) as f:
+            result = json.load(f)
+        assert result["runs"] == ["runs/0", "runs/1"]
+        assert result["metrics"]["duration_s"]["n"] == 2
+        assert result["metrics"]["peak_rss"]["mean"] > 0
+        assert [verdict["name"] for verdict in result["verdicts"]] == [
+            "duration",
+            "psutil",
+        ]
+        assert os.path.exists(
+            os.path.join(target_dir, "runs", "warmup-0", "index.html")
+        )
+        assert os.path.exists(os.path.join(target_dir, "repeat.html"))
+    finally:
+        sys.argv = old_sys
+        shutil.rmtree(target_dir)
+
+
+def _reject(constant):
+    raise ValueError(f"{constant} is not valid JSON")
+
+
+def test_repeat_single_run():
+    target_dir = tempfile.mkdtemp()
+    os.environ["RANGE"] = "1000"
+
+    old_sys = sys.argv
+    sys.argv = [
+        "perf8",
+        "--psutil",
+        "--repeat=1",
+        "--warmup=1",
+        "--refresh-rate=0.1",
+        "-t",
+        target_dir,
+        "-c",
+        os.path.join(os.path.dirname(__file__), "demo.py"),
+    ]
+    try:
+        assert main()
+        with open(os.path.join(target_dir, "repeat.json")) as f:
+            result = json.load(f, parse_constant=_reject)
+        assert result["metrics"]["duration_s"]["n"] == 1
+        assert result["metrics"]["duration_s"]["ci_low"] is None
+    finally:
+        sys.argv = old_sys
+        shutil.rmtree(target_dir)
+
+
+def _fake_run(args, run_dir, cpus):
+    if run_dir.endswith("run-0"):
+        sys.exit(1)
+    time.sleep(0.5)
+    with open(os.path.join(run_dir, SUMMARY_FILE), "w") as f:
+        json.dump(_summary(1), f)
+
+
+def test_run_all_joins_the_batch(monkeypatch):
+    target_dir = tempfile.mkdtemp()
+    try:
+        run_dirs = [os.path.join(target_dir, f"run-{i}") for i in range(2)]
+        for run_dir in run_dirs:
+            os.makedirs(run_dir)
+        monkeypatch.setattr(repeat, "_run", _fake_run)
+        monkeypatch.setattr(repeat, "cpu_sets", lambda count: [None] * count)
+
+        with pytest.raises(RuntimeError, match="run-0"):
+            run_all(SimpleNamespace(parallel=2), run_dirs)
+        # the failure is raised once the other run of the batch is done
+        assert os.path.exists(os.path.join(run_dirs[1], SUMMARY_FILE))
+    finally:
+        shutil.rmtree(target_dir)
@@ -0,0 +1,137 @@
+#
+# Licensed to Elasticsearch B.V. under one or more contributor
+# license agreements. See the NOTICE file distributed with
+# this work for additional information regarding copyright
+# ownership. Elasticsearch B.V. licenses this file to you under
+# the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# 	http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+import asyncio
+import time
+
+import pytest
+
+from perf8.scheduler import ProbeScheduler, Ticker
+
+
+@pytest.mark.asyncio
+async def test_slow_probe_does_not_delay_others():
+    fast_calls = []
+    slow_calls = []
+
+    def fast():
+        fast_calls.append(time.monotonic())
+
+    def slow():
+        slow_calls.append(time.monotonic())
+        time.sleep(0.35)
+
+    scheduler = ProbeScheduler(0.05)
+    scheduler.add("fast", fast)
+    scheduler.add("slow", slow)
+    scheduler.start()
+    await asyncio.sleep(1.0)
+    await scheduler.stop()
+
+    fast_stats = scheduler.stats["fast"]
+    slow_stats = scheduler.stats["slow"]
+
+    assert len(fast_calls) >= 15
+    assert fast_stats.skipped == 0
+    assert fast_stats.jitter_max < 0.05
+    assert len(slow_calls) <= 4
+    assert slow_stats.skipped > 0
+    assert slow_stats.duration_max >= 0.35
+    # sleeping does not use CPU
+    assert slow_stats.cpu_total < slow_stats.duration_total / 2
+
+
+@pytest.mark.asyncio
+async def test_probe_errors_are_counted():
+    async def broken():
+        raise ValueError("boom")
+
+    scheduler = ProbeScheduler(0.05)
+    scheduler.add("broken", broken)
+    scheduler.start()
+    await asyncio.sleep(0.2)
+    await scheduler.stop()
+
+    stats = scheduler.stats["broken"]
+    assert stats.errors == stats.ticks > 0
+
+
+@pytest.mark.asyncio
+async def test_per_probe_rates():
+    calls = {"fast": 0, "slow": 0, "default": 0}
+
+    async def probe(name):
+        calls[name] += 1
+
+    scheduler = ProbeScheduler(5.0)
+    scheduler.add("fast", probe, "fast", every=0.02)
+    scheduler.add("slow", probe, "slow", every=0.2)
+    scheduler.add("default", probe, "default")
+    scheduler.start()
+    await asyncio.sleep(1.0)
+    await scheduler.stop()
+
+    assert scheduler.stats["default"].every == 5.0
+    assert 40 <= calls["fast"] <= 52
+    assert 5 <= calls["slow"] <= 7
+    assert calls["default"] == 1
+
+
+@pytest.mark.asyncio
+async def test_disabled_probe_is_not_called():
+    calls = []
+    enabled = [True]
+
+    def probe():
+        calls.append(time.monotonic())
+
+    scheduler = ProbeScheduler(0.05)
+    scheduler.add("probe", probe, when=lambda: enabled[0])
+    scheduler.start()
+    await asyncio.sleep(0.2)
+    enabled[0] = False
+    # lets a probe started right before finish
+    await asyncio.sleep(0.05)
+    count = len(calls)
+    await asyncio.sleep(0.2)
+    await scheduler.stop()
+
+    assert count > 0
+    assert len(calls) == count
+    assert scheduler.stats["probe"].ticks == count
+
+
+@pytest.mark.asyncio
+async def test_ticker_does_not_drift():
+    loop = asyncio.get_running_loop()
+    ticker = Ticker(0.05)
+    start = loop.time()
+    for i in range(10):
+        await ticker.tick()
+        # simulates work between ticks
+        time.sleep(0.01)
+    elapsed = loop.time() - start
+    # 10 ticks with the first one at start: 9 periods + the last work
+    assert 0.45 <= elapsed < 0.5 + 0.04
+    assert ticker.missed == 0
+
+    # blocking the loop for several periods skips ticks instead of bursting
+    time.sleep(0.2)
+    await ticker.tick()
+    assert ticker.missed >= 3
+    assert ticker.deadline > loop.time()
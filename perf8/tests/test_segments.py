@@ -0,0 +1,191 @@
+#
+# Licensed to Elasticsearch B.V. under one or more contributor
+# license agreements. See the NOTICE file distributed with
+# this work for additional information regarding copyright
+# ownership. Elasticsearch B.V. licenses this file to you under
+# the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# 	http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pytest
+
+from perf8.cli import main
+from perf8 import segments
+from perf8.daemon import parse_time
+from perf8.segments import (
+    Maintenance,
+    SegmentedDatafile,
+    list_segments,
+    parse_size,
+    rollup,
+    rollup_entries,
+)
+
+
+@pytest.fixture
+def target_dir():
+    target_dir = tempfile.mkdtemp()
+    try:
+        yield target_dir
+    finally:
+        shutil.rmtree(target_dir)
+
+
+def test_rollup():
+    records = np.zeros(
+        8, dtype=[("pid", "<i8"), ("role", "<U32"), ("rss", "<i8"), ("when", "<f8")]
+    )
+    records["pid"] = [1, 2] * 4
+    records["role"] = ["main", "worker"] * 4
+    records["rss"] = [10, 100, 20, 200, 30, 300, 40, 400]
+    records["when"] = [0, 0, 1, 1, 2, 2, 3, 3]
+
+    rolled = rollup(records, 2)
+    # one record per process and per interval
+    assert rolled["pid"].tolist() == [1, 2, 1, 2]
+    assert rolled["role"].tolist() == ["main", "worker"] * 2
+    assert rolled["rss"].tolist() == [15, 150, 35, 350]
+    assert rolled["when"].tolist() == [0.5, 0.5, 2.5, 2.5]
+
+
+def test_rollup_entries():
+    timer = {"count": 2, "min": 1, "max": 3, "mean": 2, "p50": 2, "p90": 3, "p99": 3}
+    slow = {"count": 1, "min": 5, "max": 5, "mean": 5, "p50": 5, "p90": 5, "p99": 5}
+    entries = [
+        {"when": 0, "time": 100, "counters": {"c": 1}, "timers": {"t": timer}},
+        {"when": 1, "time": 101, "counters": {"c": 2}, "timers": {"t": slow}},
+        {"when": 2, "time": 102, "counters": {"c": 4}, "gauges": {"g": 7}},
+    ]
+    first, second = rollup_entries(entries, 2)
+    assert first["counters"] == {"c": 3} and second["counters"] == {"c": 4}
+    assert first["timers"]["t"]["count"] == 3
+    assert first["timers"]["t"]["mean"] == 3
+    assert first["timers"]["t"]["max"] == 5 and first["timers"]["t"]["min"] == 1
+    assert second["gauges"] == {"g": 7}
+
+
+def test_segments(target_dir):
+    root = os.path.join(target_dir, "segments")
+    directory = os.path.join(root, "report")
+    data_file = SegmentedDatafile(directory, ["value", "when"], 0.05)
+    data_file.open()
+    for i in range(20):
+        data_file.add((i, time.time()))
+        time.sleep(0.01)
+    data_file.close()
+    segments = list_segments(directory)
+    assert len(segments) > 2
+    assert data_file.load()["value"].tolist() == list(range(20))
+
+    # all segments but the current one are compacted
+    maintenance = Maintenance(root, 0.01, 1, 0, 0)
+    compacted, removed = maintenance.run(now=time.time() + 1)
+    assert compacted == len(segments) - 1 and removed == 0
+    assert [is_rollup for _, is_rollup, _ in list_segments(directory)] == [True] * (
+        len(segments) - 1
+    ) + [False]
+    assert len(data_file.load()) < 20
+
+    # the retention keeps the current segment
+    maintenance = Maintenance(root, 0, 1, 0, 1)
+    compacted, removed = maintenance.run()
+    assert removed == len(segments) - 1
+    assert len(list_segments(directory)) == 1
+
+
+def test_interrupted_compaction(target_dir, monkeypatch):
+    root = os.path.join(target_dir, "segments")
+    directory = os.path.join(root, "report")
+    os.makedirs(directory)
+    for start in (1000, 2000):
+        np.save(
+            os.path.join(directory, f"{start * 1000}.npy"),
+            np.array([(1.0, start)], dtype=[("value", "<f8"), ("when", "<f8")]),
+        )
+
+    def crash(records, interval):
+        raise OSError("No space left on device")
+
+    monkeypatch.setattr(segments, "rollup", crash)
+    with pytest.raises(OSError):
+        Maintenance(root, 1, 1, 0, 0).run(now=3000)
+    # the raw segment is still the one read
+    assert [path for _, _, path in list_segments(directory)] == [
+        os.path.join(directory, "1000000.npy"),
+        os.path.join(directory, "2000000.npy"),
+    ]
+    monkeypatch.undo()
+    assert Maintenance(root, 1, 1, 0, 0).run(now=3000) == (1, 0)
+    assert [is_rollup for _, is_rollup, _ in list_segments(directory)] == [
+        True,
+        False,
+    ]
+
+
+def test_retention_end_time(target_dir):
+    root = os.path.join(target_dir, "segments")
+    directory = os.path.join(root, "report")
+    os.makedirs(directory)
+    for start in (1000, 2000, 3000):
+        with open(os.path.join(directory, f"{start * 1000}.npy"), "wb") as f:
+            f.write(b"x")
+
+    # the first segment ends at 2000, it holds data of the last 1500s
+    assert Maintenance(root, 0, 1, 1500, 0).run(now=3100) == (0, 0)
+    assert Maintenance(root, 0, 1, 1500, 0).run(now=3600) == (0, 1)
+    assert [start for start, _, _ in list_segments(directory)] == [2000, 3000]
+
+
+def test_parse():
+    assert parse_size("10G") == 10 * 1024**3 and parse_size("512") == 512
+    assert parse_time("2h", now=10000) == 2800
+    assert parse_time("now", now=10000) == 10000
+    assert parse_time("1234.5") == 1234.5
+    assert parse_time("2023-01-06T00:00:00") > 0
+
+
+def test_daemon_report(target_dir):
+    os.environ["RANGE"] = "1000"
+    old_sys = sys.argv
+    try:
+        sys.argv = [
+            "perf8",
+            "--psutil",
+            "--psutil-tree",
+            "--daemon",
+            "--segment-duration=0.2",
+            "--refresh-rate=0.05",
+            "-t",
+            target_dir,
+            "-c",
+            os.path.join(os.path.dirname(__file__), "demo.py"),
+        ]
+        main()
+        assert os.path.exists(os.path.join(target_dir, "session.json"))
+        assert len(list_segments(os.path.join(target_dir, "segments", "report"))) > 1
+
+        sys.argv = ["perf8", "report", "-t", target_dir, "--since", "1h"]
+        html_report = main()
+        assert os.path.exists(html_report)
+        assert os.path.exists(os.path.join(os.path.dirname(html_report), "rss.png"))
+        assert os.path.exists(
+            os.path.join(os.path.dirname(html_report), "tree_uss.png")
+        )
+    finally:
+        sys.argv = old_sys
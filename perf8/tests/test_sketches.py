@@ -0,0 +1,124 @@
+#
+# Licensed to Elasticsearch B.V. under one or more contributor
+# license agreements. See the NOTICE file distributed with
+# this work for additional information regarding copyright
+# ownership. Elasticsearch B.V. licenses this file to you under
+# the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# 	http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+import json
+import math
+import os
+import random
+import shutil
+import tempfile
+
+import pytest
+
+from perf8.sketches import TimerSketch, HyperLogLog
+from perf8.statsd_server import StatsdData, StatsdProtocol
+
+
+def test_timer_sketch():
+    rnd = random.Random(8)
+    values = [rnd.lognormvariate(3, 1.5) for _ in range(100000)]
+    sketch = TimerSketch()
+    for value in values:
+        sketch.add(value)
+
+    values.sort()
+    for q in (0.5, 0.9, 0.99):
+        exact = values[int(q * (len(values) - 1))]
+        assert abs(sketch.quantile(q) - exact) <= exact * 0.011
+
+    summary = sketch.summary()
+    assert summary["count"] == 100000
+    assert summary["min"] == values[0] and summary["max"] == values[-1]
+    assert abs(summary["mean"] - sum(values) / len(values)) < 1e-6
+
+    # the number of buckets is bounded whatever the spread of values
+    small = TimerSketch(max_bins=64)
+    for i in range(1, 100000):
+        small.add(i * 1.7)
+    assert len(small.bins) == 64
+    assert abs(small.quantile(0.99) - 99000 * 1.7) < 99000 * 1.7 * 0.011
+
+    assert TimerSketch().summary() == {"count": 0}
+
+    # merging the sketches of two halves gives the sketch of the whole
+    first, second = TimerSketch(), TimerSketch()
+    for i, value in enumerate(values):
+        (first if i % 2 else second).add(value)
+    first.merge(second)
+    assert first.bins == sketch.bins
+    assert abs(first.mean - sketch.mean) < 1e-6
+    assert first.quantile(0.99) == sketch.quantile(0.99)
+
+
+def test_timer_sketch_non_finite():
+    sketch = TimerSketch()
+    sketch.add(10.0)
+    for value in (math.nan, math.inf):
+        with pytest.raises((ValueError, OverflowError)):
+            sketch.add(value)
+    # the sketch is left as it was
+    assert sketch.count == 1 and sketch.total == 10.0
+    assert sketch.min == sketch.max == 10.0
+
+
+def test_hyperloglog():
+    hll = HyperLogLog()
+    for i in range(100000):
+        hll.add(f"user-{i}".encode())
+        # duplicates are not counted
+        hll.add(f"user-{i // 2}".encode())
+    assert abs(hll.count() - 100000) < 100000 * 0.05
+
+    hll = HyperLogLog()
+    for i in range(100):
+        hll.add(i)
+    assert abs(hll.count() - 100) <= 2
+
+
+def test_statsd_flush():
+    target_dir = tempfile.mkdtemp()
+    try:
+        data = StatsdData(os.path.join(target_dir, "statsd.json"))
+        protocol = StatsdProtocol(data)
+        for i in range(1000):
+            protocol.datagram_received(f"db.query:{i}|ms".encode(), None)
+            protocol.datagram_received(f"users:{i % 10}|s".encode(), None)
+            protocol.datagram_received(b"requests:1|c", None)
+        data.flush()
+
+        with open(data.report_file) as f:
+            entry = json.loads(f.readline())
+
+        assert entry["counters"] == {"requests": 1000}
+        assert entry["sets"] == {"users": 10}
+        timer = entry["timers"]["db.query"]
+        assert timer["count"] == 1000
+        assert timer["min"] == 0 and timer["max"] == 999
+        assert abs(timer["p90"] - 899) < 10
+
+        # the run summaries cover every interval
+        for i in range(1000, 2000):
+            protocol.datagram_received(f"db.query:{i}|ms".encode(), None)
+        data.flush()
+        run = data.timer_summaries()["db.query"]
+        assert run["count"] == 2000
+        assert run["max"] == 1999
+        assert abs(run["p50"] - 1000) < 15
+        data.close()
+    finally:
+        shutil.rmtree(target_dir)
@@ -0,0 +1,72 @@
+#
+# Licensed to Elasticsearch B.V. under one or more contributor
+# license agreements. See the NOTICE file distributed with
+# this work for additional information regarding copyright
+# ownership. Elasticsearch B.V. licenses this file to you under
+# the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# 	http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+import math
+
+import pytest
+
+from perf8.stats import compare, json_safe, summarize, t_critical
+
+
+def test_summarize():
+    summary = summarize([2, 4, 4, 4, 5, 5, 7, 9])
+    assert summary["n"] == 8
+    assert summary["mean"] == 5
+    assert summary["median"] == 4.5
+    assert summary["stdev"] == pytest.approx(2.138, abs=1e-3)
+    # mean +/- t(7) * stdev / sqrt(8)
+    assert summary["ci_low"] == pytest.approx(
+        5 - 2.365 * 2.138 / math.sqrt(8), abs=1e-3
+    )
+    assert summary["ci_high"] == pytest.approx(
+        5 + 2.365 * 2.138 / math.sqrt(8), abs=1e-3
+    )
+
+    single = summarize([3])
+    assert single["median"] == single["mean"] == 3
+    assert single["ci_low"] == -math.inf and single["ci_high"] == math.inf
+
+
+def test_t_critical():
+    assert t_critical(1) == 12.706
+    assert t_critical(35.7) == t_critical(30)
+    assert t_critical(1000) == 1.96
+    assert t_critical(0) == math.inf
+
+
+def test_compare():
+    base = [10.0, 10.2, 9.8, 10.1, 9.9]
+    slower = [11.0, 11.2, 10.8, 11.1, 10.9]
+    result = compare(base, slower)
+    assert result["delta"] == pytest.approx(1.0)
+    assert result["delta_pct"] == pytest.approx(10.0)
+    assert result["significant"]
+    assert result["ci_low"] < 1.0 < result["ci_high"]
+
+    noisy = compare(base, [9.0, 11.5, 10.0, 8.9, 11.2])
+    assert not noisy["significant"]
+    assert noisy["ci_low"] < 0 < noisy["ci_high"]
+
+    assert compare([1.0, 1.0], [1.0, 1.0])["ci_high"] == 0
+
+
+def test_json_safe():
+    data = {"summary": summarize([3.0]), "values": [1.0, math.nan]}
+    assert json_safe(data)["summary"]["ci_low"] is None
+    assert json_safe(data)["summary"]["mean"] == 3.0
+    assert json_safe(data)["values"] == [1.0, None]
@@ -0,0 +1,303 @@
+#
+# Licensed to Elasticsearch B.V. under one or more contributor
+# license agreements. See the NOTICE file distributed with
+# this work for additional information regarding copyright
+# ownership. Elasticsearch B.V. licenses this file to you under
+# the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# 	http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+import asyncio
+import json
+import multiprocessing
+import os
+import shutil
+import socket
+import tempfile
+import time
+
+import numpy as np
+import pytest
+
+from perf8.logger import logger
+from perf8.plot import render_graphs
+from perf8.statsd_report import StatsdSeries, statsd_graphs
+from perf8.statsd_server import StatsdData, read_series, start
+
+BENCHMARK = "PERF8_BENCHMARK" in os.environ
+BENCHMARK_METRICS = int(os.environ.get("PERF8_BENCHMARK_STATSD_METRICS", 10000))
+BENCHMARK_INTERVALS = int(os.environ.get("PERF8_BENCHMARK_STATSD_INTERVALS", 10000))
+METRICS_PER_PACKET = 20
+
+
+def _packet(i):
+    lines = []
+    for j in range(METRICS_PER_PACKET // 4):
+        lines.append(f"app.requests:1|c|#route:/{j}")
+        lines.append(f"app.latency:{i % 500 + j}|ms|@0.5")
+        lines.append(f"app.queue:{i % 30}|g")
+        lines.append(f"app.users:{i % 1000}|s")
+    return "\n".join(lines).encode()
+
+
+def test_ingest():
+    target_dir = tempfile.mkdtemp()
+    try:
+        data = StatsdData(os.path.join(target_dir, "statsd.json"))
+        data.ingest(b"hits:2|c\nhits:1|c|@0.1\n\nlatency:10|ms|@0.5\nlatency:20|ms")
+        data.ingest(b"queue:10|g\nqueue:-3|g\nqueue:+1|g\nload:0.5|g")
+        data.ingest(b"users:alice|s\nusers:bob|s\nusers:alice|s")
+        data.ingest(b"hits:1|c|#env:prod,host:a\nhits:1|c|#host:a,env:prod")
+        data.ingest(b"garbage\nhits:x|c\nhits:1|c|@0\nhits:1|zz\n")
+
+        assert data.counters["hits"] == 12
+        assert data.counters["hits{env:prod,host:a}"] == 2
+        assert data.gauges == {"queue": 8, "load": 0.5}
+        assert data.sets["users"].count() == 2
+        assert data.timers["latency"].count == 3
+        assert data.received == 13
+        assert data.malformed == 4
+        data.close()
+    finally:
+        shutil.rmtree(target_dir)
+
+
+def test_ingest_non_finite():
+    target_dir = tempfile.mkdtemp()
+    path = os.path.join(target_dir, "statsd.json")
+    try:
+        data = StatsdData(path)
+        data.ingest(b"lat:inf|ms\nok:1|c")
+        data.ingest(b"lat:nan|ms\nlat:1e400|ms\nlat:10|ms")
+        data.ingest(b"hits:1|c|@0\nhits:1|c|@-1\nhits:1|c|@nan\nhits:2|c")
+        data.ingest(b"queue:inf|g\nqueue:5|g")
+
+        assert data.counters == {"ok": 1, "hits": 2}
+        assert data.gauges == {"queue": 5}
+        assert data.timers["lat"].summary() == {
+            "count": 1,
+            "min": 10.0,
+            "max": 10.0,
+            "mean": 10.0,
+            "p50": 10.0,
+            "p90": 10.0,
+            "p99": 10.0,
+        }
+        assert data.received == 4
+        assert data.malformed == 7
+        data.flush()
+        data.close()
+
+        def _reject(constant):
+            raise ValueError(f"{constant} is not valid JSON")
+
+        with open(path) as f:
+            for line in f:
+                json.loads(line, parse_constant=_reject)
+    finally:
+        shutil.rmtree(target_dir)
+
+
+def test_gauges_across_flushes():
+    target_dir = tempfile.mkdtemp()
+    path = os.path.join(target_dir, "statsd.json")
+    try:
+        data = StatsdData(path)
+        data.ingest(b"queue:10|g")
+        data.flush()
+        data.flush()
+        # relative to the last value, not to 0
+        data.ingest(b"queue:-3|g")
+        data.flush()
+        data.close()
+
+        with open(path) as f:
+            entries = [json.loads(line) for line in f]
+        assert [entry["gauges"]["queue"] for entry in entries[:3]] == [10, 10, 7]
+    finally:
+        shutil.rmtree(target_dir)
+
+
+def _send(port, packets, rate):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    payloads = [_packet(i) for i in range(1000)]
+    start = time.perf_counter()
+    for i in range(packets):
+        # paced so we send `rate` packets per second
+        delay = start + i / rate - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        sock.sendto(payloads[i % 1000], ("127.0.0.1", port))
+    sock.close()
+
+
+@pytest.mark.skipif(not BENCHMARK, reason="set PERF8_BENCHMARK to run")
+def test_ingest_benchmark():
+    target_dir = tempfile.mkdtemp()
+    try:
+        data = StatsdData(os.path.join(target_dir, "statsd.json"))
+        packets = [_packet(i) for i in range(1000)]
+        start = time.perf_counter()
+        for _ in range(50):
+            for packet in packets:
+                data.ingest(packet)
+        duration = time.perf_counter() - start
+        data.close()
+        rate = data.received / duration
+        print(f"Parsed {data.received} metrics at {rate:.0f} metrics/sec")
+        assert data.malformed == 0
+        assert rate >= 100000
+    finally:
+        shutil.rmtree(target_dir)
+
+
+@pytest.mark.skipif(not BENCHMARK, reason="set PERF8_BENCHMARK to run")
+def test_load_generator_benchmark():
+    # 100k metrics/sec for 3 seconds, sent from another process
+    metrics_per_sec = 100000
+    packets = 3 * metrics_per_sec // METRICS_PER_PACKET
+    port = 8126
+    target_dir = tempfile.mkdtemp()
+
+    async def _run():
+        data = StatsdData(os.path.join(target_dir, "statsd.json"))
+        transport, _ = await start(data, port)
+        sender = multiprocessing.Process(
+            target=_send, args=(port, packets, metrics_per_sec / METRICS_PER_PACKET)
+        )
+        begin = time.perf_counter()
+        sender.start()
+        while sender.is_alive():
+            await asyncio.sleep(0.1)
+            data.flush()
+        await asyncio.sleep(0.5)
+        duration = time.perf_counter() - begin
+        transport.close()
+        data.close()
+        return data, duration
+
+    try:
+        data, duration = asyncio.run(_run())
+    finally:
+        shutil.rmtree(target_dir)
+
+    expected = packets * METRICS_PER_PACKET
+    print(
+        f"Received {data.received}/{expected} metrics in {duration:.2f}s "
+        f"({data.received / duration:.0f} metrics/sec)"
+    )
+    assert data.malformed == 0
+    assert data.received == expected
+
+
+def test_statsd_graphs():
+    target_dir = tempfile.mkdtemp()
+    try:
+        data = StatsdData(os.path.join(target_dir, "statsd.json"))
+        for i in range(20):
+            data.ingest(b"app.hits:1|c\nhits:2|c\ndb.queries:3|c")
+            for value in range(100):
+                data.ingest(f"app.latency:{value + i}|ms".encode())
+            data.ingest(f"app.queue:{i}|g\napp.users:{i % 3}|s".encode())
+            data.flush()
+        data.close()
+
+        graphs = statsd_graphs(data.get_series(), target_dir)
+
+        titles = {graph.title: graph for graph in graphs}
+        assert sorted(titles) == [
+            "Statsd Counters - app",
+            "Statsd Counters - db",
+            "Statsd Counters - statsd",
+            "Statsd Gauges - app",
+            "Statsd Sets - app",
+            "Statsd Timers - app",
+        ]
+        timers = titles["Statsd Timers - app"]
+        x, y = timers.lines[0].get_xy()
+        low, high = timers.lines[0].get_band()
+        assert len(x) == len(y) == len(low) == len(high) == 20
+        assert np.all(low <= high) and np.all(y <= low)
+
+        render_graphs(logger, graphs, workers=1)
+        for graph in graphs:
+            assert os.path.exists(graph.plot_file)
+        with open(timers.series_file) as f:
+            assert '"band":{"low":' in f.read()
+    finally:
+        shutil.rmtree(target_dir)
+
+
+def test_statsd_series():
+    entries = [
+        {"when": 0, "counters": {"a": 1}, "timers": {"t": {"p50": 1, "p90": 2}}},
+        {"when": 1, "counters": {}},
+        {"when": 2, "counters": {}},
+        {"when": 3, "counters": {"a": 2}, "gauges": {"g": 5}},
+        {"when": 4},
+        {"when": 5, "gauges": {"g": 1}},
+    ]
+    series = StatsdSeries(iter(entries))
+    assert len(series) == 6
+    assert series.names["counters"] == ["a"]
+
+    x, y = series.samples("counters", "a")
+    assert list(x) == [0, 1, 2, 3, 4, 5]
+    assert list(y) == [1, 0, 0, 2, 0, 0]
+
+    # gaps are only marked at their edges
+    x, y = series.samples("gauges", "g")
+    assert list(x) == [0, 2, 3, 4, 5]
+    assert np.isnan(y[[0, 1, 3]]).all() and y[2] == 5 and y[4] == 1
+
+    x, stats = series.samples("timers", "t")
+    assert list(x) == [0, 1, 5] and stats.shape == (3, 3)
+    assert list(stats[0][:2]) == [1, 2] and np.isnan(stats[0][2])
+
+
+def _write_statsd_json(path, num_metrics, num_intervals, per_interval=100):
+    # each interval has `per_interval` counters, cycling through all names
+    with open(path, "w") as f:
+        for i in range(num_intervals):
+            first = i * per_interval
+            counters = {
+                f"ns{j % 100}.metric{j}": j
+                for j in ((first + k) % num_metrics for k in range(per_interval))
+            }
+            f.write(json.dumps({"when": i, "counters": counters}) + "\n")
+
+
+@pytest.mark.skipif(not BENCHMARK, reason="set PERF8_BENCHMARK to run")
+def test_series_loader_benchmark():
+    target_dir = tempfile.mkdtemp()
+    try:
+        durations = []
+        for scale in (2, 1):
+            path = os.path.join(target_dir, f"statsd-{scale}.json")
+            _write_statsd_json(
+                path, BENCHMARK_METRICS // scale, BENCHMARK_INTERVALS // scale
+            )
+            start = time.perf_counter()
+            series = StatsdSeries(read_series(path))
+            graphs = statsd_graphs(series, target_dir)
+            durations.append(time.perf_counter() - start)
+            assert len(series.names["counters"]) == BENCHMARK_METRICS // scale
+
+        print(
+            f"Loaded {BENCHMARK_METRICS} metrics x {BENCHMARK_INTERVALS} intervals "
+            f"and built {len(graphs)} graphs in {durations[1]:.2f}s "
+            f"(half the size: {durations[0]:.2f}s)"
+        )
+        # twice the names and intervals with the same density is 2x the data
+        assert durations[1] < durations[0] * 3
+    finally:
+        shutil.rmtree(target_dir)
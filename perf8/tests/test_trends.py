@@ -0,0 +1,134 @@
+#
+# Licensed to Elasticsearch B.V. under one or more contributor
+# license agreements. See the NOTICE file distributed with
+# this work for additional information regarding copyright
+# ownership. Elasticsearch B.V. licenses this file to you under
+# the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# 	http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+import cProfile
+import json
+import os
+import shutil
+import sys
+import tempfile
+
+import numpy as np
+import pytest
+
+from perf8.cli import main
+from perf8.datafile import Datafile
+from perf8.trends import connect, ingest, load_trends
+
+
+def _report(target_dir, created_at, duration):
+    os.makedirs(target_dir)
+    summary = {
+        "created_at": created_at,
+        "git_sha": f"sha{created_at}",
+        "success": True,
+        "duration_s": duration,
+        "command": {"wall": duration, "cpu": duration, "peak_rss": 1024},
+        "statsd": {"timers": {}},
+    }
+    with open(os.path.join(target_dir, "summary.json"), "w") as f:
+        json.dump(summary, f)
+    profiler = cProfile.Profile()
+    profiler.runcall(sorted, range(1000))
+    profiler.dump_stats(os.path.join(target_dir, "profile.data"))
+
+
+def test_ingest():
+    root = tempfile.mkdtemp()
+    db = os.path.join(root, "trends.db")
+    reports = [os.path.join(root, str(i)) for i in range(3)]
+    for i, report in enumerate(reports):
+        _report(report, 1000 + i, 10.0 + i)
+    try:
+        assert ingest(db, reports[:2]) == 2
+        # only the new report is read
+        assert ingest(db, reports) == 1
+
+        connection = connect(db)
+        try:
+            runs, metrics, profile = load_trends(connection, last=2)
+            assert [run["git_sha"] for run in runs] == ["sha1001", "sha1002"]
+            assert list(metrics["duration_s"]) == [11.0, 12.0]
+            assert profile
+            assert all(len(values) == 2 for values in profile.values())
+
+            _, metrics, _ = load_trends(connection, patterns=["dur*"])
+            assert list(metrics) == ["duration_s"]
+            assert np.array_equal(metrics["duration_s"], [10.0, 11.0, 12.0])
+        finally:
+            connection.close()
+    finally:
+        shutil.rmtree(root)
+
+
+# the mean of a series of NaN warns
+@pytest.mark.filterwarnings("ignore::RuntimeWarning")
+def test_ingest_nan_series():
+    root = tempfile.mkdtemp()
+    db = os.path.join(root, "trends.db")
+    report = os.path.join(root, "report")
+    _report(report, 1000, 10.0)
+    data_file = Datafile(os.path.join(report, "report.npy"), ("rss", "since"))
+    data_file.open()
+    for i in range(3):
+        data_file.add((np.nan, i))
+    data_file.close()
+    try:
+        assert ingest(db, [report]) == 1
+        connection = connect(db)
+        try:
+            _, metrics, _ = load_trends(connection)
+            assert "duration_s" in metrics
+            assert "rss.mean" not in metrics
+        finally:
+            connection.close()
+    finally:
+        shutil.rmtree(root)
+
+
+def test_trends():
+    root = tempfile.mkdtemp()
+    db = os.path.join(root, "trends.db")
+    report = os.path.join(root, "report")
+    os.environ["RANGE"] = "1000"
+
+    old_sys = sys.argv
+    sys.argv = [
+        "perf8",
+        "--psutil",
+        "--refresh-rate=0.1",
+        "--trends-db",
+        db,
+        "-t",
+        report,
+        "-c",
+        os.path.join(os.path.dirname(__file__), "demo.py"),
+    ]
+    try:
+        assert main()
+        with open(os.path.join(report, "summary.json")) as f:
+            assert "git_sha" in json.load(f)
+
+        target_dir = os.path.join(root, "trends")
+        sys.argv = ["perf8", "trends", report, "--db", db, "-t", target_dir]
+        assert main()
+        assert os.path.exists(os.path.join(target_dir, "trends.html"))
+        assert os.path.exists(os.path.join(target_dir, "trend_rss.peak.png"))
+    finally:
+        sys.argv = old_sys
+        shutil.rmtree(root)
@@ -32,6 +32,8 @@ async def test_watcher():
         command = os.path.join(os.path.dirname(__file__), "demo.py")
         refresh_rate = 0.1
         psutil = True
+        procfs = False
+        cgroup = False
         cprofile = True
         memray = False
         asyncstats = False
@@ -49,7 +51,10 @@ async def test_watcher():
         watcher = WatchedProcess(Args())
 
         await watcher.run()
-        assert os.path.exists(os.path.join(Args.target_dir, "index.html"))
+        index = os.path.join(Args.target_dir, "index.html")
+        assert os.path.exists(index)
+        with open(index) as f:
+            assert "perf8 overhead" in f.read()
     finally:
         shutil.rmtree(Args.target_dir)
 
@@ -62,6 +67,8 @@ async def test_async_watcher():
         command = os.path.join(os.path.dirname(__file__), "ademo.py")
         refresh_rate = 0.1
         psutil = True
+        procfs = False
+        cgroup = False
         cprofile = False
         memray = False
         asyncstats = True
@@ -0,0 +1,322 @@
+#
+# Licensed to Elasticsearch B.V. under one or more contributor
+# license agreements. See the NOTICE file distributed with
+# this work for additional information regarding copyright
+# ownership. Elasticsearch B.V. licenses this file to you under
+# the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# 	http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+"""
+Trends -- the history of many reports in a SQLite database.
+
+A report is ingested once: its metrics, the same as `perf8 compare`
+uses, the functions with the most own time in its cProfile data and its
+metadata (git commit, arguments, system info) are stored, and the
+report files are not read again. A report made with --repeat is stored
+as the median of its runs.
+
+`perf8 trends` ingests the reports it's given, then draws each metric
+over the last runs in <target_dir>/trends.html, from the database only.
+Runs are ingested at the end of a run with --trends-db.
+"""
+
+import datetime
+import json
+import math
+import os
+import re
+import sqlite3
+from collections import defaultdict
+from fnmatch import fnmatch
+
+import numpy as np
+from jinja2 import Environment, FileSystemLoader
+
+from perf8 import __version__
+from perf8 import stats
+from perf8.compare import load_run, mean_profile, run_dirs, unit, unit_formatter
+from perf8.logger import logger
+from perf8.plot import Graph, Line
+from perf8.repeat import SUMMARY_FILE
+
+HERE = os.path.dirname(__file__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    title TEXT,
+    version TEXT,
+    git_sha TEXT,
+    success INTEGER,
+    runs INTEGER NOT NULL,
+    arguments TEXT,
+    system_info TEXT,
+    UNIQUE (path, created_at)
+);
+CREATE INDEX IF NOT EXISTS runs_created_at ON runs (created_at);
+CREATE TABLE IF NOT EXISTS metrics (
+    run_id INTEGER NOT NULL REFERENCES runs (id),
+    name TEXT NOT NULL,
+    value REAL NOT NULL,
+    PRIMARY KEY (run_id, name)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS profile (
+    run_id INTEGER NOT NULL REFERENCES runs (id),
+    function TEXT NOT NULL,
+    calls REAL NOT NULL,
+    tottime REAL NOT NULL,
+    cumtime REAL NOT NULL,
+    PRIMARY KEY (run_id, function)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS profile_function ON profile (function, run_id);
+"""
+
+RECENT = "SELECT id FROM runs WHERE created_at >= ?"
+
+# functions of the last run drawn in the cProfile graph
+PROFILE_LINES = 5
+COLORS = ("b", "r", "g", "m", "c", "y", "k")
+
+
+def connect(db_path):
+    connection = sqlite3.connect(db_path)
+    connection.executescript(SCHEMA)
+    return connection
+
+
+def _load_json(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def ingest_report(connection, report_dir, profile_top=20):
+    """Stores a report, returns False if it was already there."""
+    report_dir = os.path.abspath(report_dir)
+    dirs = run_dirs(report_dir)
+    summary = _load_json(os.path.join(dirs[0], SUMMARY_FILE))
+    known = connection.execute(
+        "SELECT 1 FROM runs WHERE path = ? AND created_at = ?",
+        (report_dir, summary["created_at"]),
+    ).fetchone()
+    if known:
+        return False
+
+    success = summary.get("success")
+    repeat_json = os.path.join(report_dir, "repeat.json")
+    if os.path.exists(repeat_json):
+        success = _load_json(repeat_json)["success"]
+
+    runs = [load_run(run) for run in dirs]
+    metrics = [
+        (name, stats.median([run["metrics"][name] for run in runs]))
+        for name in runs[0]["metrics"]
+        if all(name in run["metrics"] for run in runs)
+    ]
+    # e.g. the mean of a series of NaN, SQLite would store NULL
+    metrics = [(name, value) for name, value in metrics if math.isfinite(value)]
+    profile = sorted(
+        mean_profile([run["profile"] for run in runs]).items(),
+        key=lambda item: item[1]["tottime"],
+        reverse=True,
+    )[:profile_top]
+
+    with connection:
+        run_id = connection.execute(
+            "INSERT INTO runs (path, created_at, title, version, git_sha, success,"
+            " runs, arguments, system_info) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                report_dir,
+                summary["created_at"],
+                summary.get("title"),
+                summary.get("version"),
+                summary.get("git_sha"),
+                success,
+                len(runs),
+                json.dumps(summary.get("arguments")),
+                json.dumps(summary.get("system_info")),
+            ),
+        ).lastrowid
+        connection.executemany(
+            "INSERT INTO metrics (run_id, name, value) VALUES (?, ?, ?)",
+            [(run_id, name, value) for name, value in metrics],
+        )
+        connection.executemany(
+            "INSERT INTO profile (run_id, function, calls, tottime, cumtime)"
+            " VALUES (?, ?, ?, ?, ?)",
+            [
+                (run_id, func, entry["calls"], entry["tottime"], entry["cumtime"])
+                for func, entry in profile
+            ],
+        )
+    return True
+
+
+def ingest(db_path, report_dirs, profile_top=20):
+    """Stores the reports that are not in the database yet."""
+    connection = connect(db_path)
+    ingested = 0
+    try:
+        for report_dir in report_dirs:
+            try:
+                if ingest_report(connection, report_dir, profile_top):
+                    ingested += 1
+                    logger.info(f"[trends] Ingested {report_dir}")
+                else:
+                    logger.debug(f"[trends] {report_dir} is already ingested")
+            except (OSError, ValueError, KeyError, sqlite3.Error) as e:
+                logger.warning(f"[trends] Can't ingest {report_dir}: {e!r}")
+    finally:
+        connection.close()
+    return ingested
+
+
+def load_trends(connection, last=None, patterns=None):
+    """Returns the last runs, the values of each metric for those runs, and
+    the own time of the functions that took the most in the last one.
+
+    Values are aligned with the runs, NaN when a run lacks the metric.
+    """
+    runs = connection.execute(
+        "SELECT id, path, created_at, title, git_sha, success, runs FROM runs"
+        " ORDER BY created_at DESC LIMIT ?",
+        (last or -1,),
+    ).fetchall()
+    runs.reverse()
+    if not runs:
+        return [], {}, {}
+    index = {run[0]: i for i, run in enumerate(runs)}
+    # the last runs, found with the index on created_at
+    recent = (runs[0][2],)
+
+    metrics = defaultdict(lambda: np.full(len(runs), np.nan))
+    for run_id, name, value in connection.execute(
+        f"SELECT run_id, name, value FROM metrics WHERE run_id IN ({RECENT})", recent
+    ):
+        if run_id not in index:
+            continue
+        if patterns and not any(fnmatch(name, pattern) for pattern in patterns):
+            continue
+        metrics[name][index[run_id]] = value
+
+    functions = [
+        row[0]
+        for row in connection.execute(
+            "SELECT function FROM profile WHERE run_id = ?"
+            " ORDER BY tottime DESC LIMIT ?",
+            (runs[-1][0], PROFILE_LINES),
+        )
+    ]
+    profile = {func: np.full(len(runs), np.nan) for func in functions}
+    if functions:
+        marks = ", ".join("?" * len(functions))
+        for run_id, func, tottime in connection.execute(
+            f"SELECT run_id, function, tottime FROM profile"
+            f" WHERE function IN ({marks}) AND run_id IN ({RECENT})",
+            (*functions, *recent),
+        ):
+            if run_id in index:
+                profile[func][index[run_id]] = tottime
+
+    return (
+        [
+            {
+                "number": i + 1,
+                "path": path,
+                "created_at": datetime.datetime.fromtimestamp(created_at).strftime(
+                    "%d-%m-%y %H:%M:%S"
+                ),
+                "title": title,
+                "git_sha": git_sha,
+                "success": success,
+                "runs": count,
+            }
+            for i, (_, path, created_at, title, git_sha, success, count) in enumerate(
+                runs
+            )
+        ],
+        dict(sorted(metrics.items())),
+        profile,
+    )
+
+
+def trend_graphs(runs, metrics, profile, target_dir):
+    x = np.array([run["number"] for run in runs])
+    graphs = []
+    for name, values in metrics.items():
+        graphs.append(
+            Graph(
+                name,
+                target_dir,
+                "trend_" + re.sub(r"[^\w.-]", "_", name) + ".png",
+                name,
+                unit_formatter(unit(name)),
+                Line((x, values), name, None, "b"),
+                xlabel="Run",
+            )
+        )
+    if profile:
+        graphs.append(
+            Graph(
+                "cProfile own time",
+                target_dir,
+                "trend_profile.png",
+                "Seconds",
+                None,
+                *(
+                    Line((x, values), func, None, color)
+                    for (func, values), color in zip(profile.items(), COLORS)
+                ),
+                xlabel="Run",
+            )
+        )
+    for graph in graphs:
+        graph.render()
+    return graphs
+
+
+def render(args, runs, graphs):
+    environment = Environment(loader=FileSystemLoader(os.path.join(HERE, "templates")))
+    template = environment.get_template("trends.html")
+    content = template.render(
+        args=args,
+        version=__version__,
+        created_at=datetime.datetime.now().strftime("%d-%m-%y %H:%M:%S"),
+        runs=runs,
+        graphs=[{"title": graph.title, "file": graph.target_file} for graph in graphs],
+    )
+    target = os.path.join(args.target_dir, "trends.html")
+    with open(target, "w") as f:
+        f.write(content)
+    return target
+
+
+def trends(args):
+    """Ingests the given reports and draws the trends of the last runs."""
+    if args.reports:
+        ingest(args.db, args.reports, args.profile_top)
+
+    connection = connect(args.db)
+    try:
+        runs, metrics, profile = load_trends(connection, args.last, args.metric)
+    finally:
+        connection.close()
+    if not runs:
+        logger.warning(f"[trends] No run in {args.db}")
+        return False
+
+    os.makedirs(args.target_dir, exist_ok=True)
+    graphs = trend_graphs(runs, metrics, profile, args.target_dir)
+    logger.info(f"Find the trends of {len(runs)} runs at {render(args, runs, graphs)}")
+    return True
@@ -28,10 +28,15 @@ from collections import defaultdict
 
 import humanize
 
-from perf8.plugins.base import get_registered_plugins
+from perf8.plugins.base import BasePlugin, get_registered_plugins
 from perf8.reporter import Reporter
 from perf8.logger import logger
 from perf8.statsd_server import start, StatsdData
+from perf8.scheduler import ProbeScheduler
+from perf8.segments import Maintenance, segments_dir, SEGMENTS_DIR
+from perf8.daemon import save_session
+from perf8.live import LiveServer, plugin_graphs
+from perf8.overhead import OverheadTracker, load_run_summary
 
 
 HERE = os.path.dirname(__file__)
@@ -57,8 +62,13 @@ class WatchedProcess:
         signal.signal(signal.SIGTERM, self.exit)
         signal.signal(signal.SIGUSR1, self.runner_exit)
         self.started = False
+        self.runner_done = False
         self.stats_server = None
         self.stats_data = None
+        self.scheduler = None
+        self.live_server = None
+        self.overhead = OverheadTracker()
+        self.execution_info = None
 
     def exit(self, signum, frame):
         logger.info(f"We got a {signum} signal, passing it along")
@@ -67,36 +77,73 @@ class WatchedProcess:
     def runner_exit(self, signum, frame):
         logger.info(f"We got a {signum} signal, the app finished execution")
         logger.info("The app wrapper is now building in-process reports")
-        # we can stop out of process plugins
-        self.stop()
+        # the probing loop will stop out of process plugins
+        self.runner_done = True
+
+    async def _flush_statsd(self):
+        logger.debug("Flushing statsd")
+        self.stats_data.flush()
 
     async def _probe(self):
-        logger.info(f"Starting the probing -- every {self.every} seconds")
+        self.scheduler = ProbeScheduler(self.every)
 
-        while self.started:
-            for plugin in self.out_plugins:
-                if not plugin.enabled:
-                    continue
-                await plugin.probe(self.pid)
-                logger.debug(f"Sent a probe to {plugin.name}")
+        for plugin in self.out_plugins:
+            if type(plugin).probe is BasePlugin.probe or not plugin.enabled:
+                continue
+            logger.info(f"Probing {plugin.name} every {plugin.rate} seconds")
+            self.scheduler.add(
+                plugin.name,
+                plugin.probe,
+                self.pid,
+                every=plugin.rate,
+                when=lambda plugin=plugin: plugin.enabled,
+            )
 
-            if self.stats_data is not None:
-                logger.debug("Flushing statsd")
-                self.stats_data.flush()
+        if self.stats_data is not None:
+            statsd_rate = getattr(self.args, "statsd_rate", None) or self.every
+            logger.info(f"Flushing statsd every {statsd_rate} seconds")
+            self.scheduler.add("statsd", self._flush_statsd, every=statsd_rate)
 
-            if self.proc.poll() is not None:
-                break
+        if getattr(self.args, "daemon", False):
+            maintenance = Maintenance(
+                os.path.join(self.args.target_dir, SEGMENTS_DIR),
+                self.args.rollup_after,
+                self.args.rollup_interval,
+                self.args.retention,
+                self.args.retention_size,
+            )
+            self.scheduler.add(
+                "segments",
+                maintenance.run,
+                every=min(self.args.segment_duration, 60.0),
+            )
 
-            await asyncio.sleep(self.every)
+        self.scheduler.start()
+        try:
+            while self.started and not self.runner_done and self.proc.poll() is None:
+                await asyncio.sleep(min(self.every, 0.1))
+        finally:
+            await self.scheduler.stop()
+
+        self.stop()
 
     def start(self):
         logger.info(f"[perf8] Plugins: {', '.join([p.name for p in self.plugins])}")
         self.started = True
+        daemon = getattr(self.args, "daemon", False)
+        if daemon:
+            save_session(self.args)
         for plugin in self.out_plugins:
             plugin.start(self.pid)
         if self.args.statsd:
             statsd_json = os.path.join(self.args.target_dir, "statsd.json")
-            self.stats_data = StatsdData(statsd_json)
+            if daemon:
+                self.stats_data = StatsdData(
+                    segments_dir(self.args.target_dir, statsd_json),
+                    self.args.segment_duration,
+                )
+            else:
+                self.stats_data = StatsdData(statsd_json)
             logger.info(f"Listening to statsd events on port {self.args.statsd_port}")
             self.stats_server = asyncio.create_task(
                 start(self.stats_data, self.args.statsd_port)
@@ -107,7 +154,8 @@ class WatchedProcess:
             return
         try:
             for plugin in self.out_plugins:
-                self.out_reports[plugin.name].extend(plugin.stop(self.pid))
+                with self.overhead.measure(f"{plugin.name} report"):
+                    self.out_reports[plugin.name].extend(plugin.stop(self.pid))
         finally:
             self.started = False
 
@@ -128,6 +176,10 @@ class WatchedProcess:
         if len(plugins) > 0:
             cmd.extend(["--plugins", ",".join(plugins)])
 
+        plot_points = getattr(self.args, "plot_points", None)
+        if plot_points is not None:
+            cmd.extend(["--plot-points", plot_points])
+
         cmd.extend(["-s", self.cmd])
         cmd = [str(item) for item in cmd]
 
@@ -140,24 +192,56 @@ class WatchedProcess:
             self.pid = self.proc.pid
             self.start()
 
+            live_port = getattr(self.args, "live_port", None)
+            if live_port is not None:
+                self.live_server = LiveServer(
+                    self.args.target_dir,
+                    live_port,
+                    interval=min(self.every, 1.0),
+                    graphs=plugin_graphs(self.out_plugins),
+                    title=getattr(self.args, "title", "Performance Report"),
+                    started_at=start,
+                )
+                await self.live_server.start()
+                logger.info(f"Live series at {self.live_server.url}")
+
             await self._probe()
             execution_time = time.time() - start
             logger.info(f"Command execution time {execution_time:.2f} seconds.")
         finally:
+            if self.live_server is not None:
+                await self.live_server.close()
             if self.stats_server is not None:
                 await self.stats_server
                 transport, proto = self.stats_server.result()
                 transport.close()
                 self.stats_data.close()
+                logger.info(
+                    f"Received {self.stats_data.received} statsd metrics "
+                    f"({self.stats_data.malformed} malformed)"
+                )
             self.stop()
 
         self.proc.wait()
 
+        report_json = os.path.join(self.args.target_dir, "report.json")
+        run_summary = load_run_summary(report_json)
+        self.overhead.add_probes(self.scheduler.stats)
+        overhead = self.overhead.summary(run_summary.get("overhead", []))
+        if overhead["ratio"] is not None:
+            logger.info(
+                f"perf8 used {overhead['perf8_cpu']:.2f}s of CPU, "
+                f"{overhead['ratio']:.1%} of the command CPU time"
+            )
+
         execution_info = {
             "duration": humanize.precisedelta(execution_time),
             "duration_s": execution_time,
+            "probes": [stats.as_dict() for stats in self.scheduler.stats.values()],
+            "overhead": overhead,
+            "command": run_summary.get("command"),
         }
-        report_json = os.path.join(self.args.target_dir, "report.json")
+        self.execution_info = execution_info
         reporter = Reporter(self.args, execution_info, self.stats_data)
         html_report = reporter.generate(report_json, self.out_reports, self.plugins)
         logger.info(f"Find the full report at {html_report}")